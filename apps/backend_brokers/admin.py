@@ -1,6 +1,14 @@
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
-from .models import Profile, Wallet, Transaction, ExchangeRate
+from .models import (
+    Profile,
+    Wallet,
+    Transaction,
+    Posting,
+    ExchangeRate,
+    LatestRate,
+    RateFetchLog,
+)
 
 
 class WalletInline(admin.TabularInline):
@@ -8,6 +16,12 @@ class WalletInline(admin.TabularInline):
     extra = 0
 
 
+class PostingInline(admin.TabularInline):
+    model = Posting
+    extra = 0
+    raw_id_fields = ("wallet",)
+
+
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ("user", "account_type", "phone_number")
@@ -29,6 +43,8 @@ class TransactionAdmin(admin.ModelAdmin):
     )
     search_fields = ("user__user__username", "from_currency", "to_currency")
     list_filter = ("created_at", "from_currency", "to_currency", "visible_to")
+    raw_id_fields = ("source_wallet", "destination_wallet")
+    inlines = [PostingInline]
 
 
 @admin.register(ExchangeRate)
@@ -38,6 +54,12 @@ class ExchangeRateAdmin(admin.ModelAdmin):
     search_fields = ("currency",)
 
 
+@admin.register(LatestRate)
+class LatestRateAdmin(admin.ModelAdmin):
+    list_display = ("currency", "rate", "date")
+    search_fields = ("currency",)
+
+
 @admin.register(Wallet)
 class WalletAdmin(admin.ModelAdmin):
     list_display = (
@@ -49,3 +71,15 @@ class WalletAdmin(admin.ModelAdmin):
     )
     search_fields = ("user__user__username",)
     list_filter = ("user", "currency", "wallet_status")
+
+
+@admin.register(RateFetchLog)
+class RateFetchLogAdmin(admin.ModelAdmin):
+    list_display = (
+        "started_at",
+        "status",
+        "latency_ms",
+        "effective_date",
+        "rows_changed",
+    )
+    list_filter = ("status",)
@@ -0,0 +1,148 @@
+"""
+Wallet balances at a point in the past.
+
+take_checkpoints() runs once a day (the take_balance_checkpoints command) and
+stores the ledger balance at midnight of every wallet that had postings since
+the previous run. balance_as_of() then reads the nearest checkpoint before the
+requested moment and adds the few postings in between, instead of replaying
+the wallet's whole history.
+"""
+
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import BalanceCheckpoint, Posting, Transaction, Wallet
+
+
+def last_midnight():
+    return timezone.make_aware(datetime.combine(timezone.localdate(), time()))
+
+
+def _total(postings):
+    return postings.aggregate(
+        total=Coalesce(
+            Sum("amount"),
+            Value(Decimal(0)),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+    )["total"]
+
+
+def take_checkpoints(as_of=None):
+    """
+    Writes a checkpoint at *as_of* (the last midnight by default) for every
+    wallet with postings since the previous run. Returns the number written.
+    """
+    as_of = as_of or last_midnight()
+    previous = (
+        BalanceCheckpoint.objects.order_by("-id")
+        .values("as_of", "last_entry_id")
+        .first()
+    )
+    if previous and previous["as_of"] >= as_of:
+        return 0
+    previous_entry = previous["last_entry_id"] if previous else 0
+
+    with transaction.atomic():
+        # ids grow with created_at, so this walks back over today's entries only
+        last_entry = (
+            Transaction.objects.filter(created_at__lt=as_of)
+            .order_by("-id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        if last_entry is None or last_entry <= previous_entry:
+            return 0
+        changes = dict(
+            Posting.objects.filter(
+                entry_id__gt=previous_entry,
+                entry_id__lte=last_entry,
+                wallet__isnull=False,
+            )
+            .values("wallet")
+            .annotate(total=Sum("amount"))
+            .values_list("wallet", "total")
+            .order_by()
+        )
+        latest = BalanceCheckpoint.objects.filter(wallet=OuterRef("pk")).order_by(
+            "-as_of"
+        )
+        wallets = Wallet.objects.filter(pk__in=changes).annotate(
+            checkpoint=Subquery(latest.values("balance")[:1])
+        )
+
+        checkpoints = []
+        first = []  # wallets checkpointed for the first time
+        for wallet in wallets:
+            if wallet.checkpoint is None:
+                first.append(wallet)
+                continue
+            checkpoints.append(
+                BalanceCheckpoint(
+                    wallet=wallet,
+                    as_of=as_of,
+                    last_entry_id=last_entry,
+                    balance=wallet.checkpoint + changes[wallet.pk],
+                )
+            )
+        if first:
+            # the balance column is the ledger balance now, less the house
+            # legs not swept yet; take back what was booked after as_of
+            adjustments = (
+                Posting.objects.filter(wallet__in=first)
+                .values("wallet")
+                .annotate(
+                    pending=Sum("amount", filter=Q(pending=True)),
+                    later=Sum("amount", filter=Q(entry_id__gt=last_entry)),
+                )
+                .order_by()
+            )
+            adjustments = {row["wallet"]: row for row in adjustments}
+            for wallet in first:
+                row = adjustments[wallet.pk]
+                checkpoints.append(
+                    BalanceCheckpoint(
+                        wallet=wallet,
+                        as_of=as_of,
+                        last_entry_id=last_entry,
+                        balance=wallet.balance
+                        + (row["pending"] or 0)
+                        - (row["later"] or 0),
+                    )
+                )
+        BalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=1000)
+    return len(checkpoints)
+
+
+def balance_as_of(wallet, moment):
+    """
+    Returns the ledger balance of *wallet* just before *moment*.
+    """
+    postings = Posting.objects.filter(wallet=wallet)
+    checkpoint = wallet.checkpoints.filter(as_of__lte=moment).order_by("-as_of").first()
+    if checkpoint is not None:
+        return checkpoint.balance + _total(
+            postings.filter(
+                entry_id__gt=checkpoint.last_entry_id, entry__created_at__lt=moment
+            )
+        )
+
+    # before the first checkpoint: work back from it, or from the live balance
+    checkpoint = wallet.checkpoints.order_by("as_of").first()
+    if checkpoint is not None:
+        return checkpoint.balance - _total(
+            postings.filter(
+                entry_id__lte=checkpoint.last_entry_id, entry__created_at__gte=moment
+            )
+        )
+    balance = Wallet.objects.values_list("balance", flat=True).get(pk=wallet.pk)
+    return (
+        balance
+        + _total(postings.filter(pending=True))
+        - _total(postings.filter(entry__created_at__gte=moment))
+    )
@@ -0,0 +1,94 @@
+"""
+Per-profile monthly exchange counters, which decide whether the promotional
+spread still applies. They are updated in the transaction that records the
+exchanges, so reading one is a lookup on the (profile, month) index instead
+of counting the month's transactions.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import MonthlyTransactionCounter, Transaction
+from .table_locks import lock_table
+
+
+def current_month():
+    return timezone.localdate().replace(day=1)
+
+
+def transactions_this_month(profile_id):
+    """
+    Returns the number of exchanges the profile made this month.
+    """
+    count = (
+        MonthlyTransactionCounter.objects.filter(
+            profile_id=profile_id, month=current_month()
+        )
+        .values_list("count", flat=True)
+        .first()
+    )
+    return count or 0
+
+
+def transactions_this_month_by_profile(profile_ids):
+    """
+    Returns {profile id: number of exchanges this month} for *profile_ids*,
+    leaving out the profiles that made none.
+    """
+    return dict(
+        MonthlyTransactionCounter.objects.filter(
+            profile_id__in=profile_ids, month=current_month()
+        ).values_list("profile_id", "count")
+    )
+
+
+def record_transactions(counts):
+    """
+    Adds {profile id: number of exchanges} to this month's counters. Call it
+    in the transaction that writes the exchanges.
+    """
+    month = current_month()
+    for profile_id, count in counts.items():
+        counter = MonthlyTransactionCounter.objects.filter(
+            profile_id=profile_id, month=month
+        )
+        if counter.update(count=F("count") + count):
+            continue
+        try:
+            with transaction.atomic():
+                MonthlyTransactionCounter.objects.create(
+                    profile_id=profile_id, month=month, count=count
+                )
+        except IntegrityError:
+            # created by a concurrent transfer in the meantime
+            counter.update(count=F("count") + count)
+
+
+def rebuild_counters():
+    """
+    Recomputes every counter from the Transaction history. Returns the number
+    of counters written. Transfers wait for it, as the counters are locked
+    while the history is read.
+    """
+    with transaction.atomic():
+        lock_table(MonthlyTransactionCounter)
+        rows = (
+            Transaction.objects.filter(visible_to="user")
+            .annotate(month=TruncMonth("created_at"))
+            .values("user_id", "month")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+        counters = [
+            MonthlyTransactionCounter(
+                profile_id=row["user_id"],
+                month=timezone.localtime(row["month"]).date(),
+                count=row["count"],
+            )
+            for row in rows
+        ]
+        MonthlyTransactionCounter.objects.all().delete()
+        MonthlyTransactionCounter.objects.bulk_create(counters, batch_size=1000)
+    return len(counters)
@@ -0,0 +1,77 @@
+"""
+Cross rates between every pair of supported currencies.
+
+The matrix is built from the table the rate cache holds, each time the
+cache loads one, and stored as flat lists indexed by currency ordinal, so a
+conversion reads its rate with a single lookup instead of two database
+queries.
+"""
+
+import threading
+from decimal import Decimal
+
+from .models import Wallet
+from .rate_cache import rate_cache
+
+SPREAD_PROMO = Decimal("0.01")
+SPREAD_STANDARD = Decimal("0.02")
+SPREAD_TIERS = (SPREAD_PROMO, SPREAD_STANDARD)
+
+CURRENCIES = [code for code, _ in Wallet.SELECTABLE_CURRENCIES]
+CURRENCY_INDEX = {code: i for i, code in enumerate(CURRENCIES)}
+
+
+class CrossRateMatrix:
+    def __init__(self, rates, effective_date):
+        """
+        *rates* maps currency to its rate in PLN, as the rate cache holds
+        them; pairs with a currency missing from it have no rate.
+        """
+        self.source = rates
+        self.effective_date = effective_date
+        rates = {code: Decimal(str(rate)) for code, rate in (rates or {}).items()}
+        size = len(CURRENCIES)
+        self.mid = [None] * (size * size)
+        self.with_spread = {spread: [None] * (size * size) for spread in SPREAD_TIERS}
+
+        for i, source in enumerate(CURRENCIES):
+            for j, destination in enumerate(CURRENCIES):
+                if source not in rates or destination not in rates:
+                    continue
+                k = i * size + j
+                self.mid[k] = rates[source] / rates[destination]
+                for spread, table in self.with_spread.items():
+                    table[k] = self.mid[k] * (1 - spread)
+
+    def quote(self, source, destination, spread):
+        """
+        Returns (mid_rate, rate_after_spread) for converting *source* into
+        *destination*, or (None, None) if either currency has no rate.
+        """
+        try:
+            k = CURRENCY_INDEX[source] * len(CURRENCIES) + CURRENCY_INDEX[destination]
+        except KeyError:
+            return None, None
+        return self.mid[k], self.with_spread[spread][k]
+
+
+_lock = threading.Lock()
+_matrix = None
+
+
+def get_cross_rates():
+    """
+    Returns the CrossRateMatrix of the table in the rate cache, rebuilding it
+    whenever the cache has loaded new rates: a new publication, a correction
+    of the current one, or the stored table replacing the snapshot read on a
+    cold start.
+    """
+    global _matrix
+    rates, effective_date = rate_cache.get()
+    matrix = _matrix
+    if matrix is None or matrix.source is not rates:
+        with _lock:
+            if _matrix is None or _matrix.source is not rates:
+                _matrix = CrossRateMatrix(rates, effective_date)
+            matrix = _matrix
+    return matrix
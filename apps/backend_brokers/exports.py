@@ -0,0 +1,133 @@
+"""
+CSV and NDJSON export of transaction history.
+
+Rows are read with .values().iterator(), so the database hands them over in
+chunks and no model instances are built, and each row is encoded and sent
+before the next chunk is read: memory use does not depend on the number of
+rows. Gzip is applied to the stream as it goes.
+"""
+
+import csv
+import json
+import zlib
+from datetime import date, datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .history import wallet_transactions
+from .models import Transaction
+
+FIELDS = (
+    "id",
+    "created_at",
+    "source_iban",
+    "destination_iban",
+    "from_currency",
+    "to_currency",
+    "amount",
+    "rate",
+    "result_amount",
+    "visible_to",
+)
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+CHUNK_SIZE = 2000
+# compressed output is sent once at least this much has built up
+GZIP_FLUSH_SIZE = 64 * 1024
+
+
+def date_range(params):
+    """
+    Returns the created_at filter for the "from" and "to" dates (YYYY-MM-DD,
+    both inclusive) in *params*. Raises ValueError for a malformed date.
+    """
+    filters = {}
+    if params.get("from"):
+        day = date.fromisoformat(params["from"])
+        filters["created_at__gte"] = timezone.make_aware(datetime.combine(day, time()))
+    if params.get("to"):
+        day = date.fromisoformat(params["to"]) + timedelta(days=1)
+        filters["created_at__lt"] = timezone.make_aware(datetime.combine(day, time()))
+    return filters
+
+
+def wallet_rows(wallet, filters):
+    return (
+        wallet_transactions(wallet, **filters)
+        .values(*FIELDS)
+        .order_by("created_at", "id")
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def profile_rows(profile, filters):
+    return (
+        Transaction.objects.filter(user=profile, **filters)
+        .values(*FIELDS)
+        .order_by("created_at", "id")
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+class _Line:
+    """
+    File-like object for csv.writer that hands back the line it was given.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        row["created_at"] = row["created_at"].isoformat()
+        yield writer.writerow([row[field] for field in FIELDS])
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Tells whether the Accept-Encoding header value *accept_encoding* allows
+    gzip: named, or covered by "*", with a q-value above zero.
+    """
+    weights = {}
+    for coding in accept_encoding.split(","):
+        name, *params = coding.split(";")
+        weight = 1.0
+        for param in params:
+            key, _sep, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    return weights.get("gzip", weights.get("*", 0.0)) > 0
+
+
+def gzip_stream(lines):
+    """
+    Gzips the text *lines* on the fly, yielding compressed chunks.
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    pending = []
+    size = 0
+    for line in lines:
+        data = compressor.compress(line.encode())
+        if data:
+            pending.append(data)
+            size += len(data)
+        if size >= GZIP_FLUSH_SIZE:
+            yield b"".join(pending)
+            pending, size = [], 0
+    pending.append(compressor.flush())
+    yield b"".join(pending)
@@ -1,3 +1,5 @@
+from uuid import uuid4
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
@@ -105,6 +107,13 @@ class TransferForm(forms.Form):
         queryset=Wallet.objects.none(), label=_("Konto docelowe")
     )
     amount = forms.DecimalField(max_digits=10, decimal_places=2, label=_("Kwota"))
+    # a new key for every rendered form; resubmitting the same form sends it again
+    idempotency_key = forms.CharField(
+        widget=forms.HiddenInput,
+        required=False,
+        max_length=64,
+        initial=lambda: uuid4().hex,
+    )
 
     def __init__(self, user, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -116,6 +125,13 @@ class TransferForm(forms.Form):
 class DepositForm(forms.Form):
     wallet = forms.ModelChoiceField(queryset=Wallet.objects.none(), label=_("Portfel"))
     amount = forms.DecimalField(max_digits=12, decimal_places=2, min_value=0.01, label=_("Kwota"))
+    # a new key for every rendered form; resubmitting the same form sends it again
+    idempotency_key = forms.CharField(
+        widget=forms.HiddenInput,
+        required=False,
+        max_length=64,
+        initial=lambda: uuid4().hex,
+    )
 
     def __init__(self, user, *args, **kwargs):
         super().__init__(*args, **kwargs)
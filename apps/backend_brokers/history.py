@@ -0,0 +1,127 @@
+"""
+Wallet history, newest first, in pages of a fixed size.
+
+Pages are cut with a keyset cursor on (created_at, id) instead of an offset,
+so a page deep in the history costs the same as the first one.
+The wallet foreign keys of older transactions were filled in by migration
+0026; link_wallets() (the link_transaction_wallets command) links the ones
+written by servers still running the previous release during a deploy.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Transaction, Wallet, WalletLinkProgress
+
+PAGE_SIZE = 20
+LINK_BATCH_SIZE = 1000
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_cursor(entry):
+    """
+    Returns the cursor pointing just past *entry*: microseconds since the
+    epoch and the id.
+    """
+    micros = (entry.created_at - EPOCH) // timedelta(microseconds=1)
+    return f"{micros}-{entry.pk}"
+
+
+def decode_cursor(cursor):
+    """
+    Returns (created_at, id) of *cursor*, raises ValueError if it is malformed.
+    """
+    micros, pk = cursor.split("-")
+    try:
+        created_at = EPOCH + timedelta(microseconds=int(micros))
+    except OverflowError:
+        raise ValueError(f"cursor out of range: {cursor}")
+    return created_at, int(pk)
+
+
+def wallet_transactions(wallet, *args, **kwargs):
+    """
+    Returns the transactions of *wallet* matching the filter arguments, as a
+    UNION ALL of the source and destination wallet foreign key scans. Both
+    indexes end in (created_at, id), so ordering by those is a merge.
+    """
+    return (
+        Transaction.objects.filter(source_wallet=wallet)
+        .filter(*args, **kwargs)
+        .union(
+            Transaction.objects.filter(destination_wallet=wallet).filter(
+                *args, **kwargs
+            ),
+            all=True,
+        )
+    )
+
+
+def history_page(wallet, cursor=None, size=PAGE_SIZE):
+    """
+    Returns (transactions, next_cursor) for the page of *wallet*'s history
+    after *cursor* (the first page if None). next_cursor is None on the last
+    page. Raises ValueError for a malformed cursor.
+    """
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        after = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        # the plain range is what the index seek uses, *after* only drops
+        # the rows of the cursor's own timestamp
+        entries = wallet_transactions(wallet, after, created_at__lte=created_at)
+    else:
+        entries = wallet_transactions(wallet)
+    # the database merges both branches and stops after size + 1 rows
+    page = list(entries.order_by("-created_at", "-id")[: size + 1])
+    if len(page) > size:
+        return page[:size], encode_cursor(page[size - 1])
+    return page, None
+
+
+def link_wallets(batch_size=LINK_BATCH_SIZE):
+    """
+    Fills source_wallet and destination_wallet of older transactions from
+    their IBANs, one batch per database transaction, so it can run next to
+    live traffic and be stopped at any point. Starts after the last
+    transaction the previous run looked at (WalletLinkProgress) and skips
+    the admin rows that never became ledger entries. Returns the number
+    linked.
+    """
+    progress, _created = WalletLinkProgress.objects.get_or_create(pk=1)
+    linked = 0
+    last_id = progress.last_id
+    while True:
+        with transaction.atomic():
+            entries = list(
+                Transaction.objects.filter(
+                    id__gt=last_id, destination_wallet__isnull=True
+                )
+                .exclude(visible_to__startswith="admin-")
+                .order_by("id")
+                .only("id", "source_iban", "destination_iban", "visible_to")[
+                    :batch_size
+                ]
+            )
+            if not entries:
+                return linked
+            last_id = entries[-1].pk
+            ibans = {e.source_iban for e in entries} | {
+                e.destination_iban for e in entries
+            }
+            wallets = dict(
+                Wallet.objects.filter(iban__in=ibans).values_list("iban", "id")
+            )
+            changed = []
+            for entry in entries:
+                entry.destination_wallet_id = wallets.get(entry.destination_iban)
+                if entry.visible_to != "deposit":  # paid in from outside
+                    entry.source_wallet_id = wallets.get(entry.source_iban)
+                if entry.destination_wallet_id or entry.source_wallet_id:
+                    changed.append(entry)
+            Transaction.objects.bulk_update(
+                changed, ["source_wallet", "destination_wallet"]
+            )
+            WalletLinkProgress.objects.filter(pk=progress.pk).update(last_id=last_id)
+            linked += len(changed)
@@ -0,0 +1,107 @@
+"""
+The house (master) wallets on the other side of every exchange.
+
+Transfers do not update the master wallet rows, which every exchange in a
+currency would otherwise queue up on. The house legs are appended as pending
+postings instead, and sweep() periodically nets them into the master balances.
+house_position() gives the exact position in between sweeps.
+"""
+
+import threading
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Posting, Wallet
+
+# profile owning the master ("house") wallet of every currency
+HOUSE_PROFILE_ID = 10
+SWEEP_BATCH_SIZE = 5000
+# how often the master wallet ids are read again, so that a replaced master
+# wallet is picked up by every process
+WALLET_REFRESH_INTERVAL = timedelta(minutes=1)
+
+_lock = threading.Lock()
+# (loaded at, {currency: id of the active master wallet}), swapped as a whole
+_wallet_ids = (None, {})
+
+
+def house_wallet_ids(*currencies):
+    """
+    Returns the ids of the master wallets for *currencies* (None where there
+    is none). The ids are cached and read again after WALLET_REFRESH_INTERVAL,
+    or at once when a currency has no master wallet yet.
+    """
+    global _wallet_ids
+    now = timezone.now()
+    loaded_at, ids = _wallet_ids
+    if (
+        loaded_at is None
+        or now - loaded_at >= WALLET_REFRESH_INTERVAL
+        or any(currency not in ids for currency in currencies)
+    ):
+        with _lock:
+            ids = dict(
+                Wallet.objects.filter(
+                    user_id=HOUSE_PROFILE_ID, wallet_status="active"
+                ).values_list("currency", "id")
+            )
+            _wallet_ids = (now, ids)
+    return [ids.get(currency) for currency in currencies]
+
+
+def house_position():
+    """
+    Returns {currency: balance} of the master wallets, including the postings
+    not swept yet. It is a single query, so the figures are consistent.
+    """
+    # summed per wallet in a subquery, so only the pending rows (the partial
+    # index) are read, however long the ledger
+    unswept = (
+        Posting.objects.filter(pending=True, wallet=OuterRef("pk"))
+        .order_by()
+        .values("wallet")
+        .annotate(total=Sum("amount"))
+        .values("total")
+    )
+    wallets = Wallet.objects.filter(
+        user_id=HOUSE_PROFILE_ID, wallet_status="active"
+    ).annotate(
+        unswept=Coalesce(
+            Subquery(unswept),
+            Value(Decimal(0)),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+    )
+    return {w.currency: w.balance + w.unswept for w in wallets}
+
+
+def sweep(batch_size=SWEEP_BATCH_SIZE):
+    """
+    Adds pending postings to their wallet balances and marks them done, one
+    batch per transaction. Returns {wallet id: amount added}.
+    """
+    swept = {}
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Posting.objects.select_for_update()
+                .filter(pending=True)
+                .order_by("id")
+                .values_list("id", "wallet_id", "amount")[:batch_size]
+            )
+            if not rows:
+                return swept
+            totals = {}
+            for _, wallet_id, amount in rows:
+                totals[wallet_id] = totals.get(wallet_id, Decimal(0)) + amount
+            for wallet_id, total in totals.items():
+                Wallet.objects.filter(pk=wallet_id).update(balance=F("balance") + total)
+                swept[wallet_id] = swept.get(wallet_id, Decimal(0)) + total
+            Posting.objects.filter(id__in=[row[0] for row in rows]).update(
+                pending=False
+            )
@@ -0,0 +1,86 @@
+"""
+Idempotency keys for transfers and deposits.
+
+The key is stored in the same database transaction as the operation it
+guards, so either both are committed or neither is: a failed attempt can be
+retried with the same key. It is inserted after the operation, so the
+operation's own preparation (quotes, rate refreshes) runs before the
+transaction has written anything. A second request racing the first one
+blocks on the unique index, rolls its operation back and gets the first
+one's outcome.
+"""
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .models import IdempotencyKey
+from .transfers import TransferError
+
+KEY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 64
+
+
+def request_key(request, form=None):
+    """
+    Returns the idempotency key sent with *request*, from the Idempotency-Key
+    header or the form's hidden field, or "" if there is none.
+    """
+    key = request.headers.get(KEY_HEADER, "")
+    if not key and form is not None:
+        key = form.cleaned_data.get("idempotency_key", "")
+    return key.strip()[:MAX_KEY_LENGTH]
+
+
+def _stored(profile, key, scope):
+    """
+    Returns the result stored under *key*, or None. Expired records are
+    dropped so the key can be used again.
+    """
+    record = IdempotencyKey.objects.filter(profile=profile, key=key).first()
+    if record is None:
+        return None
+    if record.created_at < timezone.now() - settings.IDEMPOTENCY_KEY_RETENTION:
+        record.delete()
+        return None
+    if record.scope != scope:
+        raise TransferError(_("Ten klucz został już użyty do innej operacji."))
+    return record.result
+
+
+def run_once(profile, key, scope, action):
+    """
+    Calls *action* (which returns a JSON-serialisable result) unless *key*
+    was already used by *profile*. Returns (result, replayed), where result is
+    the stored one for a replay. Without a key, *action* always runs.
+    """
+    if not key:
+        return action(), False
+
+    result = _stored(profile, key, scope)
+    if result is not None:
+        return result, True
+
+    try:
+        with transaction.atomic():
+            result = action()
+            IdempotencyKey.objects.create(
+                profile=profile, key=key, scope=scope, result=result
+            )
+    except IntegrityError:
+        # a concurrent request with the same key committed first
+        result = _stored(profile, key, scope)
+        if result is None:
+            raise
+        return result, True
+    return result, False
+
+
+def purge_expired():
+    """
+    Deletes records older than the retention window. Returns their number.
+    """
+    cutoff = timezone.now() - settings.IDEMPOTENCY_KEY_RETENTION
+    deleted, _by_model = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,167 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.backend_brokers.models import ExchangeRate
+from apps.backend_brokers.nbp_client import (
+    FIRST_TABLE_DATE,
+    MAX_QUERY_DAYS,
+    NBPClient,
+    upsert_rates,
+)
+from apps.backend_brokers.rate_history import rate_history
+from apps.backend_brokers.rollups import rebuild_rollups
+
+# tables come out every business day, so stored dates further apart than
+# the longest run of weekends and holidays mean missing history
+MAX_TABLE_GAP = timedelta(days=7)
+
+
+def query_windows(start, end):
+    """
+    Splits the range from *start* to *end* into consecutive windows
+    that NBP accepts in a single query.
+    """
+    windows = []
+    while start <= end:
+        window_end = min(start + timedelta(days=MAX_QUERY_DAYS - 1), end)
+        windows.append((start, window_end))
+        start = window_end + timedelta(days=1)
+    return windows
+
+
+def resume_date():
+    """
+    Returns the first day of the earliest gap in the stored history, or
+    FIRST_TABLE_DATE if nothing is stored. The tables refresh_rates stores
+    each day do not hide the missing history before them, and stray rows
+    dated before FIRST_TABLE_DATE are ignored.
+    """
+    previous = FIRST_TABLE_DATE - timedelta(days=1)
+    days = (
+        ExchangeRate.objects.filter(date__gte=FIRST_TABLE_DATE)
+        .order_by("date")
+        .values_list("date", flat=True)
+    )
+    for day in days.distinct().iterator():
+        if day - previous > MAX_TABLE_GAP:
+            break
+        previous = day
+    return previous + timedelta(days=1)
+
+
+class Command(BaseCommand):
+    help = "Load historical NBP table A rates, resuming at the first missing date"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--start",
+            type=date.fromisoformat,
+            help="First date to load, YYYY-MM-DD (defaults to the start of "
+            "the earliest gap in the stored history)",
+            default=None,
+        )
+        parser.add_argument(
+            "--end",
+            type=date.fromisoformat,
+            help="Last date to load, YYYY-MM-DD (defaults to today)",
+            default=None,
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Number of windows fetched at the same time",
+            default=4,
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Number of tables written per transaction",
+            default=100,
+        )
+        parser.add_argument(
+            "--base-url",
+            type=str,
+            help="NBP table A endpoint (defaults to settings.NBP_API_URL)",
+            default=None,
+        )
+
+    def handle(self, *args, **options):
+        start = options["start"] or resume_date()
+        end = options["end"] or date.today()
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
+
+        windows = query_windows(start, end)
+        if not windows:
+            self.stdout.write(self.style.SUCCESS("Rate history is up to date."))
+            return
+
+        self.stdout.write(
+            f"Loading {start} - {end} in {len(windows)} windows "
+            f"with {options['workers']} workers..."
+        )
+        nbp = NBPClient(base_url=options["base_url"], fetch=False)
+        self.inserted = self.updated = 0
+        batch = []
+
+        # map() fetches concurrently but yields in window order, so everything
+        # before the first gap is complete and a rerun can resume there
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            fetched = executor.map(lambda window: nbp.get_tables(*window), windows)
+            try:
+                for (window_start, window_end), tables in zip(windows, fetched):
+                    batch.extend(tables)
+                    if len(batch) >= options["batch_size"]:
+                        self.write_batch(batch)
+                        batch = []
+                    self.stdout.write(
+                        f"{window_start} - {window_end}: {len(tables)} tables"
+                    )
+            except requests.exceptions.RequestException as e:
+                self.write_batch(batch)
+                executor.shutdown(cancel_futures=True)
+                self.revalue(start, end)
+                raise CommandError(f"Backfill stopped, run again to resume: {e}")
+
+        self.write_batch(batch)
+        self.revalue(start, end)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Backfill finished: {self.inserted} rates added, "
+                f"{self.updated} updated."
+            )
+        )
+
+    def revalue(self, start, end):
+        """
+        Rebuilds the rollups of the months whose PLN values the rates stored
+        between *start* and *end* change: from *start* (from the beginning
+        if no earlier table is stored, as older entries take the first
+        table) up to the next table stored after *end*.
+        """
+        if not self.inserted and not self.updated:
+            return
+        stored = ExchangeRate.objects.filter(date__gte=FIRST_TABLE_DATE)
+        first_month = None
+        if stored.filter(date__lt=start).exists():
+            first_month = start.replace(day=1)
+        last_month = (
+            stored.filter(date__gt=end)
+            .order_by("date")
+            .values_list("date", flat=True)
+            .first()
+        )
+        if last_month is not None:
+            last_month = last_month.replace(day=1)
+        # older rates may have been corrected, which refresh() would miss
+        rate_history.reload()
+        written = rebuild_rollups(first_month, last_month)
+        self.stdout.write(f"Revalued {written} monthly rollups.")
+
+    def write_batch(self, tables):
+        result = upsert_rates(tables)
+        self.inserted += result.inserted
+        self.updated += result.updated
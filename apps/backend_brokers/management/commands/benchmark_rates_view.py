@@ -0,0 +1,68 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, RequestFactory
+
+from apps.backend_brokers.rate_cache import rate_cache
+from apps.backend_brokers.views import exchange_rates_view, exchange_rates_view_async
+
+
+class Command(BaseCommand):
+    help = "Compare concurrent throughput of the sync and async /rates/ views"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            help="Number of requests sent to each view",
+            default=2000,
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="Requests in flight at the same time (threads for the sync view)",
+            default=50,
+        )
+
+    def handle(self, *args, **options):
+        total = options["requests"]
+        concurrency = options["concurrency"]
+
+        rate_cache.invalidate()
+        elapsed = self.run_sync(total, concurrency)
+        self.report("sync (WSGI thread pool)", total, elapsed)
+
+        rate_cache.invalidate()
+        elapsed = asyncio.run(self.run_async(total, concurrency))
+        self.report("async (one event loop)", total, elapsed)
+
+    def run_sync(self, total, concurrency):
+        factory = RequestFactory()
+
+        def call(_):
+            return exchange_rates_view(factory.get("/rates/"))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(call, range(total)))
+        return time.perf_counter() - started
+
+    async def run_async(self, total, concurrency):
+        factory = AsyncRequestFactory()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call():
+            async with semaphore:
+                return await exchange_rates_view_async(factory.get("/rates/"))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(call() for _ in range(total)))
+        return time.perf_counter() - started
+
+    def report(self, label, total, elapsed):
+        self.stdout.write(
+            f"{label:<26} {total} requests in {elapsed:.2f} s "
+            f"({total / elapsed:.0f} req/s)"
+        )
@@ -0,0 +1,50 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from apps.backend_brokers.rate_history import rate_history
+from apps.backend_brokers.valuation import EPOCH_ORDINAL, value_pln
+
+
+class Command(BaseCommand):
+    help = "Time value_pln() on random amounts over the stored rate history"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            help="Number of amounts valued",
+            default=1_000_000,
+        )
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        rate_history.refresh(force=True)
+        codes = ["PLN", *sorted(rate_history.series)]
+        dates = [
+            day for history in rate_history.series.values() for day in history.dates
+        ]
+        if not dates:
+            self.stderr.write("No exchange rates stored, run backfill_rates first")
+            return
+
+        generator = np.random.default_rng(0)
+        cents = generator.integers(1, 10_000_000, rows)
+        currencies = np.array(codes)[generator.integers(0, len(codes), rows)]
+        # moments spread over the stored history, to the microsecond
+        first = np.datetime64("1970-01-01") + np.timedelta64(
+            min(dates) - EPOCH_ORDINAL, "D"
+        )
+        span = (max(dates) - min(dates) + 1) * 86_400_000_000
+        moments = first.astype("datetime64[us]") + generator.integers(
+            0, span, rows
+        ).astype("timedelta64[us]")
+
+        started = time.perf_counter()
+        value_pln(cents, currencies, moments)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{rows} amounts in {len(codes)} currencies valued in {elapsed:.3f} s "
+            f"({rows / elapsed:.0f} rows/s)"
+        )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from apps.backend_brokers.history import LINK_BATCH_SIZE, link_wallets
+
+
+class Command(BaseCommand):
+    help = "Fill the wallet foreign keys of older transactions from their IBANs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Transactions updated per database transaction",
+            default=LINK_BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        linked = link_wallets(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Linked {linked} transactions."))
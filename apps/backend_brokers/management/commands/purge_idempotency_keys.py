@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.backend_brokers.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete idempotency keys older than settings.IDEMPOTENCY_KEY_RETENTION"
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired keys."))
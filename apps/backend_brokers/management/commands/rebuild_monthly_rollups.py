@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from apps.backend_brokers.rollups import rebuild_rollups
+
+
+def month(value):
+    return datetime.strptime(value, "%Y-%m").date()
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the monthly rollups from the transaction history; "
+        "transfers wait until it is done"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from",
+            dest="first_month",
+            type=month,
+            help="First month (YYYY-MM) to rebuild, the oldest by default",
+        )
+        parser.add_argument(
+            "--to",
+            dest="last_month",
+            type=month,
+            help="Last month (YYYY-MM) to rebuild, the newest by default",
+        )
+
+    def handle(self, *args, **options):
+        written = rebuild_rollups(options["first_month"], options["last_month"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} monthly rollups."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.backend_brokers.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the monthly transaction counters from the transaction "
+        "history; transfers wait until it is done"
+    )
+
+    def handle(self, *args, **options):
+        written = rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} monthly counters."))
@@ -0,0 +1,86 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.backend_brokers.models import RateFetchLog
+from apps.backend_brokers.nbp_client import NBPClient
+from apps.backend_brokers.rate_snapshot import save_snapshot
+
+
+class Command(BaseCommand):
+    help = "Fetch NBP table A and store new or changed exchange rates"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--base-url",
+            type=str,
+            help="NBP table A endpoint (defaults to settings.NBP_API_URL)",
+            default=None,
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running and refresh every --interval seconds",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            help="Seconds between refreshes in --loop mode",
+            default=900,
+        )
+
+    def handle(self, *args, **options):
+        if not options["loop"]:
+            self.refresh(options["base_url"])
+            return
+
+        while True:
+            self.refresh(options["base_url"])
+            time.sleep(options["interval"])
+
+    def refresh(self, base_url):
+        started = time.monotonic()
+        nbp = NBPClient(base_url=base_url)
+        latency_ms = int((time.monotonic() - started) * 1000)
+
+        rates, effective_date = nbp.rates
+        if not rates:
+            RateFetchLog.objects.create(
+                status="error", latency_ms=latency_ms, error=nbp.last_error or ""
+            )
+            self.stdout.write(
+                self.style.ERROR(
+                    f"NBP fetch failed after {latency_ms} ms: {nbp.last_error}"
+                )
+            )
+            return
+
+        if nbp.not_modified:  # NBP answered 304, nothing to write
+            RateFetchLog.objects.create(
+                status="ok", latency_ms=latency_ms, effective_date=effective_date
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Table {effective_date} not modified ({latency_ms} ms)."
+                )
+            )
+            return
+
+        result = nbp.save_to_db()
+        save_snapshot(settings.NBP_SNAPSHOT_PATH, rates, effective_date)
+        rows_changed = result.inserted + result.updated
+        RateFetchLog.objects.create(
+            status="ok",
+            latency_ms=latency_ms,
+            effective_date=effective_date,
+            rows_changed=rows_changed,
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Table {effective_date} fetched in {latency_ms} ms, "
+                f"{result.inserted} rates added, {result.updated} updated, "
+                f"{result.unchanged} unchanged."
+            )
+        )
@@ -0,0 +1,86 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.backend_brokers.settlement import SETTLE_BATCH_SIZE, queue_stats, settle_batch
+
+
+class Command(BaseCommand):
+    help = "Settle queued transfers in micro-batches grouped by currency pair"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Transfers settled per database transaction",
+            default=SETTLE_BATCH_SIZE,
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Worker threads draining the queue",
+            default=1,
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running and wait for new transfers instead of exiting",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Seconds to wait when the queue is empty in --loop mode",
+            default=1.0,
+        )
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
+        # workers take different batches by skipping the rows another one
+        # has locked; without SKIP LOCKED (SQLite) they would only fail on
+        # the database lock
+        if (
+            options["workers"] > 1
+            and not connection.features.has_select_for_update_skip_locked
+        ):
+            raise CommandError(
+                f"{connection.vendor} cannot skip locked rows, use --workers 1"
+            )
+        if options["workers"] == 1:
+            self.work(options)
+        else:
+            workers = [
+                threading.Thread(target=self.work_in_thread, args=(options,))
+                for _ in range(options["workers"])
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+        stats = queue_stats()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Queue depth {stats['depth']}, "
+                f"average latency {stats['latency_avg']} s, "
+                f"worst {stats['latency_max']} s."
+            )
+        )
+
+    def work_in_thread(self, options):
+        try:
+            self.work(options)
+        finally:
+            connection.close()
+
+    def work(self, options):
+        while True:
+            settled = settle_batch(options["batch_size"])
+            if settled:
+                self.stdout.write(f"Settled {settled} transfers.")
+            elif options["loop"]:
+                time.sleep(options["interval"])
+            else:
+                return
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.backend_brokers.house_accounts import house_position, sweep
+
+
+class Command(BaseCommand):
+    help = "Book pending house postings into the master wallet balances"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running and sweep every --interval seconds",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            help="Seconds between sweeps in --loop mode",
+            default=60,
+        )
+
+    def handle(self, *args, **options):
+        if not options["loop"]:
+            self.sweep()
+            return
+
+        while True:
+            self.sweep()
+            time.sleep(options["interval"])
+
+    def sweep(self):
+        swept = sweep()
+        self.stdout.write(
+            self.style.SUCCESS(f"Swept postings into {len(swept)} master wallets.")
+        )
+        for currency, balance in sorted(house_position().items()):
+            self.stdout.write(f"{currency}: {balance}")
@@ -0,0 +1,24 @@
+from datetime import date, datetime, time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.backend_brokers.checkpoints import take_checkpoints
+
+
+class Command(BaseCommand):
+    help = "Store the balance at midnight of every wallet with new postings"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--as-of",
+            type=date.fromisoformat,
+            help="Day (YYYY-MM-DD) whose midnight to checkpoint, today by default",
+        )
+
+    def handle(self, *args, **options):
+        as_of = None
+        if options["as_of"]:
+            as_of = timezone.make_aware(datetime.combine(options["as_of"], time()))
+        written = take_checkpoints(as_of)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} balance checkpoints."))
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        (
+            "backend_brokers",
+            "0011_alter_exchangerate_currency_alter_exchangerate_date_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RateFetchLog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("started_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("ok", "OK"), ("error", "Error")], max_length=10
+                    ),
+                ),
+                ("latency_ms", models.PositiveIntegerField()),
+                ("effective_date", models.DateField(blank=True, null=True)),
+                ("rows_changed", models.PositiveIntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+            ],
+            options={
+                "ordering": ["-started_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:32
+
+from django.db import migrations, models
+
+
+def fill_latest_rates(apps, schema_editor):
+    ExchangeRate = apps.get_model("backend_brokers", "ExchangeRate")
+    LatestRate = apps.get_model("backend_brokers", "LatestRate")
+    latest = {}
+    for date, currency, rate in ExchangeRate.objects.order_by("date").values_list(
+        "date", "currency", "rate"
+    ):
+        latest[currency] = LatestRate(currency=currency, date=date, rate=rate)
+    LatestRate.objects.bulk_create(latest.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0012_ratefetchlog"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LatestRate",
+            fields=[
+                (
+                    "currency",
+                    models.CharField(
+                        max_length=3,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="Waluta",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="Data")),
+                (
+                    "rate",
+                    models.DecimalField(
+                        decimal_places=4, max_digits=12, verbose_name="Kurs wymiany"
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(fill_latest_rates, migrations.RunPython.noop),
+    ]
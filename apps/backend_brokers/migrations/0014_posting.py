@@ -0,0 +1,238 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def _entry_postings(Posting, wallets, entry, legs):
+    """
+    Postings of one exchange: *entry* is its "user" row, *legs* the admin rows
+    that followed it.
+    """
+    postings = [
+        Posting(
+            entry=entry,
+            wallet_id=wallets.get(entry.source_iban),
+            amount=-entry.amount,
+            currency=entry.from_currency,
+            kind="principal",
+        ),
+        Posting(
+            entry=entry,
+            wallet_id=wallets.get(entry.destination_iban),
+            amount=entry.result_amount,
+            currency=entry.to_currency,
+            kind="principal",
+        ),
+    ]
+    noprofit = [leg for leg in legs if leg.visible_to == "admin-noprofit"]
+    profit = [leg for leg in legs if leg.visible_to == "admin-profit"]
+    profit_amount = sum(leg.amount for leg in profit)
+    if noprofit:
+        postings.append(
+            Posting(
+                entry=entry,
+                wallet_id=wallets.get(noprofit[0].destination_iban),
+                amount=noprofit[0].amount,
+                currency=noprofit[0].from_currency,
+                kind="house",
+            )
+        )
+    if len(noprofit) > 1:
+        postings.append(
+            Posting(
+                entry=entry,
+                wallet_id=wallets.get(noprofit[1].source_iban),
+                amount=-(noprofit[1].amount + profit_amount),
+                currency=noprofit[1].from_currency,
+                kind="house",
+            )
+        )
+    for leg in profit:
+        postings.append(
+            Posting(
+                entry=entry,
+                wallet_id=wallets.get(leg.destination_iban),
+                amount=leg.amount,
+                currency=leg.from_currency,
+                kind="profit",
+            )
+        )
+    return postings
+
+
+def _deposit_postings(Posting, wallets, entry):
+    return [
+        Posting(
+            entry=entry,
+            wallet_id=wallets.get(entry.destination_iban),
+            amount=entry.amount,
+            currency=entry.to_currency,
+            kind="deposit",
+        ),
+        Posting(
+            entry=entry,
+            wallet_id=None,
+            amount=-entry.amount,
+            currency=entry.to_currency,
+            kind="deposit",
+        ),
+    ]
+
+
+def split_transactions(apps, schema_editor):
+    """
+    Turns every "user" transaction and the admin rows written right after it
+    into one journal entry with postings, then removes the admin rows.
+    Admin rows that cannot be matched to an entry are left alone.
+    """
+    Transaction = apps.get_model("backend_brokers", "Transaction")
+    Posting = apps.get_model("backend_brokers", "Posting")
+    Wallet = apps.get_model("backend_brokers", "Wallet")
+    wallets = dict(Wallet.objects.values_list("iban", "id"))
+
+    postings = []
+    merged = []
+    entry, legs = None, []
+    for row in Transaction.objects.order_by("id").iterator(chunk_size=2000):
+        if row.visible_to.startswith("admin-"):
+            if entry is not None and row.user_id == entry.user_id and len(legs) < 3:
+                legs.append(row)
+            continue
+        if entry is not None:
+            postings += _entry_postings(Posting, wallets, entry, legs)
+            merged += [leg.id for leg in legs]
+        entry, legs = None, []
+        if row.visible_to == "user":
+            entry = row
+        elif row.visible_to == "deposit":
+            postings += _deposit_postings(Posting, wallets, row)
+    if entry is not None:
+        postings += _entry_postings(Posting, wallets, entry, legs)
+        merged += [leg.id for leg in legs]
+
+    Posting.objects.bulk_create(postings, batch_size=2000)
+    for start in range(0, len(merged), 500):
+        Transaction.objects.filter(id__in=merged[start : start + 500]).delete()
+
+
+def join_transactions(apps, schema_editor):
+    """
+    Writes the house and profit postings back as admin rows.
+    """
+    Transaction = apps.get_model("backend_brokers", "Transaction")
+    Posting = apps.get_model("backend_brokers", "Posting")
+    ibans = dict(
+        apps.get_model("backend_brokers", "Wallet").objects.values_list("id", "iban")
+    )
+
+    for entry in Transaction.objects.filter(visible_to="user").prefetch_related(
+        "postings"
+    ):
+        legs = {"principal": [], "house": [], "profit": []}
+        for posting in entry.postings.all():
+            legs[posting.kind].append(posting)
+        profit = sum(p.amount for p in legs["profit"])
+        rows = []
+        for house in legs["house"]:
+            common = dict(
+                user_id=entry.user_id,
+                from_currency=house.currency,
+                to_currency=house.currency,
+                rate=1,
+                visible_to="admin-noprofit",
+            )
+            if house.amount > 0:
+                rows.append(
+                    Transaction(
+                        source_iban=entry.source_iban,
+                        destination_iban=ibans.get(house.wallet_id, ""),
+                        amount=house.amount,
+                        result_amount=house.amount,
+                        **common,
+                    )
+                )
+            else:
+                rows.append(
+                    Transaction(
+                        source_iban=ibans.get(house.wallet_id, ""),
+                        destination_iban=entry.destination_iban,
+                        amount=-house.amount - profit,
+                        result_amount=-house.amount - profit,
+                        **common,
+                    )
+                )
+        for leg in legs["profit"]:
+            rows.append(
+                Transaction(
+                    user_id=entry.user_id,
+                    source_iban=entry.source_iban,
+                    destination_iban=ibans.get(leg.wallet_id, ""),
+                    from_currency=leg.currency,
+                    to_currency=leg.currency,
+                    amount=leg.amount,
+                    rate=entry.rate,
+                    result_amount=leg.amount,
+                    visible_to="admin-profit",
+                )
+            )
+        for row in Transaction.objects.bulk_create(rows):
+            Transaction.objects.filter(id=row.id).update(created_at=entry.created_at)
+    Posting.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0013_latestrate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Posting",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=12)),
+                ("currency", models.CharField(max_length=10)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("principal", "Principal"),
+                            ("house", "House"),
+                            ("profit", "Profit"),
+                            ("deposit", "Deposit"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "entry",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="postings",
+                        to="backend_brokers.transaction",
+                    ),
+                ),
+                (
+                    "wallet",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="postings",
+                        to="backend_brokers.wallet",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(split_transactions, join_transactions),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0014_posting"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="posting",
+            name="pending",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name="posting",
+            index=models.Index(
+                condition=models.Q(("pending", True)),
+                fields=["wallet"],
+                name="posting_pending_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+
+def count_transactions(apps, schema_editor):
+    Transaction = apps.get_model("backend_brokers", "Transaction")
+    MonthlyTransactionCounter = apps.get_model(
+        "backend_brokers", "MonthlyTransactionCounter"
+    )
+    rows = (
+        Transaction.objects.filter(visible_to="user")
+        .annotate(month=TruncMonth("created_at"))
+        .values("user_id", "month")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    MonthlyTransactionCounter.objects.bulk_create(
+        [
+            MonthlyTransactionCounter(
+                profile_id=row["user_id"],
+                month=timezone.localtime(row["month"]).date(),
+                count=row["count"],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0017_transferrequest"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MonthlyTransactionCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField()),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "profile",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="monthly_counters",
+                        to="backend_brokers.profile",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("profile", "month"), name="unique_monthly_counter"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(count_transactions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0018_monthlytransactioncounter"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="posting",
+            index=models.Index(
+                fields=["wallet", "kind"], name="posting_wallet_kind_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["user", "visible_to", "created_at"],
+                name="transaction_user_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["visible_to", "created_at"], name="transaction_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="wallet",
+            index=models.Index(
+                condition=models.Q(("wallet_status", "active")),
+                fields=["user", "currency"],
+                name="wallet_active_idx",
+            ),
+        ),
+    ]
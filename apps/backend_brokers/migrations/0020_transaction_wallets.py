@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0019_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="destination_wallet",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="incoming_transactions",
+                to="backend_brokers.wallet",
+            ),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="source_wallet",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="outgoing_transactions",
+                to="backend_brokers.wallet",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["source_wallet", "created_at", "id"],
+                name="transaction_source_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["destination_wallet", "created_at", "id"],
+                name="transaction_destination_idx",
+            ),
+        ),
+    ]
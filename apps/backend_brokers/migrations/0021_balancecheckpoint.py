@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0020_transaction_wallets"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BalanceCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("as_of", models.DateTimeField()),
+                ("last_entry_id", models.PositiveBigIntegerField()),
+                ("balance", models.DecimalField(decimal_places=2, max_digits=12)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name="posting",
+            name="posting_wallet_kind_idx",
+        ),
+        migrations.AddIndex(
+            model_name="posting",
+            index=models.Index(
+                fields=["wallet", "entry"], name="posting_wallet_entry_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="balancecheckpoint",
+            name="wallet",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="checkpoints",
+                to="backend_brokers.wallet",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="balancecheckpoint",
+            constraint=models.UniqueConstraint(
+                fields=("wallet", "as_of"), name="unique_balance_checkpoint"
+            ),
+        ),
+    ]
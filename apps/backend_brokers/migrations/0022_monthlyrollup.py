@@ -0,0 +1,122 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+
+def fill_rollups(apps, schema_editor):
+    Transaction = apps.get_model("backend_brokers", "Transaction")
+    Posting = apps.get_model("backend_brokers", "Posting")
+    MonthlyRollup = apps.get_model("backend_brokers", "MonthlyRollup")
+    key = ("user_id", "month", "visible_to", "from_currency", "to_currency")
+    rows = (
+        Transaction.objects.annotate(month=TruncMonth("created_at"))
+        .values(*key)
+        .annotate(
+            count=Count("id"), amount=Sum("amount"), result_amount=Sum("result_amount")
+        )
+        .order_by()
+    )
+    profit = {
+        tuple(row[:-1]): row[-1]
+        for row in Posting.objects.filter(kind="profit")
+        .annotate(month=TruncMonth("entry__created_at"))
+        .values_list(
+            "entry__user_id",
+            "month",
+            "entry__visible_to",
+            "entry__from_currency",
+            "entry__to_currency",
+        )
+        .annotate(profit=Sum("amount"))
+        .order_by()
+    }
+    MonthlyRollup.objects.bulk_create(
+        [
+            MonthlyRollup(
+                profile_id=row["user_id"],
+                month=timezone.localtime(row["month"]).date(),
+                visible_to=row["visible_to"],
+                from_currency=row["from_currency"],
+                to_currency=row["to_currency"],
+                count=row["count"],
+                amount=row["amount"],
+                result_amount=row["result_amount"],
+                profit=profit.get(tuple(row[field] for field in key), 0),
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0021_balancecheckpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MonthlyRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField()),
+                ("visible_to", models.CharField(max_length=32)),
+                ("from_currency", models.CharField(max_length=10)),
+                ("to_currency", models.CharField(max_length=10)),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=16),
+                ),
+                (
+                    "result_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=16),
+                ),
+                (
+                    "profit",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=16),
+                ),
+                (
+                    "profile",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="monthly_rollups",
+                        to="backend_brokers.profile",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["visible_to", "month"], name="rollup_month_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=(
+                            "profile",
+                            "month",
+                            "visible_to",
+                            "from_currency",
+                            "to_currency",
+                        ),
+                        name="unique_monthly_rollup",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0022_monthlyrollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="monthlyrollup",
+            name="amount_pln",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=16),
+        ),
+        migrations.AddField(
+            model_name="monthlyrollup",
+            name="profit_pln",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=16),
+        ),
+        migrations.AddField(
+            model_name="monthlyrollup",
+            name="result_amount_pln",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=16),
+        ),
+    ]
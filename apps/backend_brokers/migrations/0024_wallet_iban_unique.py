@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0023_monthlyrollup_pln"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="wallet",
+            name="iban",
+            field=models.CharField(max_length=34, unique=True, verbose_name="IBAN"),
+        ),
+        migrations.AlterField(
+            model_name="wallet",
+            name="user",
+            field=models.ForeignKey(
+                default="deleted_user",
+                on_delete=django.db.models.deletion.SET_DEFAULT,
+                related_name="wallets",
+                to="backend_brokers.profile",
+                verbose_name="Użytkownik",
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0024_wallet_iban_unique"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="posting",
+            name="wallet",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="postings",
+                to="backend_brokers.wallet",
+            ),
+        ),
+    ]
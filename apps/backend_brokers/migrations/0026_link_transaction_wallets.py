@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:37
+
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def link_wallets(apps, schema_editor):
+    """
+    Fills the wallet foreign keys of the transactions written before 0020
+    from their IBANs, so their history shows up right after the deploy, and
+    records how far it got for link_transaction_wallets. The admin rows
+    0014 could not merge into an entry are left alone.
+    """
+    Transaction = apps.get_model("backend_brokers", "Transaction")
+    Wallet = apps.get_model("backend_brokers", "Wallet")
+    WalletLinkProgress = apps.get_model("backend_brokers", "WalletLinkProgress")
+    wallets = dict(Wallet.objects.values_list("iban", "id"))
+
+    last_id = 0
+    while True:
+        entries = list(
+            Transaction.objects.filter(id__gt=last_id, destination_wallet__isnull=True)
+            .exclude(visible_to__startswith="admin-")
+            .order_by("id")
+            .only("id", "source_iban", "destination_iban", "visible_to")[:BATCH_SIZE]
+        )
+        if not entries:
+            break
+        last_id = entries[-1].id
+        for entry in entries:
+            entry.destination_wallet_id = wallets.get(entry.destination_iban)
+            if entry.visible_to != "deposit":  # paid in from outside
+                entry.source_wallet_id = wallets.get(entry.source_iban)
+        Transaction.objects.bulk_update(
+            entries, ["source_wallet", "destination_wallet"]
+        )
+    WalletLinkProgress.objects.create(pk=1, last_id=last_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0025_posting_wallet_protect"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WalletLinkProgress",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("last_id", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(link_wallets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0026_link_transaction_wallets"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="balancecheckpoint",
+            name="wallet",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="checkpoints",
+                to="backend_brokers.wallet",
+            ),
+        ),
+    ]
@@ -0,0 +1,104 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import time, timedelta
+from decimal import ROUND_HALF_EVEN, Decimal
+from zoneinfo import ZoneInfo
+
+from django.db import migrations
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+# copied from rate_cache, so the migration does not depend on app code
+NBP_TIMEZONE = ZoneInfo("Europe/Warsaw")
+PUBLICATION_TIME = time(12, 15)
+CENT = Decimal("0.01")
+
+
+def _rate_day(moment):
+    # the day of the table that applied at *moment*, like rate_history.rate_day()
+    moment = moment.astimezone(NBP_TIMEZONE)
+    day = moment.date()
+    return day - timedelta(days=1) if moment.time() < PUBLICATION_TIME else day
+
+
+def fill_pln_sums(apps, schema_editor):
+    """
+    Fills the PLN sums 0023 added with 0, valuing every transaction at the
+    NBP table of its own day (the first stored table before that), like
+    valuation.value_pln() does.
+    """
+    ExchangeRate = apps.get_model("backend_brokers", "ExchangeRate")
+    MonthlyRollup = apps.get_model("backend_brokers", "MonthlyRollup")
+    Transaction = apps.get_model("backend_brokers", "Transaction")
+
+    history = defaultdict(lambda: ([], []))  # currency -> (dates, rates)
+    rates = ExchangeRate.objects.order_by("currency", "date").values_list(
+        "currency", "date", "rate"
+    )
+    for currency, day, rate in rates.iterator(chunk_size=5000):
+        history[currency][0].append(day)
+        history[currency][1].append(rate)
+
+    def to_pln(amount, currency, moment):
+        if currency == "PLN":
+            return amount
+        if currency not in history:
+            return Decimal(0)
+        dates, values = history[currency]
+        i = max(bisect_right(dates, _rate_day(moment)) - 1, 0)
+        return (amount * values[i]).quantize(CENT, ROUND_HALF_EVEN)
+
+    sums = defaultdict(lambda: [Decimal(0)] * 3)
+    rows = (
+        Transaction.objects.annotate(
+            profit=Sum("postings__amount", filter=Q(postings__kind="profit"))
+        )
+        .values_list(
+            "user_id",
+            "visible_to",
+            "from_currency",
+            "to_currency",
+            "amount",
+            "result_amount",
+            "profit",
+            "created_at",
+        )
+        .order_by()
+    )
+    for (
+        profile_id,
+        kind,
+        source,
+        destination,
+        amount,
+        result_amount,
+        profit,
+        created_at,
+    ) in rows.iterator(chunk_size=5000):
+        month = timezone.localtime(created_at).date().replace(day=1)
+        total = sums[(profile_id, month, kind, source, destination)]
+        total[0] += to_pln(amount, source, created_at)
+        total[1] += to_pln(result_amount, destination, created_at)
+        total[2] += to_pln(profit or Decimal(0), destination, created_at)
+
+    for (profile_id, month, kind, source, destination), values in sums.items():
+        MonthlyRollup.objects.filter(
+            profile_id=profile_id,
+            month=month,
+            visible_to=kind,
+            from_currency=source,
+            to_currency=destination,
+        ).update(
+            amount_pln=values[0], result_amount_pln=values[1], profit_pln=values[2]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend_brokers", "0027_balancecheckpoint_wallet_protect"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_pln_sums, migrations.RunPython.noop),
+    ]
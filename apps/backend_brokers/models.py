@@ -1,5 +1,6 @@
 from email.policy import default
 from random import choices
+import uuid
 
 from django.db import models
 from django.contrib.auth.models import User
@@ -100,6 +101,16 @@ class Wallet(models.Model):
     balance = models.DecimalField(_("Stan konta"), max_digits=12, decimal_places=2, default=0.00)
     wallet_status = models.CharField(_("Status portfela"), max_length=50, default="active")
 
+    class Meta:
+        indexes = [
+            # every lookup of a customer's wallets asks for the active ones
+            models.Index(
+                fields=["user", "currency"],
+                condition=models.Q(wallet_status="active"),
+                name="wallet_active_idx",
+            )
+        ]
+
     def __str__(self):
         return "{} {} ({} {})".format(_("Portfel"), self.wallet_id, self.balance, self.currency)
 
@@ -112,6 +123,24 @@ class Transaction(models.Model):
     from_currency = models.CharField(max_length=10)  # np. "USD"
     to_currency = models.CharField(max_length=10)  # np. "PLN"
     destination_iban = models.CharField(max_length=34, default="test")
+    # the same wallets as the IBANs; deposits come from outside and have no
+    # source wallet. Indexed below together with the history order.
+    source_wallet = models.ForeignKey(
+        Wallet,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        db_index=False,
+        related_name="outgoing_transactions",
+    )
+    destination_wallet = models.ForeignKey(
+        Wallet,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        db_index=False,
+        related_name="incoming_transactions",
+    )
 
     # transaction data
     amount = models.DecimalField(
@@ -124,10 +153,273 @@ class Transaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     visible_to = models.CharField(max_length=32)  # np. "admin", "user"
 
+    class Meta:
+        indexes = [
+            # a profile's exchanges in a date range (stats, report)
+            models.Index(
+                fields=["user", "visible_to", "created_at"],
+                name="transaction_user_date_idx",
+            ),
+            # everyone's exchanges in a date range (superuser stats)
+            models.Index(
+                fields=["visible_to", "created_at"], name="transaction_date_idx"
+            ),
+            # a wallet's history, newest first
+            models.Index(
+                fields=["source_wallet", "created_at", "id"],
+                name="transaction_source_idx",
+            ),
+            models.Index(
+                fields=["destination_wallet", "created_at", "id"],
+                name="transaction_destination_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.user.user.username}: {self.amount} {self.from_currency} → {self.to_currency} @ {self.rate}"
 
 
+class Posting(models.Model):
+    """
+    One leg of a Transaction (the journal entry): a signed amount booked on a
+    wallet. The legs of an entry sum to zero per currency; the spread the house
+    earns is a separate "profit" leg on its wallet.
+    """
+
+    KIND_CHOICES = (
+        ("principal", "Principal"),  # the customer's own wallets
+        ("house", "House"),  # the other side of an exchange, on a master wallet
+        ("profit", "Profit"),  # spread earned by the house
+        ("deposit", "Deposit"),  # money paid in; the external leg has no wallet
+    )
+
+    entry = models.ForeignKey(
+        Transaction, on_delete=models.CASCADE, related_name="postings"
+    )
+    # a wallet with ledger legs cannot be deleted, or the entries would no
+    # longer balance
+    wallet = models.ForeignKey(
+        Wallet,
+        on_delete=models.PROTECT,
+        related_name="postings",
+        null=True,
+        blank=True,
+    )
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    currency = models.CharField(max_length=10)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # house legs are not in the wallet balance until sweep_house_accounts runs
+    pending = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["wallet"],
+                condition=models.Q(pending=True),
+                name="posting_pending_idx",
+            ),
+            # a wallet's postings after a balance checkpoint
+            models.Index(fields=["wallet", "entry"], name="posting_wallet_entry_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.amount:+} {self.currency}"
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Ledger balance of a wallet (its postings, pending house legs included)
+    at *as_of*, i.e. after every entry up to last_entry_id. Written by
+    take_balance_checkpoints for the wallets that had postings since the
+    previous run.
+    """
+
+    # a checkpoint sums up postings, so it protects the wallet like they do
+    wallet = models.ForeignKey(
+        Wallet, on_delete=models.PROTECT, related_name="checkpoints"
+    )
+    as_of = models.DateTimeField()
+    last_entry_id = models.PositiveBigIntegerField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["wallet", "as_of"], name="unique_balance_checkpoint"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.wallet_id} @ {self.as_of:%Y-%m-%d %H:%M}: {self.balance}"
+
+
+class WalletLinkProgress(models.Model):
+    """
+    How far link_wallets() got: every transaction up to last_id has been
+    looked at. A single row.
+    """
+
+    last_id = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"linked up to {self.last_id}"
+
+
+class MonthlyTransactionCounter(models.Model):
+    """
+    Number of exchanges a profile made in a calendar month, kept up to date
+    by the transfer code. *month* is the first day of the month.
+    """
+
+    profile = models.ForeignKey(
+        Profile, on_delete=models.CASCADE, related_name="monthly_counters"
+    )
+    month = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["profile", "month"], name="unique_monthly_counter"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.profile_id} {self.month:%Y-%m}: {self.count}"
+
+
+class MonthlyRollup(models.Model):
+    """
+    Totals of a profile's transactions of one kind (visible_to) and currency
+    pair in a calendar month, kept up to date by the transfer and deposit
+    code. *month* is the first day of the month; *profit* is the spread the
+    house earned, in to_currency. The *_pln fields value every transaction at
+    the NBP rate of the day it was made.
+    """
+
+    profile = models.ForeignKey(
+        Profile, on_delete=models.CASCADE, related_name="monthly_rollups"
+    )
+    month = models.DateField()
+    visible_to = models.CharField(max_length=32)
+    from_currency = models.CharField(max_length=10)
+    to_currency = models.CharField(max_length=10)
+    count = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    result_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    profit = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    # the same sums in PLN, each transaction at the rate of its own day
+    amount_pln = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    result_amount_pln = models.DecimalField(
+        max_digits=16, decimal_places=2, default=0
+    )
+    profit_pln = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=[
+                    "profile",
+                    "month",
+                    "visible_to",
+                    "from_currency",
+                    "to_currency",
+                ],
+                name="unique_monthly_rollup",
+            )
+        ]
+        indexes = [
+            # everyone's totals for a range of months (superuser stats)
+            models.Index(fields=["visible_to", "month"], name="rollup_month_idx"),
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.profile_id} {self.month:%Y-%m} {self.visible_to} "
+            f"{self.from_currency}→{self.to_currency}: {self.count}"
+        )
+
+
+class TransferRequest(models.Model):
+    """
+    A transfer accepted in queued settlement mode, waiting for the
+    settle_transfers workers. The token is what the customer polls with.
+    """
+
+    STATUS_CHOICES = (
+        ("queued", "Queued"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    profile = models.ForeignKey(
+        Profile, on_delete=models.CASCADE, related_name="transfer_requests"
+    )
+    source = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name="+")
+    destination = models.ForeignKey(
+        Wallet, on_delete=models.CASCADE, related_name="+"
+    )
+    from_currency = models.CharField(max_length=10)
+    to_currency = models.CharField(max_length=10)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    spread = models.DecimalField(max_digits=5, decimal_places=4)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="queued")
+    error = models.CharField(max_length=255, blank=True)
+    entry = models.ForeignKey(
+        Transaction,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    settled_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["from_currency", "to_currency", "id"],
+                condition=models.Q(status="queued"),
+                name="transfer_request_queued_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.token} {self.status}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Outcome of a transfer or deposit submitted with an idempotency key, so a
+    retry of the same request returns it instead of running again.
+    """
+
+    SCOPE_CHOICES = (
+        ("transfer", "Transfer"),
+        ("deposit", "Deposit"),
+        ("batch", "Batch"),
+    )
+
+    profile = models.ForeignKey(
+        Profile, on_delete=models.CASCADE, related_name="idempotency_keys"
+    )
+    key = models.CharField(max_length=64)
+    scope = models.CharField(max_length=10, choices=SCOPE_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    result = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["profile", "key"], name="unique_idempotency_key"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key}"
+
+
 class ExchangeRate(models.Model):
     date = models.DateField(_("Data"))
     currency = models.CharField(_("Waluta"), max_length=3)
@@ -139,3 +431,37 @@ class ExchangeRate(models.Model):
 
     def __str__(self):
         return f"{self.date} - {self.currency}: {self.rate}"
+
+
+class LatestRate(models.Model):
+    """
+    Newest known rate of every currency, kept current by upsert_rates.
+    """
+
+    currency = models.CharField(_("Waluta"), max_length=3, primary_key=True)
+    date = models.DateField(_("Data"))
+    rate = models.DecimalField(_("Kurs wymiany"), max_digits=12, decimal_places=4)
+
+    def __str__(self):
+        return f"{self.currency}: {self.rate} ({self.date})"
+
+
+class RateFetchLog(models.Model):
+    """
+    One row per refresh_rates run: how long the NBP request took and what came of it.
+    """
+
+    STATUS_CHOICES = (("ok", "OK"), ("error", "Error"))
+
+    started_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    latency_ms = models.PositiveIntegerField()
+    effective_date = models.DateField(null=True, blank=True)
+    rows_changed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["-started_at"]
+
+    def __str__(self):
+        return f"{self.started_at:%Y-%m-%d %H:%M} {self.status} ({self.latency_ms} ms)"
@@ -1,27 +1,74 @@
+import logging
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+
 import requests
-from .models import ExchangeRate
+from django.conf import settings
+from django.db import transaction
+from .models import ExchangeRate, LatestRate
+from .nbp_transport import transport as default_transport
+
+logger = logging.getLogger(__name__)
+
+RATE_PRECISION = Decimal("0.0001")  # ExchangeRate.rate has 4 decimal places
+UPSERT_BATCH_SIZE = 500
+
+UpsertResult = namedtuple("UpsertResult", ["inserted", "updated", "unchanged"])
+
+
+# NBP answers at most 93 days of tables per query
+MAX_QUERY_DAYS = 93
+# the first table A available from the API
+FIRST_TABLE_DATE = date(2002, 1, 2)
+
 
 class NBPClient:
-    def __init__(self):
-        self.base_url = "https://api.nbp.pl/api/exchangerates/tables/A/"
-        self.rates = self.get_exchange_rates()
+    def __init__(self, base_url=None, fetch=True, transport=None):
+        self.base_url = base_url or settings.NBP_API_URL
+        self.transport = transport or default_transport
+        self.last_error = None
+        self.not_modified = False
+        self.rates = self.get_exchange_rates() if fetch else (None, None)
 
     def get_exchange_rates(self):
         """
         Fetches current exchange rates from NBP table A and returns them in a dictionary.
         """
         try:
-            response = requests.get(self.base_url)
-            response.raise_for_status()
-            print("API connection successfull")
-            data = response.json()
+            data, self.not_modified = self.transport.get_json(
+                self.base_url, conditional=True
+            )
             rates = {rate["code"]: rate["mid"] for rate in data[0]["rates"]}
             rates["PLN"] = 1.0  # Set PLN rate to 1 for easier calculations
             return rates, data[0]["effectiveDate"]
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching exchange rates: {e}")
+        except (requests.exceptions.RequestException, ValueError, LookupError) as e:
+            logger.error("Error fetching exchange rates: %s", e)
+            self.last_error = str(e)
             return None, None
 
+    def get_tables(self, start, end):
+        """
+        Fetches all tables published between *start* and *end* (inclusive, at most
+        MAX_QUERY_DAYS apart) and returns them as a list of (rates, effective_date).
+        Raises requests.exceptions.RequestException on failure.
+        """
+        try:
+            data, _ = self.transport.get_json(
+                f"{self.base_url}{start.isoformat()}/{end.isoformat()}/"
+            )
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 404:  # no tables in this range (holidays)
+                return []
+            raise
+        return [
+            (
+                {rate["code"]: rate["mid"] for rate in table["rates"]},
+                table["effectiveDate"],
+            )
+            for table in data
+        ]
+
     def show_current_rates(self):
         """
         Displays the current exchange rates from NBP.
@@ -35,17 +82,93 @@ class NBPClient:
                 continue
             output += f"• 1 {currency} = {rate:.4f} PLN\n"
         return output
-    
+
     def save_to_db(self):
+        """
+        Stores the fetched table, writing only new or changed rates.
+        Returns UpsertResult(inserted, updated, unchanged).
+        """
         if not self.rates[0]:
-            return
+            return UpsertResult(0, 0, 0)
+        return upsert_rates([self.rates])
+
+
+def upsert_rates(tables):
+    """
+    Stores several tables in one transaction.
 
-        rates, effective_date = self.rates
+    *tables* is an iterable of (rates, effective_date) pairs, the format of
+    NBPClient.rates. Rows that already hold the same rate are not written.
+    Returns UpsertResult(inserted, updated, unchanged).
+    """
+    incoming = {}
+    for rates, effective_date in tables:
+        if isinstance(effective_date, str):
+            effective_date = date.fromisoformat(effective_date)
         for code, value in rates.items():
             if code == "PLN":
                 continue
-            ExchangeRate.objects.get_or_create(
-                date=effective_date,
-                currency=code,
-                defaults={'rate': value}
-            )
\ No newline at end of file
+            incoming[(effective_date, code)] = Decimal(str(value)).quantize(
+                RATE_PRECISION
+            )
+    if not incoming:
+        return UpsertResult(0, 0, 0)
+
+    dates = [effective_date for effective_date, _ in incoming]
+    with transaction.atomic():
+        stored = {
+            (effective_date, code): rate
+            for effective_date, code, rate in ExchangeRate.objects.filter(
+                date__range=(min(dates), max(dates))
+            ).values_list("date", "currency", "rate")
+        }
+        changed = [
+            ExchangeRate(date=effective_date, currency=code, rate=rate)
+            for (effective_date, code), rate in incoming.items()
+            if stored.get((effective_date, code)) != rate
+        ]
+        ExchangeRate.objects.bulk_create(
+            changed,
+            batch_size=UPSERT_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["date", "currency"],
+            update_fields=["rate"],
+        )
+        _update_latest_rates(incoming)
+
+    updated = sum(1 for row in changed if (row.date, row.currency) in stored)
+    return UpsertResult(
+        inserted=len(changed) - updated,
+        updated=updated,
+        unchanged=len(incoming) - len(changed),
+    )
+
+
+def _update_latest_rates(incoming):
+    """
+    Moves LatestRate forward to the newest of the *incoming* rates.
+    """
+    newest = {}
+    for (effective_date, code), rate in incoming.items():
+        if code not in newest or effective_date > newest[code][0]:
+            newest[code] = (effective_date, rate)
+
+    current = {
+        code: (effective_date, rate)
+        for code, effective_date, rate in LatestRate.objects.values_list(
+            "currency", "date", "rate"
+        )
+    }
+    changed = [
+        LatestRate(currency=code, date=effective_date, rate=rate)
+        for code, (effective_date, rate) in newest.items()
+        if code not in current
+        or effective_date > current[code][0]
+        or (effective_date == current[code][0] and rate != current[code][1])
+    ]
+    LatestRate.objects.bulk_create(
+        changed,
+        update_conflicts=True,
+        unique_fields=["currency"],
+        update_fields=["date", "rate"],
+    )
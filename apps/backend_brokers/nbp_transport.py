@@ -0,0 +1,96 @@
+"""
+Shared HTTP transport for the NBP API.
+
+Used by both the web app and the command line client, so it must not
+import anything from Django.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 3.05  # seconds, slightly above a TCP retransmission window
+READ_TIMEOUT = 10
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5  # seconds, doubled on every retry
+BACKOFF_CAP = 8
+POOL_SIZE = 10
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+TransportResponse = namedtuple("TransportResponse", ["data", "not_modified"])
+
+
+class NBPTransport:
+    def __init__(
+        self,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        max_retries=MAX_RETRIES,
+        pool_size=POOL_SIZE,
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        self.session.headers["Accept"] = "application/json"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._validators = {}  # url -> (etag, last_modified, data)
+        self._lock = threading.Lock()
+
+    def get_json(self, url, conditional=False):
+        """
+        GETs *url* and returns TransportResponse(data, not_modified).
+
+        With *conditional* the ETag/Last-Modified of the previous answer are sent
+        along, and a 304 returns the data remembered from that answer.
+        Raises requests.exceptions.RequestException when all attempts fail.
+        """
+        headers = {}
+        cached = self._validators.get(url) if conditional else None
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        response = self._get(url, headers)
+        if response.status_code == 304 and cached:
+            return TransportResponse(cached[2], True)
+        response.raise_for_status()
+
+        data = response.json()
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if conditional and (etag or last_modified):
+            with self._lock:
+                self._validators[url] = (etag, last_modified, data)
+        return TransportResponse(data, False)
+
+    def _get(self, url, headers):
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if last_attempt:
+                    raise
+                logger.warning("NBP request to %s failed, retrying", url)
+            else:
+                if response.status_code not in RETRY_STATUSES or last_attempt:
+                    return response
+                logger.warning(
+                    "NBP answered %s for %s, retrying", response.status_code, url
+                )
+            # exponential backoff with full jitter
+            time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt)))
+
+
+transport = NBPTransport()
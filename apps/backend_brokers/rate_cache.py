@@ -0,0 +1,131 @@
+"""
+Process-wide cache of the latest NBP table A.
+
+Rates are read from the LatestRate table, which the refresh_rates command
+keeps up to date, so serving them never waits on NBP. A cold start with an
+empty table is warmed from the rate snapshot file. Table A is published
+once per business day, so a loaded table stays valid until the next
+publication instead of for a fixed number of seconds.
+"""
+
+import logging
+import threading
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .models import LatestRate
+from .rate_snapshot import load_snapshot
+
+logger = logging.getLogger(__name__)
+
+NBP_TIMEZONE = ZoneInfo("Europe/Warsaw")
+# NBP publishes table A between 11:45 and 12:15 Warsaw time
+PUBLICATION_TIME = time(12, 15)
+# how long to wait before looking again when the next table is overdue
+RETRY_INTERVAL = timedelta(minutes=15)
+
+
+def next_publication(effective_date):
+    """
+    Returns the moment (aware datetime) when the table following
+    *effective_date* is expected to be published.
+    """
+    day = effective_date + timedelta(days=1)
+    while day.weekday() >= 5:  # no tables on saturdays and sundays
+        day += timedelta(days=1)
+    return datetime.combine(day, PUBLICATION_TIME, tzinfo=NBP_TIMEZONE)
+
+
+def latest_stored_rates():
+    """
+    Returns (rates, effective_date) built from the LatestRate table,
+    or (None, None) if it is empty.
+    """
+    latest = list(LatestRate.objects.values_list("currency", "date", "rate"))
+    if not latest:
+        return None, None
+
+    rates = {currency: float(rate) for currency, _, rate in latest}
+    rates["PLN"] = 1.0
+    return rates, max(effective_date for _, effective_date, _ in latest)
+
+
+def snapshot_rates():
+    """
+    Returns (rates, effective_date) from the snapshot file written by
+    refresh_rates and the command line client, or (None, None).
+    """
+    snapshot = load_snapshot(settings.NBP_SNAPSHOT_PATH)
+    if not snapshot:
+        return None, None
+    return snapshot["rates"], date.fromisoformat(snapshot["effective_date"])
+
+
+class RateCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._table = (None, None)  # (rates, effective_date), swapped as a whole
+        self._expires_at = None
+
+    def get(self):
+        """
+        Returns (rates, effective_date) of the latest known table,
+        refreshing it first if it has expired.
+        """
+        now = timezone.now()
+        if self._expired(now):
+            with self._lock:
+                # another thread may have refreshed while we were waiting
+                if self._expired(now):
+                    self._refresh(now)
+        return self._table
+
+    async def aget(self):
+        """
+        Async variant of get(). A fresh table is returned straight from memory,
+        only a refresh hops to the database thread.
+        """
+        if self._expired(timezone.now()):
+            return await sync_to_async(self.get)()
+        return self._table
+
+    def invalidate(self):
+        with self._lock:
+            self._expires_at = None
+
+    def _expired(self, now):
+        return self._expires_at is None or now >= self._expires_at
+
+    def _refresh(self, now):
+        rates, effective_date = latest_stored_rates()
+        if not rates:
+            # cold start before refresh_rates has run
+            rates, effective_date = snapshot_rates()
+        if rates:
+            expires_at = next_publication(effective_date)
+        else:
+            logger.warning("No exchange rates stored, run refresh_rates")
+            expires_at = now
+
+        # the next table is overdue (late publication, bank holiday or the
+        # refresh_rates worker has not picked it up yet)
+        if expires_at <= now:
+            expires_at = now + RETRY_INTERVAL
+
+        self._table = (rates, effective_date)
+        self._expires_at = expires_at
+
+
+rate_cache = RateCache()
+
+
+def get_latest_rates():
+    return rate_cache.get()
+
+
+async def aget_latest_rates():
+    return await rate_cache.aget()
@@ -0,0 +1,162 @@
+"""
+Point-in-time ("as-of") exchange rates.
+
+The history of every currency is kept in memory as two parallel sorted
+arrays, publication dates as ordinals and rates as fixed-point integers,
+so a lookup is a binary search instead of a database query.
+"""
+
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ExchangeRate
+from .rate_cache import NBP_TIMEZONE, PUBLICATION_TIME
+
+RATE_SCALE = 10_000  # ExchangeRate.rate has 4 decimal places
+PLN_FIXED = RATE_SCALE
+# how often lookups check the database for new ExchangeRate rows
+REFRESH_INTERVAL = timedelta(minutes=1)
+
+
+def rate_day(moment):
+    """
+    Returns the ordinal of the day whose table applied at *moment*.
+
+    A date is taken as is. For a datetime, a table only applies after its
+    publication (PUBLICATION_TIME in Warsaw), so earlier moments on the same
+    day get the previous day.
+    """
+    if not isinstance(moment, datetime):
+        return moment.toordinal()
+    if timezone.is_aware(moment):
+        moment = moment.astimezone(NBP_TIMEZONE)
+    day = moment.date().toordinal()
+    return day - 1 if moment.time() < PUBLICATION_TIME else day
+
+
+def to_fixed(rate):
+    return int(rate * RATE_SCALE)
+
+
+def from_fixed(value):
+    return Decimal(value) / RATE_SCALE
+
+
+class CurrencyHistory:
+    __slots__ = ("dates", "rates")
+
+    def __init__(self, dates=None, rates=None):
+        self.dates = array("i", dates or [])
+        self.rates = array("q", rates or [])
+
+    def copy(self):
+        return CurrencyHistory(self.dates, self.rates)
+
+    def add(self, day, rate):
+        i = bisect_left(self.dates, day)
+        if i < len(self.dates) and self.dates[i] == day:
+            self.rates[i] = rate
+        else:
+            self.dates.insert(i, day)
+            self.rates.insert(i, rate)
+
+    def as_of(self, day):
+        """
+        Returns the fixed-point rate published on or before *day*, or None.
+        """
+        i = bisect_right(self.dates, day) - 1
+        return self.rates[i] if i >= 0 else None
+
+
+class RateHistory:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.series = {}  # currency -> CurrencyHistory
+        self._last_id = 0
+        self._last_date = None
+        self._checked_at = None
+
+    def refresh(self, force=False):
+        """
+        Loads ExchangeRate rows added since the previous refresh, plus the
+        newest table again in case NBP corrected it. Does nothing if the last
+        check was less than REFRESH_INTERVAL ago, unless *force* is set.
+        """
+        now = timezone.now()
+        if (
+            not force
+            and self._checked_at is not None
+            and now - self._checked_at < REFRESH_INTERVAL
+        ):
+            return
+
+        with self._lock:
+            new_rows = Q(id__gt=self._last_id)
+            if self._last_date is not None:
+                new_rows |= Q(date__gte=self._last_date)
+            rows = (
+                ExchangeRate.objects.filter(new_rows)
+                .order_by("currency", "date")
+                .values_list("id", "currency", "date", "rate")
+            )
+            # readers never lock, so changes go into copies that replace
+            # the published series once complete
+            changed = {}
+            for row_id, currency, day, rate in rows.iterator(chunk_size=5000):
+                history = changed.get(currency)
+                if history is None:
+                    current = self.series.get(currency)
+                    history = current.copy() if current else CurrencyHistory()
+                    changed[currency] = history
+                history.add(day.toordinal(), to_fixed(rate))
+                self._last_id = max(self._last_id, row_id)
+                if self._last_date is None or day > self._last_date:
+                    self._last_date = day
+            self.series = {**self.series, **changed}
+            self._checked_at = now
+
+    def reload(self):
+        """
+        Rebuilds the whole history, e.g. after older rates were corrected.
+        """
+        with self._lock:
+            self.series = {}
+            self._last_id = 0
+            self._last_date = None
+        self.refresh(force=True)
+
+    def fixed_rate_as_of(self, currency, day):
+        if currency == "PLN":
+            return PLN_FIXED
+        history = self.series.get(currency)
+        return history.as_of(day) if history is not None else None
+
+    def rate_as_of(self, currency, moment):
+        """
+        Returns the Decimal rate of *currency* in PLN that applied at *moment*
+        (a date or datetime), or None if there was no table yet.
+        """
+        self.refresh()
+        value = self.fixed_rate_as_of(currency, rate_day(moment))
+        return from_fixed(value) if value is not None else None
+
+    def rates_as_of(self, pairs):
+        """
+        Bulk variant of rate_as_of() for an iterable of (currency, moment)
+        pairs. Returns a list of Decimal rates (None where unknown).
+        """
+        self.refresh()
+        result = []
+        for currency, moment in pairs:
+            value = self.fixed_rate_as_of(currency, rate_day(moment))
+            result.append(from_fixed(value) if value is not None else None)
+        return result
+
+
+rate_history = RateHistory()
@@ -0,0 +1,55 @@
+"""
+The last good NBP table on disk, so a cold start has rates without waiting
+for the network.
+
+Shared by the command line client and the web app, so it must not import
+anything from Django.
+"""
+
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def save_snapshot(path, rates, effective_date):
+    """
+    Writes *rates* ({code: mid}) published on *effective_date* to *path*.
+    The file is replaced atomically, so readers never see half of it.
+    """
+    snapshot = {
+        "effective_date": str(effective_date),
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
+        "rates": rates,
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, suffix=".tmp", delete=False, encoding="utf-8"
+        ) as f:
+            json.dump(snapshot, f, indent=4)
+        os.replace(f.name, path)
+    except OSError as e:
+        logger.warning("Could not write rate snapshot %s: %s", path, e)
+
+
+def load_snapshot(path):
+    """
+    Returns the snapshot stored at *path* as a dict with "rates",
+    "effective_date" and "fetched_at" keys, or None if there is no usable one.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        snapshot["fetched_at"] = datetime.fromisoformat(snapshot["fetched_at"])
+        if not snapshot["rates"]:
+            return None
+        return snapshot
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("Ignoring unreadable rate snapshot %s: %s", path, e)
+        return None
@@ -0,0 +1,29 @@
+"""
+Current exchange rates for conversions, read from the LatestRate table.
+"""
+
+from decimal import Decimal
+
+from .models import LatestRate
+
+
+def latest_rates():
+    """
+    Returns {currency: rate in PLN} of the newest known rates, PLN included.
+    """
+    rates = dict(LatestRate.objects.values_list("currency", "rate"))
+    rates["PLN"] = Decimal(1)
+    return rates
+
+
+def latest_rate(currency):
+    """
+    Returns the newest known rate of *currency* in PLN, or None if there is none.
+    """
+    if currency == "PLN":
+        return Decimal(1)
+    return (
+        LatestRate.objects.filter(currency=currency)
+        .values_list("rate", flat=True)
+        .first()
+    )
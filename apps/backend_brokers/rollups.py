@@ -0,0 +1,222 @@
+"""
+Monthly rollups of the ledger for the stats dashboard and the user report.
+
+The transfer and deposit code adds every entry it writes to its profile's
+MonthlyRollup row in the same database transaction, so the reports read a
+row per month and currency pair instead of every transaction. The PLN sums
+value each entry at the rate of its own day (see valuation), from a rate
+series the caller takes before its transaction starts.
+rebuild_rollups() recomputes them from the ledger for a range of months.
+"""
+
+from collections import defaultdict
+from datetime import datetime, time
+from decimal import Decimal
+from itertools import islice
+
+from dateutil.relativedelta import relativedelta
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import MonthlyRollup, Transaction
+from .table_locks import lock_table
+from .valuation import from_cents, rate_series, to_cents, to_datetime64, value_pln
+
+SUMS = (
+    "amount",
+    "result_amount",
+    "profit",
+    "amount_pln",
+    "result_amount_pln",
+    "profit_pln",
+)
+# transactions valued at a time by rebuild_rollups()
+REBUILD_CHUNK_SIZE = 20000
+
+
+def month_of(moment):
+    return timezone.localtime(moment).date().replace(day=1)
+
+
+def _totals():
+    # rollup key -> [count, amount, result_amount, profit and the PLN sums]
+    return defaultdict(lambda: [0] + [Decimal(0)] * len(SUMS))
+
+
+def _add_up(totals, rows, series):
+    """
+    Adds *rows* of (key, amount, result_amount, profit, created_at) to
+    *totals*, where key is (profile id, month, visible_to, from_currency,
+    to_currency). The PLN values of the batch are computed in one go, at the
+    rates of *series*.
+    """
+    if not rows:
+        return
+    keys, amounts, results, profits, moments = zip(*rows)
+    from_currencies = [key[3] for key in keys]
+    to_currencies = [key[4] for key in keys]
+    pln = value_pln(
+        to_cents(amounts + results + profits),
+        from_currencies + to_currencies + to_currencies,
+        to_datetime64(moments * 3),
+        series,
+    )
+    pln = pln.reshape(3, len(rows)).T.tolist()
+    for key, amount, result, profit, values in zip(
+        keys, amounts, results, profits, pln
+    ):
+        total = totals[key]
+        total[0] += 1
+        for i, value in enumerate(
+            (amount, result, profit, *map(from_cents, values)), start=1
+        ):
+            total[i] += value
+
+
+def record_entries(journals, series):
+    """
+    Adds the (entry, postings) pairs in *journals* to the rollups, valued at
+    the rates of *series* (a rate_series() taken before the transaction
+    began). Call it in the transaction that saves the entries, after they
+    are saved.
+    """
+    totals = _totals()
+    _add_up(
+        totals,
+        [
+            (
+                (
+                    entry.user_id,
+                    month_of(entry.created_at),
+                    entry.visible_to,
+                    entry.from_currency,
+                    entry.to_currency,
+                ),
+                entry.amount,
+                entry.result_amount,
+                sum((p.amount for p in postings if p.kind == "profit"), Decimal(0)),
+                entry.created_at,
+            )
+            for entry, postings in journals
+        ],
+        series,
+    )
+
+    for key, (count, *sums) in totals.items():
+        profile_id, month, visible_to, from_currency, to_currency = key
+        rollup = MonthlyRollup.objects.filter(
+            profile_id=profile_id,
+            month=month,
+            visible_to=visible_to,
+            from_currency=from_currency,
+            to_currency=to_currency,
+        )
+        changes = {"count": F("count") + count}
+        changes.update({field: F(field) + value for field, value in zip(SUMS, sums)})
+        if rollup.update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                MonthlyRollup.objects.create(
+                    profile_id=profile_id,
+                    month=month,
+                    visible_to=visible_to,
+                    from_currency=from_currency,
+                    to_currency=to_currency,
+                    count=count,
+                    **dict(zip(SUMS, sums)),
+                )
+        except IntegrityError:
+            # created by a concurrent transfer in the meantime
+            rollup.update(**changes)
+
+
+def rebuild_rollups(first_month=None, last_month=None):
+    """
+    Recomputes the rollups of the months from *first_month* to *last_month*
+    (dates, inclusive; open-ended when None) from the ledger. Returns the
+    number of rollups written. The rollups are locked while the ledger is
+    read, so transfers wait until it is done: rebuild small ranges on a live
+    system.
+    """
+    entries = Transaction.objects.all()
+    rollups = MonthlyRollup.objects.all()
+    if first_month:
+        start = timezone.make_aware(datetime.combine(first_month, time()))
+        entries = entries.filter(created_at__gte=start)
+        rollups = rollups.filter(month__gte=first_month)
+    if last_month:
+        end = timezone.make_aware(
+            datetime.combine(last_month + relativedelta(months=1), time())
+        )
+        entries = entries.filter(created_at__lt=end)
+        rollups = rollups.filter(month__lte=last_month)
+
+    series = rate_series()
+    with transaction.atomic():
+        lock_table(MonthlyRollup)
+        rows = (
+            entries.annotate(
+                profit=Sum("postings__amount", filter=Q(postings__kind="profit"))
+            )
+            .values_list(
+                "user_id",
+                "visible_to",
+                "from_currency",
+                "to_currency",
+                "amount",
+                "result_amount",
+                "profit",
+                "created_at",
+            )
+            .order_by()
+            .iterator(chunk_size=REBUILD_CHUNK_SIZE)
+        )
+        totals = _totals()
+        while chunk := list(islice(rows, REBUILD_CHUNK_SIZE)):
+            _add_up(
+                totals,
+                [
+                    (
+                        (profile_id, month_of(created_at), kind, source, destination),
+                        amount,
+                        result_amount,
+                        profit or Decimal(0),
+                        created_at,
+                    )
+                    for (
+                        profile_id,
+                        kind,
+                        source,
+                        destination,
+                        amount,
+                        result_amount,
+                        profit,
+                        created_at,
+                    ) in chunk
+                ],
+                series,
+            )
+
+        built = [
+            MonthlyRollup(
+                profile_id=profile_id,
+                month=month,
+                visible_to=visible_to,
+                from_currency=from_currency,
+                to_currency=to_currency,
+                count=count,
+                **dict(zip(SUMS, sums)),
+            )
+            for (
+                profile_id,
+                month,
+                visible_to,
+                from_currency,
+                to_currency,
+            ), (count, *sums) in totals.items()
+        ]
+        rollups.delete()
+        MonthlyRollup.objects.bulk_create(built, batch_size=1000)
+    return len(built)
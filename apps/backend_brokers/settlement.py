@@ -0,0 +1,194 @@
+"""
+Queued settlement of transfers (settings.TRANSFER_SETTLEMENT = "queued").
+
+The web request only validates the transfer and stores a TransferRequest.
+settle_transfers workers drain the queue in micro-batches of one currency
+pair: the batch shares its rate lookups and books the house legs as two
+aggregated master wallet updates instead of pending postings.
+
+The promotional spread chosen when a transfer is queued is only a request:
+the worker checks the monthly limit again and settles the transfers over it
+at the standard spread.
+"""
+
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Max, Min
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .counters import record_transactions, transactions_this_month_by_profile
+from .cross_rates import SPREAD_PROMO, SPREAD_STANDARD, get_cross_rates
+from .models import TransferRequest, Wallet
+from .rollups import record_entries
+from .transfers import TransferError, book, journal, quote_transfer
+from .valuation import rate_series
+
+SETTLE_BATCH_SIZE = 200
+# settled transfers taken into account by queue_stats()
+LATENCY_WINDOW = timedelta(minutes=15)
+
+
+def enqueue(profile, source, destination, amount, spread):
+    """
+    Queues the transfer for settlement. Returns the TransferRequest.
+    """
+    return TransferRequest.objects.create(
+        profile=profile,
+        source=source,
+        destination=destination,
+        from_currency=source.currency,
+        to_currency=destination.currency,
+        amount=amount,
+        spread=spread,
+    )
+
+
+def settle_batch(batch_size=SETTLE_BATCH_SIZE):
+    """
+    Settles up to *batch_size* queued transfers for the currency pair of the
+    oldest one not taken by another worker. Returns the number of transfers
+    settled (done or failed).
+    """
+    queued = TransferRequest.objects.filter(status="queued")
+    series = rate_series()
+    with transaction.atomic():
+        head = (
+            queued.order_by("id")
+            .select_for_update(skip_locked=True)
+            .values("from_currency", "to_currency")
+            .first()
+        )
+        if head is None:
+            return 0
+        transfers = list(
+            queued.filter(**head)
+            .order_by("id")
+            .select_for_update(skip_locked=True)
+            .select_related("profile", "source", "destination")[:batch_size]
+        )
+        if not transfers:  # another worker holds them
+            return 0
+
+        wallet_ids = {r.source_id for r in transfers} | {
+            r.destination_id for r in transfers
+        }
+        wallets = {
+            wallet.pk: wallet
+            # locked in one order, so that workers cannot deadlock
+            for wallet in Wallet.objects.select_for_update()
+            .filter(pk__in=wallet_ids, wallet_status="active")
+            .order_by("pk")
+        }
+        snapshot = {pk: wallet.balance for pk, wallet in wallets.items()}
+        balances = dict(snapshot)
+        matrix = get_cross_rates()
+        now = timezone.now()
+        journals = []
+        house = defaultdict(Decimal)  # master wallet id -> change
+        # exchanges this month, counting the ones settled in this batch
+        counts = Counter(
+            transactions_this_month_by_profile({t.profile_id for t in transfers})
+        )
+
+        for transfer in transfers:
+            transfer.settled_at = now
+            try:
+                if (
+                    transfer.source_id not in wallets
+                    or transfer.destination_id not in wallets
+                ):
+                    raise TransferError(_("Nieznany portfel."))
+                source = wallets[transfer.source_id]
+                destination = wallets[transfer.destination_id]
+                if (
+                    transfer.spread == SPREAD_PROMO
+                    and counts[transfer.profile_id]
+                    >= transfer.profile.transaction_limit
+                ):
+                    transfer.spread = SPREAD_STANDARD
+                quote = quote_transfer(
+                    source, destination, transfer.amount, transfer.spread, matrix
+                )
+                if balances[source.pk] < transfer.amount:
+                    raise TransferError(_("Brak wystarczających środków."))
+            except TransferError as e:
+                transfer.status = "failed"
+                transfer.error = str(e)
+                continue
+
+            balances[source.pk] -= transfer.amount
+            balances[destination.pk] += quote.converted_amount
+            house[quote.house_buy] += transfer.amount
+            house[quote.house_sell] -= quote.converted_amount
+            entry, postings = journal(
+                transfer.profile,
+                source,
+                destination,
+                transfer.amount,
+                quote,
+                pending=False,
+            )
+            journals.append((entry, postings))
+            counts[transfer.profile_id] += 1
+            transfer.status = "done"
+            transfer.entry = entry
+
+        if journals:
+            try:
+                with transaction.atomic():
+                    book(snapshot, balances, journals)
+                    record_transactions(
+                        Counter(t.profile_id for t in transfers if t.status == "done")
+                    )
+                    record_entries(journals, series)
+                    for wallet_id, change in house.items():
+                        Wallet.objects.filter(pk=wallet_id).update(
+                            balance=F("balance") + change
+                        )
+            except TransferError as e:
+                # fail the batch rather than have every worker retry it
+                for transfer in transfers:
+                    if transfer.status == "done":
+                        transfer.status = "failed"
+                        transfer.error = str(e)
+                        transfer.entry = None
+        TransferRequest.objects.bulk_update(
+            transfers, ["status", "error", "entry", "spread", "settled_at"]
+        )
+    return len(transfers)
+
+
+def queue_stats():
+    """
+    Returns queue depth, the age of the oldest queued transfer and the
+    average and worst settlement latency over LATENCY_WINDOW, in seconds.
+    """
+    now = timezone.now()
+    queued = TransferRequest.objects.filter(status="queued").aggregate(
+        depth=Count("id"), oldest=Min("created_at")
+    )
+    latency = ExpressionWrapper(
+        F("settled_at") - F("created_at"), output_field=DurationField()
+    )
+    settled = (
+        TransferRequest.objects.exclude(status="queued")
+        .filter(settled_at__gte=now - LATENCY_WINDOW)
+        .annotate(latency=latency)
+        .aggregate(average=Avg("latency"), worst=Max("latency"))
+    )
+    return {
+        "depth": queued["depth"],
+        "oldest_age": (
+            (now - queued["oldest"]).total_seconds() if queued["oldest"] else 0.0
+        ),
+        "latency_avg": _seconds(settled["average"]),
+        "latency_max": _seconds(settled["worst"]),
+    }
+
+
+def _seconds(duration):
+    return duration.total_seconds() if duration is not None else None
@@ -0,0 +1,24 @@
+"""
+Table locks for the rebuild functions, which recompute a summary table from
+the ledger while transfers keep adding to it.
+
+Without the lock, an increment committed between the rebuild's read of the
+ledger and its delete of the old rows would be lost.
+"""
+
+from django.db import connection
+
+
+def lock_table(model):
+    """
+    Blocks writes to the table of *model* by other transactions until the
+    current one ends. Call it in a transaction, before reading the ledger.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+        else:
+            # SQLite locks the whole database for writing, and a write that
+            # changes nothing still takes the lock
+            cursor.execute(f"DELETE FROM {table} WHERE 1 = 0")
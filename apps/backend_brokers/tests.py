@@ -1,3 +1,1717 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import ProtectedError
+from django.test import AsyncRequestFactory, TestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+import nbp_client
+
+from . import cross_rates, house_accounts, transfers, valuation
+from .checkpoints import balance_as_of, take_checkpoints
+from .counters import current_month, rebuild_counters, transactions_this_month
+from .cross_rates import (
+    SPREAD_PROMO,
+    SPREAD_STANDARD,
+    CrossRateMatrix,
+    get_cross_rates,
+)
+from .models import (
+    BalanceCheckpoint,
+    ExchangeRate,
+    IdempotencyKey,
+    LatestRate,
+    MonthlyRollup,
+    MonthlyTransactionCounter,
+    Posting,
+    Profile,
+    RateFetchLog,
+    Transaction,
+    TransferRequest,
+    Wallet,
+    WalletLinkProgress,
+)
+from .exports import accepts_gzip
+from .history import decode_cursor, encode_cursor, link_wallets
+from .house_accounts import (
+    HOUSE_PROFILE_ID,
+    WALLET_REFRESH_INTERVAL,
+    house_position,
+    house_wallet_ids,
+    sweep,
+)
+from .management.commands.backfill_rates import query_windows, resume_date
+from .nbp_client import FIRST_TABLE_DATE, MAX_QUERY_DAYS, upsert_rates
+from .nbp_transport import NBPTransport, TransportResponse
+from .rate_history import RateHistory
+from .rate_snapshot import load_snapshot, save_snapshot
+from .rate_cache import RateCache, rate_cache
+from .rates import latest_rates
+from .rollups import rebuild_rollups
+from .settlement import queue_stats, settle_batch
+from .transfers import TransferError, execute_deposit, execute_transfer
+from .views import exchange_rates_view_async, total_user_balance_pln
+
+
+def table_a(effective_date, rates):
+    return {
+        "table": "A",
+        "effectiveDate": effective_date,
+        "rates": [{"code": code, "mid": mid} for code, mid in rates.items()],
+    }
+
+
+class StubNBPHandler(BaseHTTPRequestHandler):
+    """
+    Answers a GET with the table stored on the server, or 503 if there is none.
+    Honours If-None-Match like NBP's caching proxy. A date range query gets the
+    tables of the server's history in that range, or 404 if there are none.
+    """
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        date_range = re.search(r"/(\d{4}-\d{2}-\d{2})/(\d{4}-\d{2}-\d{2})/$", self.path)
+        if date_range:
+            start, end = date_range.groups()
+            tables = [
+                table
+                for table in self.server.history
+                if start <= table["effectiveDate"] <= end
+            ]
+            if not tables:
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = json.dumps(tables).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.server.table is None:
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = json.dumps([self.server.table]).encode()
+        etag = f'"{hash(body)}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubNBPServerMixin:
+    """
+    Runs a local HTTP server standing in for api.nbp.pl.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(("127.0.0.1", 0), StubNBPHandler)
+        cls.server.table = None
+        cls.server.history = []
+        cls.server.paths = []
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}/tables/A/"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def publish(self, effective_date, rates):
+        self.server.table = table_a(effective_date, rates)
+
+
+class UpsertRatesTests(TestCase):
+    def test_reports_inserted_updated_unchanged(self):
+        upsert_rates([({"EUR": 4.2, "USD": 3.6, "PLN": 1.0}, "2025-11-13")])
+
+        # savepoint, select, insert, select and insert LatestRate, release
+        with self.assertNumQueries(6):
+            result = upsert_rates(
+                [
+                    ({"EUR": 4.2, "USD": 3.7, "PLN": 1.0}, "2025-11-13"),
+                    ({"EUR": 4.3, "USD": 3.8, "PLN": 1.0}, "2025-11-14"),
+                ]
+            )
+
+        self.assertEqual(result, (2, 1, 1))
+        self.assertEqual(ExchangeRate.objects.count(), 4)
+        self.assertEqual(
+            ExchangeRate.objects.get(date=date(2025, 11, 13), currency="USD").rate,
+            Decimal("3.7"),
+        )
+        self.assertEqual(
+            dict(LatestRate.objects.values_list("currency", "date")),
+            {"EUR": date(2025, 11, 14), "USD": date(2025, 11, 14)},
+        )
+
+    def test_older_tables_do_not_replace_latest_rate(self):
+        upsert_rates([({"EUR": 4.3}, "2025-11-14")])
+
+        upsert_rates([({"EUR": 4.1}, "2024-01-02")])
+
+        self.assertEqual(latest_rates()["EUR"], Decimal("4.3"))
+
+
+class RateCacheTests(TestCase):
+    def setUp(self):
+        self.cache = RateCache()
+        patcher = mock.patch("apps.backend_brokers.rate_cache.timezone.now")
+        self.now = patcher.start()
+        self.addCleanup(patcher.stop)
+        upsert_rates([({"EUR": 4.2}, "2025-11-14")])  # a friday
+
+    def at(self, day, hour, minute=0):
+        self.now.return_value = datetime(
+            2025, 11, day, hour, minute, tzinfo=dt_timezone.utc
+        )
+
+    def test_table_is_kept_until_the_next_publication(self):
+        self.at(15, 9)
+        self.assertEqual(self.cache.get()[1], date(2025, 11, 14))
+        upsert_rates([({"EUR": 4.3}, "2025-11-17")])
+
+        # monday 12:00 in Warsaw, the new table is not due yet
+        self.at(17, 11)
+        with self.assertNumQueries(0):
+            rates, effective_date = self.cache.get()
+        self.assertEqual((rates["EUR"], effective_date), (4.2, date(2025, 11, 14)))
+
+        # monday 12:15 in Warsaw
+        self.at(17, 11, 15)
+        rates, effective_date = self.cache.get()
+        self.assertEqual((rates["EUR"], effective_date), (4.3, date(2025, 11, 17)))
+
+    def test_overdue_table_is_retried_after_an_interval(self):
+        self.at(17, 12)
+        self.assertEqual(self.cache.get()[1], date(2025, 11, 14))
+
+        self.at(17, 12, 10)
+        with self.assertNumQueries(0):
+            self.cache.get()
+        self.at(17, 12, 15)
+        with self.assertNumQueries(1):
+            self.cache.get()
+
+    def test_concurrent_readers_refresh_once(self):
+        self.at(15, 9)
+        loads = []
+
+        def slow_load():
+            loads.append(threading.get_ident())
+            time.sleep(0.05)
+            return {"EUR": 4.2, "PLN": 1.0}, date(2025, 11, 14)
+
+        readers = 8
+        barrier = threading.Barrier(readers)
+        tables = []
+
+        def read():
+            barrier.wait()
+            tables.append(self.cache.get())
+
+        with mock.patch(
+            "apps.backend_brokers.rate_cache.latest_stored_rates",
+            side_effect=slow_load,
+        ):
+            threads = [threading.Thread(target=read) for _ in range(readers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(len(tables), readers)
+        self.assertTrue(all(table[1] == date(2025, 11, 14) for table in tables))
+
+
+class AsyncExchangeRatesViewTests(TestCase):
+    def setUp(self):
+        upsert_rates([({"EUR": 4.2345}, "2025-11-14")])
+        rate_cache.invalidate()
+        self.addCleanup(rate_cache.invalidate)
+
+    async def test_serves_the_cached_table(self):
+        request = AsyncRequestFactory().get("/pl/rates/")
+        request.user = AnonymousUser()
+
+        response = await exchange_rates_view_async(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "1 EUR = 4,234 PLN")
+        self.assertContains(response, "14 listopada 2025")
+        # a fresh table comes straight from memory
+        with mock.patch(
+            "apps.backend_brokers.rate_cache.latest_stored_rates"
+        ) as latest_stored_rates:
+            response = await exchange_rates_view_async(request)
+        latest_stored_rates.assert_not_called()
+        self.assertContains(response, "1 EUR = 4,234 PLN")
+
+
+class CrossRateTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(cross_rates, "_matrix", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        rate_cache.invalidate()
+        self.addCleanup(rate_cache.invalidate)
+
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        self.snapshot_path = os.path.join(snapshot_dir.name, "rates_snapshot.json")
+        settings_override = self.settings(NBP_SNAPSHOT_PATH=self.snapshot_path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_cold_start_quotes_from_the_snapshot(self):
+        save_snapshot(self.snapshot_path, {"EUR": 4.0, "PLN": 1.0}, "2025-11-14")
+
+        matrix = get_cross_rates()
+        self.assertEqual(
+            matrix.quote("EUR", "PLN", SPREAD_STANDARD),
+            (Decimal("4"), Decimal("3.92")),
+        )
+
+        # refresh_rates stores the same table, the next load replaces the
+        # snapshot
+        upsert_rates([({"EUR": 4.0}, "2025-11-14")])
+        rate_cache.invalidate()
+        self.assertIsNot(get_cross_rates(), matrix)
+
+    def test_correction_rebuilds_the_matrix(self):
+        upsert_rates([({"EUR": 4.0}, "2025-11-14")])
+        matrix = get_cross_rates()
+        self.assertIs(get_cross_rates(), matrix)
+
+        # NBP corrects the table without changing its date
+        upsert_rates([({"EUR": 4.1}, "2025-11-14")])
+        rate_cache.invalidate()
+
+        matrix = get_cross_rates()
+        self.assertEqual(matrix.effective_date, date(2025, 11, 14))
+        self.assertEqual(matrix.quote("EUR", "PLN", SPREAD_STANDARD)[0], Decimal("4.1"))
+
+    def test_pairs_without_a_rate(self):
+        matrix = CrossRateMatrix({"EUR": 4.0, "PLN": 1.0}, date(2025, 11, 14))
+
+        self.assertEqual(
+            matrix.quote("PLN", "EUR", SPREAD_PROMO),
+            (Decimal("0.25"), Decimal("0.2475")),
+        )
+        self.assertEqual(matrix.quote("PLN", "USD", SPREAD_PROMO), (None, None))
+        self.assertEqual(matrix.quote("USD", "EUR", SPREAD_PROMO), (None, None))
+        self.assertEqual(matrix.quote("XXX", "PLN", SPREAD_PROMO), (None, None))
+        self.assertEqual(
+            CrossRateMatrix(None, None).quote("PLN", "PLN", SPREAD_PROMO),
+            (None, None),
+        )
+
+
+class RateHistoryTests(TestCase):
+    def setUp(self):
+        upsert_rates([({"EUR": 4.1}, "2025-11-13"), ({"EUR": 4.2}, "2025-11-14")])
+        self.history = RateHistory()
+
+    def test_rate_as_of_uses_newest_table_on_or_before_the_day(self):
+        rates = self.history.rates_as_of(
+            [
+                ("EUR", date(2025, 11, 13)),
+                ("EUR", date(2025, 11, 16)),  # sunday, friday's table applies
+                ("EUR", date(2025, 11, 12)),  # before the first table
+                ("PLN", date(2025, 11, 12)),
+                # before publication the previous day's table applies
+                ("EUR", datetime(2025, 11, 14, 9, 0, tzinfo=dt_timezone.utc)),
+            ]
+        )
+
+        self.assertEqual(
+            rates, [Decimal("4.1"), Decimal("4.2"), None, Decimal(1), Decimal("4.1")]
+        )
+
+    def test_refresh_picks_up_new_and_corrected_rates(self):
+        self.history.refresh()
+        upsert_rates([({"EUR": 4.0}, "2025-11-10"), ({"EUR": 4.25}, "2025-11-14")])
+
+        self.history.refresh(force=True)
+
+        self.assertEqual(
+            self.history.rate_as_of("EUR", date(2025, 11, 11)), Decimal("4.0")
+        )
+        self.assertEqual(
+            self.history.rate_as_of("EUR", date(2025, 11, 14)), Decimal("4.25")
+        )
+
+
+class RefreshRatesCommandTests(StubNBPServerMixin, TestCase):
+    def setUp(self):
+        # a fresh transport, so no ETags are remembered from other tests
+        patcher = mock.patch(
+            "apps.backend_brokers.nbp_client.default_transport", NBPTransport()
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        self.snapshot_path = os.path.join(snapshot_dir.name, "rates_snapshot.json")
+        settings_override = self.settings(NBP_SNAPSHOT_PATH=self.snapshot_path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def refresh(self):
+        call_command("refresh_rates", base_url=self.base_url, stdout=StringIO())
+        return RateFetchLog.objects.latest("id")
+
+    def test_stores_table(self):
+        self.publish("2025-11-14", {"EUR": 4.2345, "USD": 3.6512})
+
+        log = self.refresh()
+
+        self.assertEqual(log.status, "ok")
+        self.assertEqual(log.rows_changed, 2)
+        self.assertEqual(log.effective_date, date(2025, 11, 14))
+        self.assertEqual(
+            ExchangeRate.objects.get(currency="EUR").rate, Decimal("4.2345")
+        )
+        snapshot = load_snapshot(self.snapshot_path)
+        self.assertEqual(snapshot["effective_date"], "2025-11-14")
+        self.assertEqual(snapshot["rates"]["USD"], 3.6512)
+
+    def test_writes_only_changed_rows(self):
+        self.publish("2025-11-14", {"EUR": 4.2345, "USD": 3.6512})
+        self.refresh()
+
+        self.publish("2025-11-14", {"EUR": 4.2345, "USD": 3.6600})
+        log = self.refresh()
+
+        self.assertEqual(log.rows_changed, 1)
+        self.assertEqual(ExchangeRate.objects.count(), 2)
+        self.assertEqual(ExchangeRate.objects.get(currency="USD").rate, Decimal("3.66"))
+
+    def test_unchanged_table_costs_a_304(self):
+        self.publish("2025-11-14", {"EUR": 4.2345, "USD": 3.6512})
+        self.refresh()
+
+        with mock.patch(
+            "apps.backend_brokers.nbp_client.NBPClient.save_to_db"
+        ) as save_to_db:
+            log = self.refresh()
+
+        save_to_db.assert_not_called()
+        self.assertEqual(log.status, "ok")
+        self.assertEqual(log.rows_changed, 0)
+        self.assertEqual(log.effective_date, date(2025, 11, 14))
+
+    def test_records_failure(self):
+        self.server.table = None
+
+        with mock.patch("apps.backend_brokers.nbp_transport.time.sleep") as sleep:
+            log = self.refresh()
+
+        self.assertEqual(sleep.call_count, 3)  # retried before giving up
+        self.assertEqual(log.status, "error")
+        self.assertIn("503", log.error)
+        self.assertFalse(ExchangeRate.objects.exists())
+
+
+class BackfillRatesCommandTests(StubNBPServerMixin, TestCase):
+    def setUp(self):
+        patcher = mock.patch(
+            "apps.backend_brokers.nbp_client.default_transport", NBPTransport()
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server.paths = []
+        self.server.history = [
+            table_a("2025-01-02", {"EUR": 4.27}),
+            table_a("2025-01-03", {"EUR": 4.28}),
+            table_a("2025-06-30", {"EUR": 4.24}),
+        ]
+
+    def backfill(self, *args):
+        call_command(
+            "backfill_rates",
+            "--base-url",
+            self.base_url,
+            "--workers",
+            "1",
+            *args,
+            stdout=StringIO(),
+        )
+        return [path.split("/tables/A/")[1] for path in self.server.paths]
+
+    def test_query_windows(self):
+        windows = query_windows(date(2025, 1, 1), date(2025, 6, 30))
+
+        self.assertEqual(
+            windows,
+            [
+                (date(2025, 1, 1), date(2025, 4, 3)),
+                (date(2025, 4, 4), date(2025, 6, 30)),
+            ],
+        )
+        for start, end in windows:
+            self.assertLessEqual((end - start).days + 1, MAX_QUERY_DAYS)
+
+    def test_windows_without_tables_are_skipped(self):
+        # the second window has no tables, NBP answers 404
+        self.server.history = self.server.history[:2]
+
+        paths = self.backfill("--start", "2025-01-01", "--end", "2025-06-30")
+
+        self.assertEqual(paths, ["2025-01-01/2025-04-03/", "2025-04-04/2025-06-30/"])
+        self.assertEqual(
+            sorted(ExchangeRate.objects.values_list("date", flat=True)),
+            [date(2025, 1, 2), date(2025, 1, 3)],
+        )
+
+    def test_resumes_at_the_earliest_gap(self):
+        self.assertEqual(resume_date(), FIRST_TABLE_DATE)
+        # a stray row from before NBP published table A is not history
+        upsert_rates([({"EUR": 4.0}, "2000-01-01")])
+        self.assertEqual(resume_date(), FIRST_TABLE_DATE)
+        # the first table is stored, then nothing until the one refresh_rates
+        # stored today
+        upsert_rates([({"EUR": 4.27}, "2025-01-02"), ({"EUR": 4.24}, "2025-06-30")])
+
+        with mock.patch(
+            "apps.backend_brokers.management.commands.backfill_rates"
+            ".FIRST_TABLE_DATE",
+            date(2025, 1, 2),
+        ):
+            paths = self.backfill("--end", "2025-06-30")
+
+        self.assertEqual(paths, ["2025-01-03/2025-04-05/", "2025-04-06/2025-06-30/"])
+        self.assertTrue(ExchangeRate.objects.filter(date=date(2025, 1, 3)).exists())
+
+    def test_rollups_are_revalued_with_the_loaded_history(self):
+        profile = Profile.objects.create(user=User.objects.create_user("customer"))
+        entry = Transaction.objects.create(
+            user=profile,
+            source_iban="PL1",
+            destination_iban="PL2",
+            from_currency="EUR",
+            to_currency="PLN",
+            amount=Decimal(10),
+            rate=Decimal(4),
+            result_amount=Decimal(40),
+            visible_to="user",
+        )
+        Transaction.objects.filter(pk=entry.pk).update(
+            created_at=datetime(2025, 1, 3, 13, 0, tzinfo=dt_timezone.utc)
+        )
+        history = RateHistory()
+        with (
+            mock.patch.object(valuation, "rate_history", history),
+            mock.patch(
+                "apps.backend_brokers.management.commands.backfill_rates.rate_history",
+                history,
+            ),
+        ):
+            rebuild_rollups()
+            # no EUR table stored yet
+            self.assertEqual(MonthlyRollup.objects.get().amount_pln, 0)
+
+            self.backfill("--start", "2025-01-01", "--end", "2025-01-31")
+
+        self.assertEqual(MonthlyRollup.objects.get().amount_pln, Decimal("42.80"))
+
+
+class CommandLineClientTests(TestCase):
+    def setUp(self):
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        self.snapshot_path = os.path.join(snapshot_dir.name, "rates_snapshot.json")
+        save_snapshot(self.snapshot_path, {"EUR": 4.0, "PLN": 1.0}, "2025-11-13")
+        self.transport = mock.Mock()
+
+    def nbp(self, **kwargs):
+        return nbp_client.NBPClient(
+            transport=self.transport, snapshot_path=self.snapshot_path, **kwargs
+        )
+
+    def test_starts_from_the_snapshot_and_refreshes_in_the_background(self):
+        fetching = threading.Event()
+        release = threading.Event()
+        table = table_a("2025-11-14", {"EUR": 4.2345})
+
+        def get_json(url, conditional=False):
+            fetching.set()
+            release.wait(5)
+            return TransportResponse([table], False)
+
+        self.transport.get_json.side_effect = get_json
+
+        client = self.nbp()
+        self.assertTrue(fetching.wait(5))
+        self.assertEqual(client.rates, {"EUR": 4.0, "PLN": 1.0})
+        self.assertEqual(client.effective_date, "2025-11-13")
+
+        release.set()
+        # the snapshot file is written last
+        for _i in range(500):
+            if load_snapshot(self.snapshot_path)["effective_date"] == "2025-11-14":
+                break
+            time.sleep(0.01)
+        self.assertEqual(load_snapshot(self.snapshot_path)["rates"]["EUR"], 4.2345)
+        self.assertEqual(client.rates, {"EUR": 4.2345, "PLN": 1.0})
+        self.assertIn("as of 2025-11-14", client.show_current_rates())
+
+    def test_failed_refresh_keeps_the_snapshot(self):
+        self.transport.get_json.side_effect = requests.exceptions.ConnectionError
+
+        client = self.nbp(background=False)
+
+        self.assertEqual(client.rates, {"EUR": 4.0, "PLN": 1.0})
+        self.assertEqual(client.effective_date, "2025-11-13")
+        self.assertEqual(
+            load_snapshot(self.snapshot_path)["effective_date"], "2025-11-13"
+        )
+
+    def test_snapshot_is_shared_with_the_web_app(self):
+        self.assertEqual(
+            os.path.abspath(nbp_client.SNAPSHOT_PATH),
+            os.path.abspath(settings.NBP_SNAPSHOT_PATH),
+        )
+
+
+class WalletsMixin:
+    """
+    A customer with a PLN and an EUR wallet, house wallets and one rate table.
+    """
+
+    def setUp(self):
+        house_user = User.objects.create_user("house", is_superuser=True)
+        self.house = Profile.objects.create(id=HOUSE_PROFILE_ID, user=house_user)
+        for currency in ("PLN", "EUR", "USD"):
+            Wallet.objects.create(
+                user=self.house,
+                wallet_id=f"house-{currency}",
+                currency=currency,
+                iban=f"HOUSE{currency}",
+                balance=100000,
+            )
+        user = User.objects.create_user("customer", password="secret")
+        # the wallet views look wallets up by user id
+        self.profile = Profile.objects.create(id=user.id, user=user)
+        self.pln = Wallet.objects.create(
+            user=self.profile, wallet_id="1", currency="PLN", iban="PL1", balance=1000
+        )
+        self.eur = Wallet.objects.create(
+            user=self.profile, wallet_id="2", currency="EUR", iban="PL2", balance=0
+        )
+        self.usd = Wallet.objects.create(
+            user=self.profile, wallet_id="3", currency="USD", iban="PL3", balance=0
+        )
+        upsert_rates([({"EUR": 4.0, "USD": 3.5}, "2025-11-14")])
+        rate_cache.invalidate()
+        for patcher in (
+            mock.patch.object(cross_rates, "_matrix", None),
+            mock.patch.object(house_accounts, "_wallet_ids", (None, {})),
+            mock.patch.object(valuation, "rate_history", RateHistory()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def neighbour(self):
+        """
+        Returns a user whose id is the id of another customer's profile, and
+        that customer's wallet: profile ids need not match user ids.
+        """
+        owner = Profile.objects.create(id=9000, user=User.objects.create_user("owner"))
+        wallet = Wallet.objects.create(
+            user=owner, wallet_id="9000", currency="PLN", iban="PL9000", balance=50
+        )
+        user = User.objects.create_user("neighbour", id=9000)
+        Profile.objects.create(id=9001, user=user)
+        return user, wallet
+
+    def house_balances(self):
+        return dict(
+            Wallet.objects.filter(user=self.house).values_list("currency", "balance")
+        )
+
+    def balance(self, wallet):
+        wallet.refresh_from_db()
+        return wallet.balance
+
+
+class ExecuteTransferTests(WalletsMixin, TestCase):
+    def test_transfer_moves_funds_and_writes_ledger(self):
+        result = execute_transfer(
+            self.profile, self.pln, self.eur, Decimal("400"), SPREAD_STANDARD
+        )
+
+        self.assertEqual(result.result_amount, Decimal("98.00"))
+        self.assertEqual(self.balance(self.pln), Decimal("600.00"))
+        self.assertEqual(self.balance(self.eur), Decimal("98.00"))
+        postings = result.postings.all()
+        self.assertEqual(len(postings), 5)
+        for currency in ("PLN", "EUR"):
+            self.assertEqual(
+                sum(p.amount for p in postings if p.currency == currency), 0
+            )
+        profit = postings.get(kind="profit")
+        self.assertEqual(
+            (profit.wallet.currency, profit.amount), ("EUR", Decimal("2.00"))
+        )
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_wallet_with_postings_cannot_be_deleted(self):
+        execute_transfer(self.profile, self.pln, self.eur, Decimal(4), SPREAD_STANDARD)
+
+        with self.assertRaises(ProtectedError):
+            self.eur.delete()
+        self.assertTrue(Posting.objects.filter(wallet=self.eur).exists())
+
+    def test_wallet_with_checkpoints_cannot_be_deleted(self):
+        BalanceCheckpoint.objects.create(
+            wallet=self.usd, as_of=timezone.now(), last_entry_id=0, balance=0
+        )
+
+        with self.assertRaises(ProtectedError):
+            self.usd.delete()
+
+    def test_insufficient_funds_changes_nothing(self):
+        with self.assertRaises(TransferError) as raised:
+            execute_transfer(
+                self.profile, self.pln, self.eur, Decimal("1000.01"), SPREAD_STANDARD
+            )
+
+        self.assertEqual(raised.exception.field, "amount")
+        self.assertEqual(self.balance(self.pln), Decimal("1000.00"))
+        self.assertEqual(self.balance(self.eur), Decimal("0.00"))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_stale_balance_cannot_overdraw(self):
+        # both requests loaded the wallet with 1000 PLN before either debited it
+        execute_transfer(
+            self.profile, self.pln, self.eur, Decimal("700"), SPREAD_STANDARD
+        )
+        with self.assertRaises(TransferError):
+            execute_transfer(
+                self.profile, self.pln, self.eur, Decimal("700"), SPREAD_STANDARD
+            )
+        self.assertEqual(self.balance(self.pln), Decimal("300.00"))
+
+    def test_query_count(self):
+        execute_transfer(self.profile, self.pln, self.eur, Decimal(1), SPREAD_STANDARD)
+        # savepoint pair, debit, credit, entry, postings, monthly counter,
+        # monthly rollup
+        with self.assertNumQueries(8):
+            execute_transfer(
+                self.profile, self.pln, self.eur, Decimal(1), SPREAD_STANDARD
+            )
+
+
+class HouseAccountsTests(WalletsMixin, TestCase):
+    def test_house_legs_wait_for_the_sweep(self):
+        execute_transfer(
+            self.profile, self.pln, self.eur, Decimal("400"), SPREAD_STANDARD
+        )
+        before = self.house_balances()
+        position = house_position()
+
+        self.assertEqual(before["PLN"], Decimal("100000.00"))
+        self.assertEqual(position["PLN"], Decimal("100400.00"))
+        self.assertEqual(position["EUR"], Decimal("99902.00"))
+
+        sweep(batch_size=2)
+
+        self.assertEqual(self.house_balances(), position)
+        self.assertEqual(house_position(), position)
+        self.assertFalse(Posting.objects.filter(pending=True).exists())
+
+    def test_pln_balance_includes_unswept_legs(self):
+        execute_transfer(
+            self.profile, self.pln, self.eur, Decimal("400"), SPREAD_STANDARD
+        )
+        position = house_position()
+        expected = (
+            position["PLN"] + position["EUR"] * 4 + position["USD"] * Decimal("3.5")
+        )
+
+        self.assertEqual(total_user_balance_pln(self.house), expected)
+        sweep()
+        self.assertEqual(total_user_balance_pln(self.house), expected)
+
+    def test_replaced_master_wallet_is_picked_up(self):
+        [old_id] = house_wallet_ids("EUR")
+        Wallet.objects.filter(pk=old_id).update(wallet_status="deleted")
+        replacement = Wallet.objects.create(
+            user=self.house, wallet_id="house-EUR-2", currency="EUR", iban="HOUSEEUR2"
+        )
+
+        self.assertEqual(house_wallet_ids("EUR"), [old_id])
+        later = timezone.now() + WALLET_REFRESH_INTERVAL
+        with mock.patch(
+            "apps.backend_brokers.house_accounts.timezone.now", return_value=later
+        ):
+            self.assertEqual(house_wallet_ids("EUR"), [replacement.pk])
+
+
+class BatchTransferTests(WalletsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.profile.account_type = "business"
+        self.profile.save()
+        self.client.force_login(self.profile.user)
+
+    def post(self, transfers):
+        return self.client.post(
+            "/pl/api/transfers/batch/",
+            json.dumps({"transfers": transfers}),
+            content_type="application/json",
+        )
+
+    def item(self, amount, source=None, destination=None):
+        return {
+            "source_wallet": (source or self.pln).pk,
+            "destination_wallet": (destination or self.eur).pk,
+            "amount": amount,
+        }
+
+    def test_items_are_checked_in_order(self):
+        response = self.post(
+            [
+                self.item("600"),
+                self.item("500"),  # only 400 PLN left
+                self.item("50", self.eur, self.pln),  # spends the EUR just bought
+                self.item("1.001"),
+            ]
+        )
+
+        results = response.json()["results"]
+        self.assertEqual([r["status"] for r in results], ["ok", "error", "ok", "error"])
+        self.assertEqual(results[0]["result_amount"], "148.50")
+        self.assertEqual(self.balance(self.pln), Decimal("598.00"))
+        self.assertEqual(self.balance(self.eur), Decimal("98.50"))
+        self.assertEqual(
+            Transaction.objects.filter(visible_to="user").count(),
+            2,
+        )
+        self.assertEqual(results[2]["transaction_id"], Transaction.objects.last().pk)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        self.post([self.item("1")])
+        # session, user, profile, monthly count, wallets, savepoint pair,
+        # two balance updates, entries, postings, monthly counter, monthly
+        # rollup (SQLite splits inserts of more than 999 parameters, so the
+        # batch is kept below that)
+        for size in (1, 20):
+            with self.assertNumQueries(13):
+                response = self.post([self.item("1")] * size)
+            self.assertEqual(len(response.json()["results"]), size)
+
+    def test_replay_returns_the_first_response(self):
+        headers = {"HTTP_IDEMPOTENCY_KEY": "batch-1"}
+        first = self.client.post(
+            "/pl/api/transfers/batch/",
+            json.dumps({"transfers": [self.item("100")]}),
+            content_type="application/json",
+            **headers,
+        )
+        replay = self.client.post(
+            "/pl/api/transfers/batch/",
+            json.dumps({"transfers": [self.item("100")]}),
+            content_type="application/json",
+            **headers,
+        )
+
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(replay["Idempotent-Replayed"], "true")
+        self.assertEqual(self.balance(self.pln), Decimal("900.00"))
+
+    def test_personal_accounts_are_refused(self):
+        self.profile.account_type = "personal"
+        self.profile.save()
+
+        self.assertEqual(self.post([self.item("1")]).status_code, 403)
+
+    def test_changed_balance_rolls_back_the_batch(self):
+        quote_transfer = transfers.quote_transfer
+
+        def spend_meanwhile(*args, **kwargs):
+            # another request empties the wallet after the snapshot was taken
+            Wallet.objects.filter(pk=self.pln.pk).update(balance=Decimal("100"))
+            return quote_transfer(*args, **kwargs)
+
+        with mock.patch.object(transfers, "quote_transfer", spend_meanwhile):
+            response = self.post([self.item("300")])
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.balance(self.eur), Decimal("0.00"))
+        self.assertFalse(Transaction.objects.exists())
+
+
+class IdempotencyKeyTests(WalletsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.profile.user)
+
+    def transfer(self, key):
+        return self.client.post(
+            "/pl/wallets/transfer",
+            {
+                "source_wallet": self.pln.pk,
+                "destination_wallet": self.eur.pk,
+                "amount": "400",
+                "idempotency_key": key,
+            },
+        )
+
+    def test_resubmitted_transfer_runs_once(self):
+        self.transfer("form-1")
+        response = self.transfer("form-1")
+
+        self.assertRedirects(response, "/pl/wallets/", fetch_redirect_response=False)
+        self.assertEqual(self.balance(self.pln), Decimal("600.00"))
+        self.assertEqual(Transaction.objects.count(), 1)
+        record = IdempotencyKey.objects.get()
+        self.assertEqual(record.result["transaction_id"], Transaction.objects.get().pk)
+
+        self.transfer("form-2")
+        self.assertEqual(self.balance(self.pln), Decimal("200.00"))
+
+    def test_failed_attempt_can_be_retried(self):
+        Wallet.objects.filter(pk=self.pln.pk).update(balance=100)
+        self.transfer("form-1")
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        Wallet.objects.filter(pk=self.pln.pk).update(balance=1000)
+        self.transfer("form-1")
+        self.assertEqual(self.balance(self.pln), Decimal("600.00"))
+
+    def test_transfer_is_prepared_before_anything_is_written(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.transfer("form-1")
+
+        statements = [query["sql"] for query in queries.captured_queries]
+        first_write = next(
+            i
+            for i, sql in enumerate(statements)
+            if sql.startswith(("INSERT", "UPDATE"))
+        )
+        rates_read = next(
+            i
+            for i, sql in enumerate(statements)
+            if "backend_brokers_exchangerate" in sql
+        )
+        self.assertLess(rates_read, first_write)
+        self.assertTrue(IdempotencyKey.objects.filter(key="form-1").exists())
+
+    def test_expired_keys_are_purged(self):
+        self.transfer("form-1")
+        IdempotencyKey.objects.update(
+            created_at=datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+        )
+
+        call_command("purge_idempotency_keys", stdout=StringIO())
+
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+@override_settings(TRANSFER_SETTLEMENT="queued")
+class QueuedSettlementTests(WalletsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.profile.user)
+
+    def transfer(self, amount, source=None, destination=None):
+        response = self.client.post(
+            "/pl/wallets/transfer",
+            {
+                "source_wallet": (source or self.pln).pk,
+                "destination_wallet": (destination or self.eur).pk,
+                "amount": amount,
+            },
+        )
+        return TransferRequest.objects.get(token=response["Location"].split("/")[-2])
+
+    def test_transfer_is_settled_by_the_worker(self):
+        first = self.transfer("400")
+        second = self.transfer("700")  # passes the check, fails at settlement
+        self.assertEqual(self.balance(self.pln), Decimal("1000.00"))
+
+        call_command("settle_transfers", stdout=StringIO())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status, second.status), ("done", "failed"))
+        self.assertEqual(first.entry.result_amount, Decimal("99.00"))
+        self.assertEqual(self.balance(self.pln), Decimal("600.00"))
+        self.assertEqual(self.balance(self.eur), Decimal("99.00"))
+        # the house legs were booked straight into the master wallets
+        self.assertEqual(self.house_balances(), house_position())
+        self.assertEqual(house_position()["PLN"], Decimal("100400.00"))
+
+        status = self.client.get(f"/pl/api/transfers/{first.token}/").json()
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["result_amount"], "99.00")
+
+    def test_key_of_another_operation_is_refused(self):
+        IdempotencyKey.objects.create(
+            profile=self.profile, key="form-1", scope="deposit", result={"id": 1}
+        )
+
+        response = self.client.post(
+            "/pl/wallets/transfer",
+            {
+                "source_wallet": self.pln.pk,
+                "destination_wallet": self.eur.pk,
+                "amount": "100",
+                "idempotency_key": "form-1",
+            },
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(TransferRequest.objects.exists())
+
+    @skipUnless(
+        not connection.features.has_select_for_update_skip_locked,
+        "the database can skip locked rows",
+    )
+    def test_parallel_workers_need_skip_locked(self):
+        self.transfer("100")
+
+        with self.assertRaises(CommandError):
+            call_command("settle_transfers", "--workers", "4", stdout=StringIO())
+        self.assertEqual(TransferRequest.objects.get().status, "queued")
+
+    def test_batches_hold_one_currency_pair(self):
+        self.transfer("100")
+        self.transfer("100", self.pln, self.usd)
+        self.transfer("100")
+
+        self.assertEqual(settle_batch(), 2)
+        self.assertEqual(
+            TransferRequest.objects.get(status="queued").to_currency, "USD"
+        )
+
+        stats = queue_stats()
+        self.assertEqual(stats["depth"], 1)
+        self.assertIsNotNone(stats["latency_max"])
+
+    def test_promo_limit_is_checked_at_settlement(self):
+        MonthlyTransactionCounter.objects.create(
+            profile=self.profile,
+            month=current_month(),
+            count=self.profile.transaction_limit - 1,
+        )
+        first = self.transfer("100")
+        second = self.transfer("100")  # queued at the promotional spread too
+        self.assertEqual(second.spread, SPREAD_PROMO)
+
+        settle_batch()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.entry.result_amount, Decimal("24.75"))
+        self.assertEqual(second.spread, SPREAD_STANDARD)
+        self.assertEqual(second.entry.result_amount, Decimal("24.50"))
+
+    def test_failed_booking_fails_the_batch(self):
+        request = self.transfer("100")
+        error = TransferError("Saldo portfela zmieniło się w trakcie operacji.")
+
+        with mock.patch("apps.backend_brokers.settlement.book", side_effect=error):
+            self.assertEqual(settle_batch(), 1)
+
+        request.refresh_from_db()
+        self.assertEqual(request.status, "failed")
+        self.assertIsNone(request.entry)
+        self.assertEqual(self.balance(self.pln), Decimal("1000.00"))
+        self.assertEqual(settle_batch(), 0)
+
+
+class MonthlyCounterTests(WalletsMixin, TestCase):
+    def test_transfers_update_the_counter(self):
+        execute_transfer(self.profile, self.pln, self.eur, Decimal(1), SPREAD_STANDARD)
+        self.profile.account_type = "business"
+        self.profile.save()
+        self.client.force_login(self.profile.user)
+        self.client.post(
+            "/pl/api/transfers/batch/",
+            json.dumps(
+                {
+                    "transfers": [
+                        {
+                            "source_wallet": self.pln.pk,
+                            "destination_wallet": self.eur.pk,
+                            "amount": "1",
+                        }
+                    ]
+                    * 3
+                }
+            ),
+            content_type="application/json",
+        )
+
+        with self.assertNumQueries(1):
+            self.assertEqual(transactions_this_month(self.profile.pk), 4)
+
+    def test_rebuild_matches_history(self):
+        execute_transfer(self.profile, self.pln, self.eur, Decimal(1), SPREAD_STANDARD)
+        execute_transfer(self.profile, self.pln, self.eur, Decimal(1), SPREAD_STANDARD)
+        Transaction.objects.update(
+            created_at=datetime(2025, 3, 5, tzinfo=dt_timezone.utc)
+        )
+
+        call_command("rebuild_transaction_counters", stdout=StringIO())
+
+        counter = MonthlyTransactionCounter.objects.get()
+        self.assertEqual((counter.month, counter.count), (date(2025, 3, 1), 2))
+        self.assertEqual(transactions_this_month(self.profile.pk), 0)
+
+    def test_rebuild_locks_the_counters_before_reading(self):
+        with CaptureQueriesContext(connection) as queries:
+            rebuild_counters()
+
+        statements = [query["sql"] for query in queries.captured_queries]
+        locked = next(
+            i for i, sql in enumerate(statements) if "monthlytransactioncounter" in sql
+        )
+        read = next(
+            i
+            for i, sql in enumerate(statements)
+            if "backend_brokers_transaction" in sql
+        )
+        self.assertLess(locked, read)
+
+
+class WalletHistoryTests(WalletsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.profile.user)
+        for i in range(45):
+            entry = execute_deposit(self.profile, self.pln, Decimal(1))
+            # pairs of entries share a timestamp, so the id breaks the tie
+            Transaction.objects.filter(pk=entry.pk).update(
+                created_at=datetime(2025, 1, 1 + i // 2, tzinfo=dt_timezone.utc)
+            )
+        execute_deposit(self.profile, self.eur, Decimal(1))
+
+    def test_pages_walk_the_whole_history_once(self):
+        response = self.client.get(f"/pl/wallet/{self.pln.pk}/")
+        seen = [tx.pk for tx in response.context["transactions"]]
+        cursor = response.context["next_cursor"]
+        while cursor:
+            with self.assertNumQueries(4):
+                response = self.client.get(
+                    f"/pl/wallet/{self.pln.pk}/history/", {"cursor": cursor}
+                )
+            seen += [tx.pk for tx in response.context["transactions"]]
+            cursor = response.context["next_cursor"]
+
+        expected = Transaction.objects.filter(destination_wallet=self.pln).order_by(
+            "-created_at", "-id"
+        )
+        self.assertEqual(seen, [tx.pk for tx in expected])
+        self.assertEqual(len(seen), 45)
+
+    def test_cursor_round_trip(self):
+        entry = Transaction.objects.first()
+        entry.created_at = datetime(
+            2025, 1, 1, 12, 0, 0, 123456, tzinfo=dt_timezone.utc
+        )
+        cursor = encode_cursor(entry)
+        self.assertEqual(cursor, f"1735732800123456-{entry.pk}")
+        self.assertEqual(decode_cursor(cursor), (entry.created_at, entry.pk))
+
+    def test_older_transactions_are_linked_by_iban(self):
+        fields = dict(
+            user=self.profile,
+            from_currency="PLN",
+            to_currency="EUR",
+            amount=Decimal(4),
+            rate=Decimal("0.25"),
+            result_amount=Decimal(1),
+        )
+        exchange = Transaction.objects.create(
+            source_iban="PL1", destination_iban="PL2", visible_to="user", **fields
+        )
+        deposit = Transaction.objects.create(
+            source_iban="PL3", destination_iban="PL3", visible_to="deposit", **fields
+        )
+
+        call_command("link_transaction_wallets", batch_size=1, stdout=StringIO())
+
+        exchange.refresh_from_db()
+        deposit.refresh_from_db()
+        self.assertEqual(exchange.source_wallet, self.pln)
+        self.assertEqual(exchange.destination_wallet, self.eur)
+        self.assertIsNone(deposit.source_wallet)
+        self.assertEqual(deposit.destination_wallet, self.usd)
+        response = self.client.get(f"/pl/wallet/{self.usd.pk}/")
+        self.assertEqual(list(response.context["transactions"]), [deposit])
+
+    def test_linking_resumes_after_the_previous_run(self):
+        fields = dict(
+            user=self.profile,
+            from_currency="PLN",
+            to_currency="EUR",
+            amount=Decimal(4),
+            rate=Decimal("0.25"),
+            result_amount=Decimal(1),
+        )
+        leftover = Transaction.objects.create(
+            source_iban="PL1",
+            destination_iban="PL2",
+            visible_to="admin-profit",
+            **fields,
+        )
+        unknown = Transaction.objects.create(
+            source_iban="XX1", destination_iban="XX2", visible_to="user", **fields
+        )
+
+        self.assertEqual(link_wallets(), 0)
+        leftover.refresh_from_db()
+        self.assertIsNone(leftover.destination_wallet)
+        self.assertEqual(WalletLinkProgress.objects.get().last_id, unknown.pk)
+        # the mark and one empty batch, in a savepoint
+        with self.assertNumQueries(4):
+            self.assertEqual(link_wallets(), 0)
+
+    def test_bad_cursor_is_refused(self):
+        response = self.client.get(
+            f"/pl/wallet/{self.pln.pk}/history/", {"cursor": "yesterday"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_out_of_range_cursor_is_refused(self):
+        response = self.client.get(
+            f"/pl/wallet/{self.pln.pk}/history/", {"cursor": f"{10**30}-1"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTests(WalletsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.profile.user)
+        execute_deposit(self.profile, self.pln, Decimal(10))
+        execute_transfer(self.profile, self.pln, self.eur, Decimal(4), SPREAD_STANDARD)
+        older = execute_deposit(self.profile, self.usd, Decimal(5))
+        Transaction.objects.filter(pk=older.pk).update(
+            created_at=datetime(2025, 3, 5, tzinfo=dt_timezone.utc)
+        )
+
+    def export(self, url, headers=None):
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content)
+
+    def test_wallet_csv(self):
+        response, body = self.export(f"/pl/wallet/{self.pln.pk}/export/")
+
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        lines = body.decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:3], ["id", "created_at", "source_iban"])
+        self.assertEqual(
+            [line.split(",")[-1] for line in lines[1:]], ["deposit", "user"]
+        )
+
+    def test_profile_ndjson_in_date_range(self):
+        _response, body = self.export(
+            "/pl/profile/export/?format=ndjson&from=2025-03-01&to=2025-03-05"
+        )
+
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(
+            (rows[0]["destination_iban"], rows[0]["amount"]), ("PL3", "5.00")
+        )
+
+    def test_gzip(self):
+        response, body = self.export(
+            "/pl/profile/export/?format=ndjson", {"Accept-Encoding": "gzip, br"}
+        )
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(len(gzip.decompress(body).splitlines()), 3)
+
+    def test_gzip_refused_by_q_value(self):
+        response, body = self.export(
+            "/pl/profile/export/?format=ndjson", {"Accept-Encoding": "gzip;q=0, br"}
+        )
+
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(len(body.splitlines()), 3)
+        self.assertTrue(accepts_gzip("br;q=1.0, *;q=0.5"))
+        self.assertFalse(accepts_gzip("*, gzip; q=0.000"))
+
+    def test_access(self):
+        other = User.objects.create_user("other")
+        Profile.objects.create(id=other.id, user=other)
+        self.client.force_login(other)
+
+        response = self.client.get(f"/pl/wallet/{self.pln.pk}/export/")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f"/pl/profile/{self.profile.pk}/export/")
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get("/pl/profile/export/?from=last-week")
+        self.assertEqual(response.status_code, 400)
+
+    def test_wallets_are_looked_up_by_profile(self):
+        user, wallet = self.neighbour()
+        self.client.force_login(user)
+
+        response = self.client.get(f"/pl/wallet/{wallet.pk}/export/")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f"/pl/wallet/{wallet.pk}/history/")
+        self.assertEqual(response.status_code, 404)
+
+
+class BalanceCheckpointTests(WalletsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # PLN starts at 1000 without a ledger entry, like older wallets
+        self.book(self.at(1), execute_deposit(self.profile, self.pln, Decimal(100)))
+        self.book(
+            self.at(2),
+            execute_transfer(
+                self.profile, self.pln, self.eur, Decimal(400), SPREAD_STANDARD
+            ),
+        )
+        self.book(self.at(4), execute_deposit(self.profile, self.pln, Decimal(50)))
+
+    def at(self, day, hour=12):
+        return datetime(2025, 3, day, hour, tzinfo=dt_timezone.utc)
+
+    def book(self, when, entry):
+        Transaction.objects.filter(pk=entry.pk).update(created_at=when)
+
+    def test_as_of_matches_the_ledger(self):
+        for day in (3, 5):
+            take_checkpoints(self.at(day, 0))
+        # the customer's and the house's wallets, then the PLN deposit
+        self.assertEqual(BalanceCheckpoint.objects.count(), 5)
+        self.assertEqual(take_checkpoints(self.at(5, 0)), 0)
+
+        expected = {1: 1000, 2: 1100, 3: 700, 4: 700, 5: 750, 6: 750}
+        for day, balance in expected.items():
+            with self.subTest(day=day):
+                self.assertEqual(
+                    balance_as_of(self.pln, self.at(day, 6)), Decimal(balance)
+                )
+        # a checkpoint read and the postings after it
+        with self.assertNumQueries(2):
+            balance_as_of(self.pln, self.at(4, 6))
+        self.assertEqual(balance_as_of(self.eur, self.at(6)), self.balance(self.eur))
+
+    def test_without_checkpoints(self):
+        self.assertEqual(balance_as_of(self.pln, self.at(3)), Decimal(700))
+        # the house leg is not swept yet, but it is in the ledger balance
+        house_pln = Wallet.objects.get(user=self.house, currency="PLN")
+        self.assertEqual(balance_as_of(house_pln, self.at(3)), house_position()["PLN"])
+
+    def test_api(self):
+        call_command(
+            "take_balance_checkpoints", "--as-of", "2025-03-03", stdout=StringIO()
+        )
+        self.client.force_login(self.profile.user)
+
+        response = self.client.get(
+            f"/pl/api/wallets/{self.pln.pk}/balance/", {"date": "2025-03-04"}
+        )
+        self.assertEqual(response.json()["balance"], "750.00")
+        response = self.client.get(f"/pl/api/wallets/{self.pln.pk}/balance/")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            f"/pl/api/wallets/{self.pln.pk}/balance/", {"date": "9999-12-31"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_looks_wallets_up_by_profile(self):
+        user, wallet = self.neighbour()
+        self.client.force_login(user)
+
+        response = self.client.get(
+            f"/pl/api/wallets/{wallet.pk}/balance/", {"date": "2025-03-04"}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class StatsDashboardTests(WalletsMixin, TestCase):
+    def transfers(self, count):
+        for _i in range(count):
+            execute_transfer(
+                self.profile, self.pln, self.eur, Decimal(4), SPREAD_STANDARD
+            )
+
+    def test_query_count_does_not_grow_with_volume(self):
+        for user, budget in ((self.profile.user, 4), (self.house.user, 4)):
+            self.client.force_login(user)
+            for count in (1, 30):
+                with self.subTest(user=user.username, count=count):
+                    self.transfers(count)
+                    with self.assertNumQueries(budget):
+                        self.client.get("/pl/stats/")
+
+    def test_totals(self):
+        self.transfers(3)
+        self.client.force_login(self.profile.user)
+
+        response = self.client.get("/pl/stats/")
+        # 4 PLN buy 0.98 EUR, worth 3.92 PLN
+        self.assertEqual(response.context["total_sum"], 11.76)
+        self.assertEqual(response.context["total_profit"], -0.24)
+
+        self.client.force_login(self.house.user)
+        response = self.client.get("/pl/stats/")
+        self.assertEqual(response.context["total_sum"], 11.76)
+        # 0.02 EUR of spread per transfer
+        self.assertEqual(response.context["total_profit"], 0.24)
+
+
+class MonthlyRollupTests(WalletsMixin, TestCase):
+    def item(self, source, destination):
+        wallets = {"PLN": self.pln, "EUR": self.eur, "USD": self.usd}
+        return {
+            "source_wallet": wallets[source].pk,
+            "destination_wallet": wallets[destination].pk,
+            "amount": "7",
+        }
+
+    def test_write_path_matches_rebuild(self):
+        self.profile.account_type = "business"
+        self.profile.save()
+        self.client.force_login(self.profile.user)
+        execute_deposit(self.profile, self.pln, Decimal(100))
+        for _i in range(2):
+            execute_transfer(
+                self.profile, self.pln, self.eur, Decimal(4), SPREAD_STANDARD
+            )
+        self.client.post(
+            "/pl/api/transfers/batch/",
+            json.dumps({"transfers": [self.item("PLN", "USD")]}),
+            content_type="application/json",
+        )
+        fields = (
+            "profile",
+            "month",
+            "visible_to",
+            "from_currency",
+            "to_currency",
+            "count",
+            "amount",
+            "result_amount",
+            "profit",
+            "amount_pln",
+            "result_amount_pln",
+            "profit_pln",
+        )
+        written = list(MonthlyRollup.objects.order_by(*fields).values_list(*fields))
+
+        call_command("rebuild_monthly_rollups", stdout=StringIO())
+
+        rebuilt = list(MonthlyRollup.objects.order_by(*fields).values_list(*fields))
+        self.assertEqual(written, rebuilt)
+        self.assertEqual(
+            [row[3:6] for row in written],
+            [("PLN", "PLN", 1), ("PLN", "EUR", 2), ("PLN", "USD", 1)],
+        )
+        self.assertEqual(
+            MonthlyRollup.objects.get(to_currency="EUR").profit, Decimal("0.04")
+        )
+
+    def test_rates_are_refreshed_before_the_booking_transaction(self):
+        outside = len(connection.savepoint_ids)
+        depths = []
+        with mock.patch.object(
+            valuation.rate_history,
+            "refresh",
+            lambda force=False: depths.append(len(connection.savepoint_ids)),
+        ):
+            execute_deposit(self.profile, self.pln, Decimal(100))
+            execute_transfer(
+                self.profile, self.pln, self.eur, Decimal(4), SPREAD_STANDARD
+            )
+
+        self.assertEqual(depths, [outside, outside])
+        self.assertEqual(MonthlyRollup.objects.count(), 2)
+
+    def test_rebuild_locks_the_rollups_before_reading(self):
+        execute_transfer(self.profile, self.pln, self.eur, Decimal(4), SPREAD_STANDARD)
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command("rebuild_monthly_rollups", stdout=StringIO())
+
+        statements = [query["sql"] for query in queries.captured_queries]
+        locked = next(i for i, sql in enumerate(statements) if "monthlyrollup" in sql)
+        read = next(
+            i
+            for i, sql in enumerate(statements)
+            if "backend_brokers_transaction" in sql
+        )
+        self.assertLess(locked, read)
+        self.assertEqual(MonthlyRollup.objects.get().count, 1)
+
+    def test_rebuild_keeps_other_months(self):
+        execute_transfer(self.profile, self.pln, self.eur, Decimal(4), SPREAD_STANDARD)
+        older = execute_transfer(
+            self.profile, self.pln, self.eur, Decimal(4), SPREAD_STANDARD
+        )
+        Transaction.objects.filter(pk=older.pk).update(
+            created_at=datetime(2025, 3, 5, tzinfo=dt_timezone.utc)
+        )
+
+        call_command(
+            "rebuild_monthly_rollups",
+            "--from",
+            "2025-03",
+            "--to",
+            "2025-03",
+            stdout=StringIO(),
+        )
+
+        # March is rebuilt from the ledger, this month's row is left alone
+        self.assertEqual(
+            dict(MonthlyRollup.objects.values_list("month", "count")),
+            {date(2025, 3, 1): 1, current_month(): 2},
+        )
+
+
+class ValuationTests(TestCase):
+    def setUp(self):
+        self.history = RateHistory()
+        patcher = mock.patch.object(valuation, "rate_history", self.history)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Warsaw moves to summer time on 2025-03-30
+        upsert_rates(
+            [
+                ({"EUR": 4.1234}, "2025-03-28"),
+                ({"EUR": 4.5678, "USD": 3.9}, "2025-03-31"),
+            ]
+        )
+
+    def test_matches_rates_as_of(self):
+        moments = [
+            datetime(2025, 3, 28, 11, 0, tzinfo=dt_timezone.utc),  # 12:00 CET
+            datetime(2025, 3, 28, 11, 30, tzinfo=dt_timezone.utc),  # 12:30 CET
+            datetime(2025, 3, 30, 23, 0, tzinfo=dt_timezone.utc),  # Monday 01:00
+            datetime(2025, 3, 31, 10, 0, tzinfo=dt_timezone.utc),  # 12:00 CEST
+            datetime(2025, 3, 31, 10, 30, tzinfo=dt_timezone.utc),  # 12:30 CEST
+        ]
+        pairs = [
+            (currency, moment)
+            for currency in ("PLN", "EUR", "USD")
+            for moment in moments
+        ]
+        amounts = [Decimal("10.05")] * len(pairs)
+
+        values = valuation.value_pln(
+            valuation.to_cents(amounts),
+            [currency for currency, _moment in pairs],
+            valuation.to_datetime64([moment for _currency, moment in pairs]),
+        )
+
+        # before its first table a currency is valued at that table
+        first = {"EUR": Decimal("4.1234"), "USD": Decimal("3.9")}
+        expected = [
+            (amount * (rate or first[currency])).quantize(Decimal("0.01"))
+            for amount, rate, (currency, _moment) in zip(
+                amounts, self.history.rates_as_of(pairs), pairs
+            )
+        ]
+        self.assertEqual([valuation.from_cents(v) for v in values], expected)
+        self.assertEqual(
+            expected[5:10],
+            [Decimal("41.44")] * 4 + [Decimal("45.91")],
+        )
+        self.assertEqual(expected[10], Decimal("39.20"))
+
+    def test_currency_without_tables_is_worth_nothing(self):
+        values = valuation.value_pln(
+            valuation.to_cents([Decimal(5), Decimal(5)]),
+            ["CHF", "EUR"],
+            valuation.to_datetime64(
+                [datetime(2025, 3, 31, 11, 0, tzinfo=dt_timezone.utc)] * 2
+            ),
+        )
+
+        self.assertEqual(values.tolist(), [0, 2284])
+
+    def test_profile_balances(self):
+        user = User.objects.create_user("customer")
+        profile = Profile.objects.create(user=user)
+        for currency, balance in (("PLN", 10), ("EUR", 2), ("USD", 1)):
+            Wallet.objects.create(
+                user=profile,
+                wallet_id=currency,
+                currency=currency,
+                iban=f"PL{currency}",
+                balance=balance,
+            )
+        moment = datetime(2025, 3, 31, 10, 0, tzinfo=dt_timezone.utc)
+
+        # USD at its first table, published after *moment*
+        self.assertEqual(
+            valuation.profile_balances_pln([profile], moment),
+            {profile.id: Decimal("22.15")},
+        )
+
+
+@tag("slow")
+@skipUnless(connection.vendor == "sqlite", "reads SQLite's EXPLAIN QUERY PLAN")
+class QueryPlanTests(WalletsMixin, TestCase):
+    """
+    Runs the hot views against a seeded ledger and checks that none of their
+    queries reads a whole Transaction, Posting or Wallet table. The size can
+    be lowered with the QUERY_PLAN_ROWS environment variable.
+    """
+
+    ROWS = int(os.environ.get("QUERY_PLAN_ROWS", 1_000_000))
+    PROFILES = 1000
+    FULL_SCAN = re.compile(r"\bSCAN (backend_brokers_(transaction|posting|wallet))\b")
+
+    @classmethod
+    def setUpTestData(cls):
+        seed = f"""
+            WITH RECURSIVE n(i) AS (
+                SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < {{count}} - 1
+            )
+            {{insert}}
+        """
+        statements = [
+            (
+                cls.PROFILES,
+                "INSERT INTO auth_user (id, password, is_superuser, username, "
+                "first_name, last_name, email, is_staff, is_active, date_joined) "
+                "SELECT 1000 + i, '', 0, 'seed' || i, '', '', '', 0, 1, "
+                "'2024-01-01 00:00:00' FROM n",
+            ),
+            (
+                cls.PROFILES,
+                "INSERT INTO backend_brokers_profile (id, user_id, phone_number, "
+                "address, account_type, transaction_limit, wallet_limit, "
+                "created_at, updated_at) "
+                "SELECT 1000 + i, 1000 + i, '', '', 'personal', 10, 5, "
+                "'2024-01-01 00:00:00', '2024-01-01 00:00:00' FROM n",
+            ),
+            (
+                cls.PROFILES * 2,
+                "INSERT INTO backend_brokers_wallet (id, user_id, wallet_id, "
+                "currency, iban, balance, wallet_status) "
+                "SELECT 100000 + i, 1000 + i / 2, 'seed' || i, "
+                "CASE i % 2 WHEN 0 THEN 'PLN' ELSE 'EUR' END, 'SEED' || i, 0, "
+                "CASE i % 10 WHEN 9 THEN 'deleted' ELSE 'active' END FROM n",
+            ),
+            (
+                cls.ROWS,
+                "INSERT INTO backend_brokers_transaction (id, user_id, "
+                "source_iban, source_wallet_id, from_currency, to_currency, "
+                "destination_iban, destination_wallet_id, amount, rate, "
+                "result_amount, created_at, visible_to) "
+                f"SELECT 1000000 + i, 1000 + i % {cls.PROFILES}, 'SEED', "
+                f"CASE i % 5 WHEN 0 THEN NULL ELSE 100000 + 2 * (i % {cls.PROFILES}) "
+                "END, 'PLN', 'EUR', 'SEED', "
+                f"100000 + 2 * (i % {cls.PROFILES}) + (i % 5 != 0), 100, 0.2475, "
+                "24.75, "
+                "datetime('2021-10-20', '+' || (i * 7919 % 157680000) || ' seconds'), "
+                "CASE i % 5 WHEN 0 THEN 'deposit' ELSE 'user' END FROM n",
+            ),
+            (
+                cls.ROWS,
+                "INSERT INTO backend_brokers_posting (entry_id, wallet_id, "
+                "amount, currency, kind, pending) "
+                f"SELECT 1000000 + i, 100000 + 2 * (i % {cls.PROFILES}), -100, "
+                "'PLN', CASE i % 5 WHEN 0 THEN 'deposit' WHEN 1 THEN 'profit' "
+                "ELSE 'principal' END, 0 FROM n",
+            ),
+        ]
+        with connection.cursor() as cursor:
+            for count, insert in statements:
+                cursor.execute(seed.format(count=count, insert=insert))
+            cursor.execute("ANALYZE")
+
+    def assertUsesIndexes(self, url, user):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                sql = query["sql"]
+                if not sql.startswith("SELECT"):
+                    continue
+                cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                plan = "\n".join(row[-1] for row in cursor.fetchall())
+                self.assertIsNone(self.FULL_SCAN.search(plan), f"{url}\n{sql}\n{plan}")
+
+    def test_customer_views(self):
+        execute_transfer(self.profile, self.pln, self.eur, Decimal(1), SPREAD_STANDARD)
+        user = self.profile.user
+        for url in (
+            "/pl/wallets/",
+            f"/pl/wallet/{self.pln.pk}/",
+            f"/pl/wallet/{self.pln.pk}/history/?cursor=1735732800000000-1",
+            "/pl/wallets/transfer",
+            f"/pl/api/estimate-exchange/?source_wallet={self.pln.pk}"
+            f"&destination_wallet={self.eur.pk}&amount=10",
+            "/pl/stats/",
+        ):
+            with self.subTest(url=url):
+                self.assertUsesIndexes(url, user)
+
+    def test_superuser_views(self):
+        self.assertUsesIndexes("/pl/stats/", self.house.user)
+
+    def test_house_position_reads_only_pending_postings(self):
+        execute_transfer(self.profile, self.pln, self.eur, Decimal(1), SPREAD_STANDARD)
+        (master,) = house_wallet_ids("PLN")
+        with connection.cursor() as cursor:
+            # every exchange leaves swept legs on the master wallets
+            cursor.execute(
+                f"""
+                WITH RECURSIVE n(i) AS (
+                    SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < {self.ROWS} - 1
+                )
+                INSERT INTO backend_brokers_posting (entry_id, wallet_id, amount,
+                    currency, kind, pending)
+                SELECT 1000000 + i, {master}, 100, 'PLN', 'house', 0 FROM n
+                """
+            )
+            cursor.execute("ANALYZE")
+
+        with CaptureQueriesContext(connection) as queries:
+            house_position()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + queries.captured_queries[-1]["sql"])
+            plan = "\n".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("posting_pending_idx", plan)
@@ -0,0 +1,308 @@
+"""
+Currency exchange between wallets.
+
+Every transfer runs in one database transaction: balances change through
+conditional UPDATEs on the database side, so concurrent transfers cannot
+overwrite each other. The ledger is double-entry: one Transaction per
+transfer or deposit, and its Posting legs written with one insert. The
+house legs stay pending until house_accounts.sweep() books them.
+"""
+
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.utils.translation import gettext_lazy as _
+
+from .counters import record_transactions
+from .cross_rates import SPREAD_PROMO, SPREAD_STANDARD, get_cross_rates
+from .house_accounts import house_wallet_ids
+from .models import Posting, Transaction, Wallet
+from .rollups import record_entries
+from .valuation import rate_series
+
+CENT = Decimal("0.01")
+# Transaction.amount holds 12 digits, 2 of them after the point
+MAX_AMOUNT = Decimal(10) ** 10
+# largest list accepted by execute_batch
+MAX_BATCH_SIZE = 1000
+
+
+class TransferError(Exception):
+    """
+    Raised when a transfer cannot be executed. The message is meant for the user,
+    *field* names the form field it belongs to (None for the whole form).
+    """
+
+    def __init__(self, message, field=None):
+        super().__init__(message)
+        self.field = field
+
+
+Quote = namedtuple(
+    "Quote", ["rate", "converted_amount", "profit", "house_buy", "house_sell"]
+)
+
+
+def quote_transfer(source, destination, amount, spread, matrix=None):
+    """
+    Prices the exchange of *amount* from *source* into *destination* at the
+    rates of *matrix* (the current CrossRateMatrix by default).
+    Returns a Quote, raises TransferError.
+    """
+    mid_rate, exchange_rate = (matrix or get_cross_rates()).quote(
+        source.currency, destination.currency, spread
+    )
+    if exchange_rate is None:
+        raise TransferError(_("Brak aktualnego kursu wymiany dla tej waluty."))
+
+    house_buy, house_sell = house_wallet_ids(source.currency, destination.currency)
+    if house_buy is None or house_sell is None:
+        raise TransferError(_("Wymiana tej waluty jest chwilowo niedostępna."))
+
+    return Quote(
+        rate=exchange_rate,
+        converted_amount=(amount * exchange_rate).quantize(CENT),
+        profit=(amount * mid_rate * spread).quantize(CENT),
+        house_buy=house_buy,
+        house_sell=house_sell,
+    )
+
+
+def journal(profile, source, destination, amount, quote, pending=True):
+    """
+    Returns the unsaved journal entry of a transfer and its postings. The
+    house legs are left for the sweep unless *pending* is False.
+    """
+    entry = Transaction(
+        user=profile,
+        source_iban=source.iban,
+        source_wallet=source,
+        from_currency=source.currency,
+        to_currency=destination.currency,
+        destination_iban=destination.iban,
+        destination_wallet=destination,
+        amount=amount,
+        rate=quote.rate,
+        result_amount=quote.converted_amount,
+        visible_to="user",
+    )
+    postings = [
+        Posting(
+            entry=entry,
+            wallet=source,
+            amount=-amount,
+            currency=source.currency,
+            kind="principal",
+        ),
+        Posting(
+            entry=entry,
+            wallet_id=quote.house_buy,
+            amount=amount,
+            currency=source.currency,
+            kind="house",
+            pending=pending,
+        ),
+        Posting(
+            entry=entry,
+            wallet_id=quote.house_sell,
+            amount=-(quote.converted_amount + quote.profit),
+            currency=destination.currency,
+            kind="house",
+            pending=pending,
+        ),
+        Posting(
+            entry=entry,
+            wallet=destination,
+            amount=quote.converted_amount,
+            currency=destination.currency,
+            kind="principal",
+        ),
+        Posting(
+            entry=entry,
+            wallet_id=quote.house_sell,
+            amount=quote.profit,
+            currency=destination.currency,
+            kind="profit",
+            pending=pending,
+        ),
+    ]
+    return entry, postings
+
+
+def execute_transfer(profile, source, destination, amount, spread):
+    """
+    Exchanges *amount* from the *source* wallet into the *destination* wallet
+    of *profile* at the current rate minus *spread*.
+    Returns the journal entry (Transaction), raises TransferError.
+    """
+    quote = quote_transfer(source, destination, amount, spread)
+    series = rate_series()
+
+    with transaction.atomic():
+        # the balance check and the debit are one statement, so two transfers
+        # racing for the same funds cannot both succeed
+        debited = Wallet.objects.filter(pk=source.pk, balance__gte=amount).update(
+            balance=F("balance") - amount
+        )
+        if not debited:
+            raise TransferError(_("Brak wystarczających środków."), field="amount")
+        Wallet.objects.filter(pk=destination.pk).update(
+            balance=F("balance") + quote.converted_amount
+        )
+
+        entry, postings = journal(profile, source, destination, amount, quote)
+        entry.save()
+        Posting.objects.bulk_create(postings)
+        record_transactions({profile.pk: 1})
+        record_entries([(entry, postings)], series)
+    return entry
+
+
+def _batch_item(wallets, item):
+    """
+    Returns (source, destination, amount) of one batch item, raises TransferError.
+    """
+    try:
+        source = wallets.get(int(item["source_wallet"]))
+        destination = wallets.get(int(item["destination_wallet"]))
+        amount = Decimal(str(item["amount"]))
+    except (TypeError, KeyError, ValueError, ArithmeticError):
+        raise TransferError(_("Nieprawidłowe dane przelewu."))
+    if source is None or destination is None:
+        raise TransferError(_("Nieznany portfel."))
+    if source == destination:
+        raise TransferError(_("Nie możesz przelać środków na to samo konto."))
+    if (
+        not amount.is_finite()
+        or not 0 < amount < MAX_AMOUNT
+        or amount != amount.quantize(CENT)
+    ):
+        raise TransferError(_("Nieprawidłowa kwota."), field="amount")
+    return source, destination, amount
+
+
+def book(snapshot, balances, journals):
+    """
+    Writes transfers planned against *snapshot* ({wallet id: balance}):
+    one update per wallet whose planned balance in *balances* differs, then
+    bulk inserts of the (entry, postings) pairs in *journals*. Must run in a
+    transaction; raises TransferError if a wallet the transfers take money
+    from no longer holds its snapshot balance.
+    """
+    for pk in sorted(balances):
+        change = balances[pk] - snapshot[pk]
+        if not change:
+            continue
+        wallet = Wallet.objects.filter(pk=pk)
+        if change < 0:
+            wallet = wallet.filter(balance__gte=-change)
+        if not wallet.update(balance=F("balance") + change):
+            raise TransferError(
+                _("Saldo portfela zmieniło się w trakcie operacji. Spróbuj ponownie.")
+            )
+    Transaction.objects.bulk_create([entry for entry, _p in journals])
+    Posting.objects.bulk_create(
+        [posting for _e, postings in journals for posting in postings]
+    )
+
+
+def execute_batch(profile, items, promo_left):
+    """
+    Executes a list of transfers between the wallets of *profile*. Each item
+    is a dict with "source_wallet" and "destination_wallet" ids and "amount";
+    the first *promo_left* executed items get the promotional spread.
+
+    All items are checked in order against one snapshot of the wallets and
+    rates, so an item may spend what an earlier one brought in. The valid ones
+    are written in one database transaction, with one balance update per
+    wallet and bulk inserts for the ledger. Returns one result dict per item;
+    raises TransferError if a balance changed since the snapshot was taken.
+    """
+    matrix = get_cross_rates()
+    wallets = {
+        wallet.pk: wallet
+        for wallet in Wallet.objects.filter(user=profile, wallet_status="active")
+    }
+    balances = {pk: wallet.balance for pk, wallet in wallets.items()}
+    results = []
+    journals = []  # (result, entry, postings)
+
+    for index, item in enumerate(items):
+        try:
+            source, destination, amount = _batch_item(wallets, item)
+            spread = SPREAD_PROMO if len(journals) < promo_left else SPREAD_STANDARD
+            quote = quote_transfer(source, destination, amount, spread, matrix)
+            if balances[source.pk] < amount:
+                raise TransferError(_("Brak wystarczających środków."), field="amount")
+        except TransferError as e:
+            results.append({"index": index, "status": "error", "error": str(e)})
+            continue
+
+        balances[source.pk] -= amount
+        balances[destination.pk] += quote.converted_amount
+        result = {
+            "index": index,
+            "status": "ok",
+            "rate": f"{quote.rate:.4f}",
+            "result_amount": f"{quote.converted_amount:.2f}",
+        }
+        results.append(result)
+        journals.append((result, *journal(profile, source, destination, amount, quote)))
+
+    if not journals:
+        return results
+
+    snapshot = {pk: wallet.balance for pk, wallet in wallets.items()}
+    booked = [(entry, postings) for _r, entry, postings in journals]
+    series = rate_series()
+    with transaction.atomic():
+        book(snapshot, balances, booked)
+        record_transactions({profile.pk: len(journals)})
+        record_entries(booked, series)
+
+    for result, entry, _p in journals:
+        result["transaction_id"] = entry.pk
+    return results
+
+
+def execute_deposit(profile, wallet, amount):
+    """
+    Pays *amount* into *wallet* of *profile*. Returns the Transaction.
+    """
+    series = rate_series()
+    with transaction.atomic():
+        Wallet.objects.filter(pk=wallet.pk).update(balance=F("balance") + amount)
+        entry = Transaction.objects.create(
+            user=profile,
+            source_iban=wallet.iban,
+            from_currency=wallet.currency,
+            to_currency=wallet.currency,
+            destination_iban=wallet.iban,
+            destination_wallet=wallet,
+            amount=amount,
+            rate=Decimal(1),
+            result_amount=amount,
+            visible_to="deposit",
+        )
+        postings = [
+            Posting(
+                entry=entry,
+                wallet=wallet,
+                amount=amount,
+                currency=wallet.currency,
+                kind="deposit",
+            ),
+            # the money comes from outside the system
+            Posting(
+                entry=entry,
+                wallet=None,
+                amount=-amount,
+                currency=wallet.currency,
+                kind="deposit",
+            ),
+        ]
+        Posting.objects.bulk_create(postings)
+        record_entries([(entry, postings)], series)
+    return entry
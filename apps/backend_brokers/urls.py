@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from apps.backend_brokers import views
 from django.contrib.auth.views import LogoutView  # , LoginView
@@ -12,7 +13,21 @@ urlpatterns = [
     path("logout/", LogoutView.as_view(next_page="login"), name="logout"),
     path("profile/", views.profile, name="profile"),
     path("profile/edit/", views.profile_edit, name="profile_edit"),
-    path("rates/", views.exchange_rates_view, name="exchange_rates"),
+    path("profile/export/", views.export_profile_history, name="export_profile_history"),
+    path(
+        "profile/<int:profile_id>/export/",
+        views.export_profile_history,
+        name="export_profile_history",
+    ),
+    path(
+        "rates/",
+        (
+            views.exchange_rates_view_async
+            if settings.ASYNC_VIEWS
+            else views.exchange_rates_view
+        ),
+        name="exchange_rates",
+    ),
     path("wallets/", views.wallet, name="wallets"),
     path("wallet/add/", views.add_wallet, name="add_wallet"),
     path(
@@ -20,10 +35,37 @@ urlpatterns = [
         views.wallet_properies_and_history,
         name="wallet_transactions",
     ),
+    path(
+        "wallet/<int:wallet_id>/history/",
+        views.wallet_history_fragment,
+        name="wallet_history_fragment",
+    ),
+    path(
+        "wallet/<int:wallet_id>/export/",
+        views.export_wallet_history,
+        name="export_wallet_history",
+    ),
     path("wallet/<int:wallet_id>/delete/", views.delete_wallet, name="delete_wallet"),
     path("wallets/transfer", views.transfer_funds, name="transfer_funds"),
+    path(
+        "wallets/transfer/<uuid:token>/",
+        views.transfer_status,
+        name="transfer_status",
+    ),
     path("wallet/deposit/", views.deposit, name="deposit"),
     path('stats/', views.stats_dashboard, name='stats_dashboard'),
     path("api/estimate-exchange/", estimate_exchange, name="estimate_exchange"),
+    path(
+        "api/wallets/<int:wallet_id>/balance/",
+        views.wallet_balance_api,
+        name="wallet_balance_api",
+    ),
+    path("api/transfers/batch/", views.batch_transfer, name="batch_transfer"),
+    path("api/transfers/queue/", views.transfer_queue_stats, name="transfer_queue_stats"),
+    path(
+        "api/transfers/<uuid:token>/",
+        views.transfer_status_api,
+        name="transfer_status_api",
+    ),
     path("report/users/", generate_user_report, name="generate_user_report"),
 ]
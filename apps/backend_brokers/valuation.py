@@ -0,0 +1,202 @@
+"""
+PLN values at the exchange rate that applied when each amount was booked.
+
+Works on whole columns at once: the moments are turned into NBP table days
+with array arithmetic, and all of them are looked up in the rate history
+(the sorted arrays kept by rate_history, merged into one) with a single
+searchsorted call.
+The history is refreshed by rate_series(); callers that value amounts in a
+database transaction take the series before it starts, so the refresh
+(the whole ExchangeRate table, the first time) holds no locks.
+Amounts and rates stay integers (grosze and RATE_SCALE fixed point), so the
+results round exactly like Decimal.quantize() would.
+"""
+
+from datetime import date, datetime, time, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Posting, Wallet
+from .rate_cache import NBP_TIMEZONE, PUBLICATION_TIME
+from .rate_history import PLN_FIXED, RATE_SCALE, rate_history
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_PUBLICATION = np.timedelta64(PUBLICATION_TIME.hour * 60 + PUBLICATION_TIME.minute, "m")
+# day ordinals stay below 2**20 until the year 2870
+DAY_BITS = 20
+# (rate_history.series, its _merge()), rebuilt when refresh() replaces it
+_merged = (None, None)
+
+
+def to_cents(amounts):
+    return np.array([int(amount * 100) for amount in amounts], dtype=np.int64)
+
+
+def to_datetime64(moments):
+    return np.array(
+        [m.astimezone(dt_timezone.utc).replace(tzinfo=None) for m in moments],
+        dtype="datetime64[us]",
+    )
+
+
+def from_cents(value):
+    return Decimal(int(value)).scaleb(-2)
+
+
+def _offset(day):
+    noon = datetime.combine(day, time(12), tzinfo=dt_timezone.utc)
+    return noon.astimezone(NBP_TIMEZONE).utcoffset() // timedelta(minutes=1)
+
+
+def rate_days(moments):
+    """
+    Column version of rate_history.rate_day(): the ordinal of the day whose
+    table applied at each of *moments* (a datetime64 array in UTC).
+    """
+    moments = np.asarray(moments, dtype="datetime64[us]")
+    days = moments.astype("datetime64[D]")
+    if not len(days):
+        return days.astype(np.int64)
+    first = days.min()
+    # Warsaw changes its UTC offset at 01:00 UTC, long before the tables
+    # are published, so the offset at noon holds for the whole UTC day
+    offsets = np.array(
+        [_offset(day) for day in np.arange(first, days.max() + 1).tolist()],
+        dtype=np.int64,
+    )
+    local = (
+        moments
+        + offsets[(days - first).astype(np.int64)].astype("timedelta64[m]")
+        - _PUBLICATION
+    )
+    return local.astype("datetime64[D]").astype(np.int64) + EPOCH_ORDINAL
+
+
+def _pack(currencies):
+    """
+    Returns currency codes of up to three letters as integers that sort like
+    the codes. Longer ones get -1, which matches no currency.
+    """
+    currencies = np.asarray(currencies)
+    too_long = None
+    if currencies.dtype.itemsize > np.dtype("U3").itemsize:
+        too_long = np.char.str_len(currencies) > 3
+    chars = currencies.astype("U3").view(np.uint32).reshape(-1, 3).astype(np.int64)
+    packed = (chars[:, 0] << 42) | (chars[:, 1] << 21) | chars[:, 2]
+    if too_long is not None:
+        packed[too_long] = -1
+    return packed
+
+
+def _merge(series):
+    """
+    Returns (codes, keys, rates, firsts) for *series*: the packed currency
+    codes in order, every table of every currency in one array sorted by
+    currency index and day, keyed (index << DAY_BITS) + day, so one search
+    finds any rate, and the position of each currency's first table.
+    """
+    codes = sorted({"PLN", *series})
+    keys = []
+    rates = []
+    for i, code in enumerate(codes):
+        if code == "PLN":
+            dates, values = [0], [PLN_FIXED]
+        else:
+            dates, values = series[code].dates, series[code].rates
+        keys.append((i << DAY_BITS) + np.array(dates, dtype=np.int64))
+        rates.append(np.array(values, dtype=np.int64))
+    firsts = np.cumsum([0] + [len(k) for k in keys[:-1]])
+    return _pack(codes), np.concatenate(keys), np.concatenate(rates), firsts
+
+
+def rate_series():
+    """
+    Returns the rate history series, refreshed first.
+    """
+    rate_history.refresh()
+    return rate_history.series  # replaced, never changed, by refresh()
+
+
+def fixed_rates(currencies, days, series=None):
+    """
+    Returns the fixed-point PLN rates of *currencies* on the table *days*
+    (ordinals). Days before a currency's first stored table get that table's
+    rate, currencies without any table 0. *series* defaults to
+    rate_series().
+    """
+    global _merged
+
+    if series is None:
+        series = rate_series()
+    if _merged[0] is not series:
+        _merged = (series, _merge(series))
+    codes, keys, rates, firsts = _merged[1]
+
+    currencies = _pack(currencies)
+    index = np.minimum(np.searchsorted(codes, currencies), len(codes) - 1)
+    found = np.searchsorted(keys, (index << DAY_BITS) + days, side="right") - 1
+    # a search that lands before the currency's first table (on the previous
+    # currency, or before the start) takes that first table
+    found = np.where(
+        (found >= 0) & (keys[found] >> DAY_BITS == index), found, firsts[index]
+    )
+    return np.where(codes[index] == currencies, rates[found], 0)
+
+
+def value_pln(cents, currencies, moments, series=None):
+    """
+    Returns the PLN values, in grosze, of *cents* (minor units of
+    *currencies*) at the rates that applied at *moments* (UTC datetime64),
+    looked up in *series* (rate_series() by default). Amounts booked before
+    the first stored table of their currency are valued at that table, the
+    ones in a currency without any table are worth 0.
+    """
+    rates = fixed_rates(currencies, rate_days(moments), series)
+    quotient, remainder = np.divmod(
+        np.asarray(cents, dtype=np.int64) * rates, RATE_SCALE
+    )
+    # round half to even, like Decimal.quantize()
+    twice = 2 * remainder
+    return quotient + (
+        (twice > RATE_SCALE) | ((twice == RATE_SCALE) & (quotient % 2 == 1))
+    )
+
+
+def profile_balances_pln(profiles=None, moment=None):
+    """
+    Returns {profile id: Decimal value in PLN of its wallets} at *moment*
+    (now by default), for *profiles* or everyone. The master wallets count
+    the house legs not swept yet, like house_position().
+    """
+    wallets = Wallet.objects.all()
+    if profiles is not None:
+        wallets = wallets.filter(user__in=profiles)
+    rows = list(wallets.values_list("id", "user_id", "balance", "currency"))
+    if not rows:
+        return {}
+    pending = dict(
+        Posting.objects.filter(pending=True, wallet__in=wallets)
+        .values("wallet")
+        .annotate(total=Sum("amount"))
+        .values_list("wallet", "total")
+        .order_by()
+    )
+    ids, owners, balances, currencies = zip(*rows)
+    balances = [
+        balance + pending.get(wallet_id, 0) for wallet_id, balance in zip(ids, balances)
+    ]
+    moments = np.full(
+        len(rows), to_datetime64([moment or timezone.now()])[0], dtype="datetime64[us]"
+    )
+    values = value_pln(to_cents(balances), currencies, moments)
+    owners, inverse = np.unique(owners, return_inverse=True)
+    totals = np.zeros(len(owners), dtype=np.int64)
+    np.add.at(totals, inverse, values)
+    return {
+        owner: from_cents(total)
+        for owner, total in zip(owners.tolist(), totals.tolist())
+    }
@@ -1,6 +1,6 @@
 #import decimal
-#import json
-from datetime import datetime, timedelta
+import json
+from datetime import date, datetime, time, timedelta
 from collections import OrderedDict
 
 from django.shortcuts import render, redirect, get_object_or_404
@@ -16,8 +16,33 @@ from .forms import (
     TransferForm,
     DepositForm,
 )
-from .models import Profile, Wallet, Transaction, ExchangeRate
-from apps.backend_brokers.nbp_client import NBPClient
+from .models import MonthlyRollup, Profile, Wallet, TransferRequest
+from apps.backend_brokers.checkpoints import balance_as_of
+from apps.backend_brokers.counters import current_month, transactions_this_month
+from apps.backend_brokers.cross_rates import SPREAD_PROMO, SPREAD_STANDARD, get_cross_rates
+from apps.backend_brokers.exports import (
+    FORMATS,
+    accepts_gzip,
+    csv_lines,
+    date_range,
+    gzip_stream,
+    ndjson_lines,
+    profile_rows,
+    wallet_rows,
+)
+from apps.backend_brokers.history import history_page
+from apps.backend_brokers.idempotency import request_key, run_once
+from apps.backend_brokers.rate_cache import aget_latest_rates, get_latest_rates
+from apps.backend_brokers.rates import latest_rate
+from apps.backend_brokers.settlement import enqueue, queue_stats
+from apps.backend_brokers.transfers import (
+    MAX_BATCH_SIZE,
+    TransferError,
+    execute_batch,
+    execute_deposit,
+    execute_transfer,
+)
+from apps.backend_brokers.valuation import profile_balances_pln
 from schwifty import IBAN
 import random
 import os
@@ -25,10 +50,11 @@ from decimal import Decimal
 from django.utils import timezone
 from django_otp.decorators import otp_required
 from django_otp.plugins.otp_totp.models import TOTPDevice
-from django.db.models import Sum
-from django.db.models.functions import TruncMonth
+from django.db.models import Q, Sum
 from dateutil.relativedelta import relativedelta
-from django.http import JsonResponse
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_POST
 from django.http import HttpResponse
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.pagesizes import landscape, A4
@@ -37,6 +63,7 @@ from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from django.utils.translation import gettext_lazy as _
+from asgiref.sync import sync_to_async
 
 def home(request):
     return render(request, "backend_brokers/home.html")
@@ -94,31 +121,39 @@ def profile_edit(request):
     )
 
 
+def _exchange_rates_context(rates, effective_date):
+    rates_sorted = {
+        k: round(v, 3) for k, v in sorted((rates or {}).items()) if k != "PLN"
+    }
+    return {"rates": rates_sorted, "date": effective_date}
+
+
 def exchange_rates_view(request):
-    nbp = NBPClient()
-    nbp.save_to_db()
-    rates, effective_date = nbp.rates
-    rates_sorted = {k: round(v, 3) for k, v in sorted(rates.items()) if k != "PLN"}
+    rates, effective_date = get_latest_rates()
     return render(
         request,
         "backend_brokers/exchange_rates.html",
-        {"rates": rates_sorted, "date": effective_date},
+        _exchange_rates_context(rates, effective_date),
+    )
+
+
+async def exchange_rates_view_async(request):
+    # used under ASGI (settings.ASYNC_VIEWS); the template still reads
+    # request.user, so rendering happens on Django's sync thread
+    rates, effective_date = await aget_latest_rates()
+    return await sync_to_async(render)(
+        request,
+        "backend_brokers/exchange_rates.html",
+        _exchange_rates_context(rates, effective_date),
     )
 
 
 @login_required
 def wallet(request):
-    now = timezone.now()
     wallets = Wallet.objects.filter(user_id=request.user.id, wallet_status="active")
     wallets_count = wallets.count()
     wallets_remaining = request.user.profile.wallet_limit - wallets_count
-    transactions_current_month = Transaction.objects.filter(
-        user_id=request.user.id,
-        visible_to="user",
-        created_at__year=now.year,
-        created_at__month=now.month,
-    )
-    transactions_count = transactions_current_month.count()
+    transactions_count = transactions_this_month(request.user.profile.id)
     transactions_remaining = request.user.profile.transaction_limit - transactions_count
     return render(
         request,
@@ -127,7 +162,6 @@ def wallet(request):
             "wallets": wallets,
             "wallets_count": wallets_count,
             "wallets_remaining": wallets_remaining,
-            "transactions_current_month": transactions_current_month,
             "transactions_count": transactions_count,
             "transactions_remaining": transactions_remaining,
         },
@@ -167,26 +201,13 @@ def add_wallet(request):
 
 @login_required
 def wallet_properies_and_history(request, wallet_id):
-    now = timezone.now()
-    transactions_current_month = Transaction.objects.filter(
-        user_id=request.user.id, created_at__year=now.year, created_at__month=now.month
-    )
-    transactions_count = transactions_current_month.count()
+    transactions_count = transactions_this_month(request.user.profile.id)
     transactions_remaining = request.user.profile.transaction_limit - transactions_count
     wallet = get_object_or_404(
         Wallet, id=wallet_id, user=request.user.id, wallet_status="active"
     )
-    iban = wallet.iban
-
-    transactions = (
-        Transaction.objects.filter(source_iban=iban, visible_to="user")
-        | Transaction.objects.filter(destination_iban=iban, visible_to="user")
-        | Transaction.objects.filter(destination_iban=iban, visible_to="deposit")
-    )  # list of all transactions containing given wallet iban
 
-    transactions = transactions.order_by(
-        "-created_at"
-    )  # newsest transactions at the top
+    transactions, next_cursor = history_page(wallet)  # newest transactions first
 
     return render(
         request,
@@ -194,11 +215,81 @@ def wallet_properies_and_history(request, wallet_id):
         {
             "wallet": wallet,
             "transactions": transactions,
+            "next_cursor": next_cursor,
             "transactions_remaining": transactions_remaining,
         },
     )
 
 
+@login_required
+def wallet_history_fragment(request, wallet_id):
+    # next page of the wallet history, appended by the "load more" button
+    wallet = get_object_or_404(
+        Wallet, id=wallet_id, user__user=request.user, wallet_status="active"
+    )
+    try:
+        transactions, next_cursor = history_page(
+            wallet, request.GET.get("cursor") or None
+        )
+    except ValueError:
+        return HttpResponseBadRequest(_("Nieprawidłowy kursor."))
+
+    return render(
+        request,
+        "backend_brokers/wallet_history_items.html",
+        {"wallet": wallet, "transactions": transactions, "next_cursor": next_cursor},
+    )
+
+
+def _export_response(request, rows, name):
+    # streams rows(filters) as CSV or NDJSON, gzipped if the client accepts it
+    export_format = request.GET.get("format", "csv")
+    if export_format not in FORMATS:
+        return HttpResponseBadRequest(_("Nieznany format eksportu."))
+    try:
+        filters = date_range(request.GET)
+    except ValueError:
+        return HttpResponseBadRequest(_("Nieprawidłowa data."))
+
+    encode = csv_lines if export_format == "csv" else ndjson_lines
+    content = encode(rows(filters))
+    gzipped = accepts_gzip(request.headers.get("Accept-Encoding", ""))
+    if gzipped:
+        content = gzip_stream(content)
+    response = StreamingHttpResponse(content, content_type=FORMATS[export_format])
+    if gzipped:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    response["Content-Disposition"] = f'attachment; filename="{name}.{export_format}"'
+    return response
+
+
+@login_required
+def export_wallet_history(request, wallet_id):
+    wallets = Wallet.objects.all()
+    if not request.user.is_superuser:  # support staff export any wallet
+        wallets = wallets.filter(user__user=request.user)
+    wallet = get_object_or_404(wallets, id=wallet_id)
+    return _export_response(
+        request, lambda filters: wallet_rows(wallet, filters), f"wallet-{wallet.iban}"
+    )
+
+
+@login_required
+def export_profile_history(request, profile_id=None):
+    if profile_id is None:
+        profile = request.user.profile
+    elif request.user.is_superuser:
+        profile = get_object_or_404(Profile, id=profile_id)
+    else:
+        return HttpResponse(_("Brak dostępu"), status=403)
+    return _export_response(
+        request,
+        lambda filters: profile_rows(profile, filters),
+        f"profile-{profile.id}",
+    )
+
+
 @login_required
 def delete_wallet(
     request, wallet_id
@@ -231,135 +322,148 @@ def delete_wallet(
     )
 
 
+def _entry_result(entry):
+    # what an idempotency key remembers about a transfer or deposit
+    return {
+        "transaction_id": entry.pk,
+        "amount": f"{entry.amount:.2f}",
+        "result_amount": f"{entry.result_amount:.2f}",
+    }
+
+
+@login_required
 def transfer_funds(request):
-    SPREAD_VALUE_PROMO = 0.01
-    SPREAD_VALUE_STANDARD = 0.02
-    spread_value = SPREAD_VALUE_STANDARD
-    now = timezone.now()
-    transactions_current_month = Transaction.objects.filter(
-        user_id=request.user.id,
-        visible_to="user",
-        created_at__year=now.year,
-        created_at__month=now.month,
-    )
-    transactions_count = transactions_current_month.count()
+    spread_value = SPREAD_STANDARD
+    transactions_count = transactions_this_month(request.user.profile.id)
     transactions_remaining = request.user.profile.transaction_limit - transactions_count
     if transactions_remaining > 0:
-        spread_value = SPREAD_VALUE_PROMO
+        spread_value = SPREAD_PROMO
 
     if request.method == "POST":
         form = TransferForm(request.user, request.POST)
         if form.is_valid():
             source = form.cleaned_data["source_wallet"]
-            master_wallet_buy = Wallet.objects.filter(
-                user_id="10", wallet_status="active", currency=source.currency
-            )[0]
-            print(master_wallet_buy)
-            destination = form.cleaned_data["destination_wallet"]
-            master_wallet_sell = Wallet.objects.filter(
-                user_id="10", wallet_status="active", currency=destination.currency
-            )[0]
             destination = form.cleaned_data["destination_wallet"]
             amount = form.cleaned_data["amount"]
 
             if source == destination:
                 form.add_error(None, _("Nie możesz przelać środków na to samo konto."))
-            elif source.balance < amount:
-                form.add_error("amount", _("Brak wystarczających środków."))
             elif 0 > amount:
                 form.add_error("amount", _("Nie można wykonać przelewu na ujemną kwotę."))
+            elif settings.TRANSFER_SETTLEMENT == "queued":
+                # checked again when the transfer is settled
+                if source.balance < amount:
+                    form.add_error("amount", _("Brak wystarczających środków."))
+                else:
+                    try:
+                        result, _replayed = run_once(
+                            request.user.profile,
+                            request_key(request, form),
+                            "transfer",
+                            lambda: {
+                                "token": str(
+                                    enqueue(
+                                        request.user.profile,
+                                        source,
+                                        destination,
+                                        amount,
+                                        spread_value,
+                                    ).token
+                                )
+                            },
+                        )
+                    except TransferError as e:
+                        form.add_error(e.field, str(e))
+                    else:
+                        return redirect("transfer_status", token=result["token"])
             else:
-                source_rate = (
-                    ExchangeRate.objects.filter(currency=source.currency)
-                    .order_by("-date")
-                    .first()
-                    .rate
-                )
-                destination_rate = (
-                    ExchangeRate.objects.filter(currency=destination.currency)
-                    .order_by("-date")
-                    .first()
-                    .rate
-                )
-                exchange_rate = (source_rate / destination_rate) * Decimal(
-                    1 - spread_value
-                )
-                converted_amount = amount * Decimal(str(exchange_rate))
-
-                # Balance updates
-                source.balance -= amount
-                master_wallet_buy.balance += amount
-                destination.balance += converted_amount
-                master_wallet_sell.balance -= converted_amount
-                source.save()
-                destination.save()
-                master_wallet_sell.save()
-                master_wallet_buy.save()
-
-                # Save details to DB - visible to user
-                Transaction.objects.create(
-                    user=request.user.profile,
-                    source_iban=source.iban,
-                    from_currency=source.currency,
-                    to_currency=destination.currency,
-                    destination_iban=destination.iban,
-                    amount=amount,
-                    rate=exchange_rate,
-                    result_amount=converted_amount,
-                    visible_to="user",
-                )
-
-                # Save details to DB - user to wallet-master transfer
-                Transaction.objects.create(
-                    user=request.user.profile,
-                    source_iban=source.iban,
-                    from_currency=source.currency,
-                    to_currency=source.currency,
-                    destination_iban=master_wallet_buy.iban,
-                    amount=amount,
-                    rate=Decimal(1),
-                    result_amount=amount,
-                    visible_to="admin-noprofit",
-                )
-
-                # Save details to DB - wallet-master to user transfer
-                Transaction.objects.create(
-                    user=request.user.profile,
-                    source_iban=master_wallet_sell.iban,
-                    from_currency=destination.currency,
-                    to_currency=destination.currency,
-                    destination_iban=destination.iban,
-                    amount=converted_amount,
-                    rate=Decimal(1),
-                    result_amount=converted_amount,
-                    visible_to="admin-noprofit",
-                )
-                # Save details to DB - wallet-master profit (user-source x spread)
-                Transaction.objects.create(
-                    user=request.user.profile,
-                    source_iban=source.iban,
-                    from_currency=destination.currency,
-                    to_currency=destination.currency,
-                    destination_iban=master_wallet_sell.iban,
-                    amount=amount
-                    * Decimal(
-                        str((source_rate / destination_rate) * Decimal(spread_value))
-                    ),
-                    rate=exchange_rate,
-                    result_amount=amount
-                    * Decimal(
-                        str((source_rate / destination_rate) * Decimal(spread_value))
-                    ),
-                    visible_to="admin-profit",
-                )
-
-                return redirect("wallets")
+                try:
+                    run_once(
+                        request.user.profile,
+                        request_key(request, form),
+                        "transfer",
+                        lambda: _entry_result(
+                            execute_transfer(
+                                request.user.profile,
+                                source,
+                                destination,
+                                amount,
+                                spread_value,
+                            )
+                        ),
+                    )
+                except TransferError as e:
+                    form.add_error(e.field, str(e))
+                else:
+                    return redirect("wallets")
     else:
         form = TransferForm(request.user)
 
     return render(request, "backend_brokers/transfer_form.html", {"form": form})
 
 
+def _transfer_request_status(transfer):
+    status = {"status": transfer.status, "error": transfer.error}
+    if transfer.entry_id:
+        status.update(_entry_result(transfer.entry))
+    return status
+
+
+@login_required
+def transfer_status(request, token):
+    transfer = get_object_or_404(
+        TransferRequest.objects.select_related("entry"),
+        token=token,
+        profile=request.user.profile,
+    )
+    return render(
+        request,
+        "backend_brokers/transfer_status.html",
+        {"transfer": transfer, "status": _transfer_request_status(transfer)},
+    )
+
+
+@login_required
+def transfer_status_api(request, token):
+    transfer = get_object_or_404(
+        TransferRequest.objects.select_related("entry"),
+        token=token,
+        profile=request.user.profile,
+    )
+    return JsonResponse(_transfer_request_status(transfer))
+
+
+@login_required
+def wallet_balance_api(request, wallet_id):
+    # balance at the end of ?date=YYYY-MM-DD, for statements and charts
+    wallets = Wallet.objects.all()
+    if not request.user.is_superuser:
+        wallets = wallets.filter(user__user=request.user)
+    wallet = get_object_or_404(wallets, id=wallet_id)
+    try:
+        day = date.fromisoformat(request.GET.get("date", ""))
+        next_day = day + timedelta(days=1)
+    except (ValueError, OverflowError):
+        return JsonResponse({"error": "Invalid date"}, status=400)
+
+    end_of_day = timezone.make_aware(datetime.combine(next_day, time()))
+    return JsonResponse(
+        {
+            "wallet": wallet.id,
+            "currency": wallet.currency,
+            "date": day.isoformat(),
+            "balance": f"{balance_as_of(wallet, end_of_day):.2f}",
+        }
+    )
+
+
+@login_required
+def transfer_queue_stats(request):
+    if not request.user.is_superuser:
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    return JsonResponse(queue_stats())
+
+
 @login_required
 def deposit(request):
     if request.method == "POST":
@@ -368,22 +472,19 @@ def deposit(request):
             wallet = form.cleaned_data["wallet"]
             amount = form.cleaned_data["amount"]
 
-            wallet.balance += amount
-            wallet.save()
-
-            Transaction.objects.create(
-                user=request.user.profile,
-                source_iban=wallet.iban,
-                from_currency=wallet.currency,
-                to_currency=wallet.currency,
-                destination_iban=wallet.iban,
-                amount=amount,
-                rate=Decimal(1),
-                result_amount=amount,
-                visible_to="deposit",
-            )
-
-            return redirect("wallets")
+            try:
+                run_once(
+                    request.user.profile,
+                    request_key(request, form),
+                    "deposit",
+                    lambda: _entry_result(
+                        execute_deposit(request.user.profile, wallet, amount)
+                    ),
+                )
+            except TransferError as e:
+                form.add_error(None, str(e))
+            else:
+                return redirect("wallets")
     else:
         form = DepositForm(request.user)
 
@@ -405,33 +506,29 @@ def stats_dashboard(request):
     transactions_agg_list = []
     profit_agg_list = []
 
+    total_sum = 0
+    total_profit = 0
+
     if user_profile:
-        now = datetime.now()
+        now = timezone.localtime()
         months_range = 12 if request.user.is_superuser else 6
         start_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0) - relativedelta(months=months_range - 1)
 
-        if request.user.is_superuser:
-            trans_qs = (
-                Transaction.objects
-                .filter(visible_to="user", created_at__gte=start_month)
-                .annotate(month=TruncMonth('created_at'))
-                .order_by('month')
-            )
-
-            profit_qs = (
-                Transaction.objects
-                .filter(visible_to="admin-profit", created_at__gte=start_month)
-                .annotate(month=TruncMonth('created_at'))
-                .order_by('month')
+        # one row per month from the monthly rollups, already in PLN at the
+        # rate of each transaction's own day
+        rollups = MonthlyRollup.objects.filter(visible_to="user", month__gte=start_month.date())
+        if not request.user.is_superuser:
+            rollups = rollups.filter(profile=user_profile)
+        trans_rows = (
+            rollups
+            .values('month')
+            .annotate(
+                sent=Sum('amount_pln'),
+                received=Sum('result_amount_pln'),
+                profit=Sum('profit_pln'),
             )
-        else:
-            trans_qs = (
-                Transaction.objects
-                .filter(user=user_profile, visible_to="user", created_at__gte=start_month)
-                .annotate(month=TruncMonth('created_at'))
-                .order_by('month')
-            )
-            profit_qs = []
+            .order_by()
+        )
 
         date_format = '%b %Y'
         month_data = OrderedDict()
@@ -444,56 +541,14 @@ def stats_dashboard(request):
             profit_data[label] = 0.0
             current += relativedelta(months=1)
 
-        for t in trans_qs:
-            month_key = t.month.strftime(date_format)
-
-            amount_to = Decimal(t.result_amount or 0)
-            to_currency = t.to_currency.upper()
-            amount_to_pln = amount_to
-
-            if to_currency != "PLN":
-                rate_to = ExchangeRate.objects.filter(currency=to_currency).order_by('-date').first()
-                if rate_to:
-                    amount_to_pln = amount_to * Decimal(rate_to.rate)
-
-            month_data[month_key] += float(amount_to_pln)
-
-        if request.user.is_superuser:
-            for p in profit_qs:
-                month_key = p.month.strftime(date_format)
-                profit_amount = Decimal(p.amount or 0)
-                currency = p.to_currency.upper()
-
-                if currency != "PLN":
-                    rate = ExchangeRate.objects.filter(currency=currency).order_by('-date').first()
-                    if rate:
-                        profit_amount *= Decimal(rate.rate)
-
-                profit_data[month_key] += float(profit_amount)
-        else:
-            for t in trans_qs:
-                month_key = t.month.strftime(date_format)
-
-                amount_from = Decimal(t.amount or 0)
-                amount_to = Decimal(t.result_amount or 0)
-
-                from_currency = t.from_currency.upper()
-                to_currency = t.to_currency.upper()
-
-                amount_from_pln = amount_from
-                amount_to_pln = amount_to
-
-                if from_currency != "PLN":
-                    rate_from = ExchangeRate.objects.filter(currency=from_currency).order_by('-date').first()
-                    if rate_from:
-                        amount_from_pln = amount_from * Decimal(rate_from.rate)
-
-                if to_currency != "PLN":
-                    rate_to = ExchangeRate.objects.filter(currency=to_currency).order_by('-date').first()
-                    if rate_to:
-                        amount_to_pln = amount_to * Decimal(rate_to.rate)
-
-                profit_data[month_key] += float(amount_to_pln - amount_from_pln)
+        for row in trans_rows:
+            month_key = row['month'].strftime(date_format)
+            month_data[month_key] += float(row['received'])
+            if request.user.is_superuser:
+                # the spread the house earned
+                profit_data[month_key] += float(row['profit'])
+            else:
+                profit_data[month_key] += float(row['received'] - row['sent'])
 
         transactions_agg_list = [
             {'month': datetime.strptime(month, date_format), 'total': total}
@@ -541,24 +596,15 @@ def estimate_exchange(request):
     except:
         return JsonResponse({"error": "Invalid parameters"}, status=400)
 
-    source_rate = ExchangeRate.objects.filter(currency=source_wallet.currency).order_by("-date").first().rate
-    destination_rate = ExchangeRate.objects.filter(currency=destination_wallet.currency).order_by("-date").first().rate
+    transactions_count = transactions_this_month(request.user.profile.id)
 
-    SPREAD_VALUE_PROMO = Decimal("0.01")
-    SPREAD_VALUE_STANDARD = Decimal("0.02")
+    spread_value = SPREAD_PROMO if transactions_count < request.user.profile.transaction_limit else SPREAD_STANDARD
 
-    now = timezone.now()
-    transactions_current_month = Transaction.objects.filter(
-        user_id=request.user.id,
-        visible_to="user",
-        created_at__year=now.year,
-        created_at__month=now.month,
+    _, exchange_rate = get_cross_rates().quote(
+        source_wallet.currency, destination_wallet.currency, spread_value
     )
-    transactions_count = transactions_current_month.count()
-
-    spread_value = SPREAD_VALUE_PROMO if transactions_count < request.user.profile.transaction_limit else SPREAD_VALUE_STANDARD
-
-    exchange_rate = (source_rate / destination_rate) * (Decimal(1) - spread_value)
+    if exchange_rate is None:
+        return JsonResponse({"error": "No exchange rate"}, status=400)
 
     converted_amount = amount * exchange_rate
 
@@ -568,37 +614,73 @@ def estimate_exchange(request):
         "spread": str(spread_value)
     })
 
-def wallet_to_pln(wallet):
+@login_required
+@require_POST
+def batch_transfer(request):
     """
-    Zwraca saldo walletu przeliczone na PLN na podstawie ostatniego dostępnego kursu.
+    Executes a JSON list of transfers for business accounts:
+    {"transfers": [{"source_wallet": id, "destination_wallet": id, "amount": "10.00"}, ...]}
+    A request repeated with the same Idempotency-Key header gets the first response.
     """
-    if wallet.currency == "PLN":
-        return wallet.balance
+    profile = request.user.profile
+    if profile.account_type != "business":
+        return JsonResponse({"error": "Business accounts only"}, status=403)
 
-    rate = ExchangeRate.objects.filter(currency=wallet.currency).order_by("-date").first()
-    if not rate:
-        return Decimal(0)
+    try:
+        items = json.loads(request.body)["transfers"]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_BATCH_SIZE:
+        return JsonResponse(
+            {"error": f"Expected a list of 1 to {MAX_BATCH_SIZE} transfers"},
+            status=400,
+        )
+
+    transactions_count = transactions_this_month(profile.id)
 
     try:
-        return wallet.balance * Decimal(rate.rate)
-    except:
+        result, replayed = run_once(
+            profile,
+            request_key(request),
+            "batch",
+            lambda: {
+                "results": execute_batch(
+                    profile, items, profile.transaction_limit - transactions_count
+                )
+            },
+        )
+    except TransferError as e:
+        return JsonResponse({"error": str(e)}, status=409)
+    response = JsonResponse(result)
+    if replayed:
+        response["Idempotent-Replayed"] = "true"
+    return response
+
+def wallet_to_pln(wallet):
+    """
+    Zwraca saldo walletu przeliczone na PLN na podstawie ostatniego dostępnego kursu.
+    """
+    rate = latest_rate(wallet.currency)
+    if rate is None:
         return Decimal(0)
 
+    return wallet.balance * rate
+
 def total_user_balance_pln(profile):
     """
     Sumuje wszystkie wallety użytkownika i zwraca saldo w PLN.
     """
-    wallets = Wallet.objects.filter(user=profile)
-    return sum(wallet_to_pln(w) for w in wallets)
+    return profile_balances_pln([profile]).get(profile.id, Decimal(0))
 
 def user_transaction_stats(profile):
     """
-    Zwraca tuple: (wszystkie transakcje, transakcje z ostatnich 30 dni)
+    Zwraca tuple: (wszystkie transakcje, transakcje w bieżącym miesiącu),
+    policzone z miesięcznych podsumowań
     """
-    total_tx = Transaction.objects.filter(user=profile).count()
-    last_month = timezone.now() - timedelta(days=30)
-    recent_tx = Transaction.objects.filter(user=profile, created_at__gte=last_month).count()
-    return total_tx, recent_tx
+    counts = MonthlyRollup.objects.filter(profile=profile).aggregate(
+        total=Sum("count"), recent=Sum("count", filter=Q(month=current_month()))
+    )
+    return counts["total"] or 0, counts["recent"] or 0
 
 def generate_user_report(request):
     if not request.user.is_superuser:
@@ -647,9 +729,11 @@ def generate_user_report(request):
     ]
 
     all_profiles = Profile.objects.all()
+    # saldo wszystkich portfeli w PLN, policzone jednym przebiegiem
+    balances = profile_balances_pln()
 
     for profile in all_profiles:
-        total_balance = total_user_balance_pln(profile)
+        total_balance = balances.get(profile.id, Decimal(0))
         total_tx, recent_tx = user_transaction_stats(profile)
 
 
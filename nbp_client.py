@@ -1,24 +1,69 @@
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
 import requests
 
+from apps.backend_brokers.nbp_transport import transport as default_transport
+from apps.backend_brokers.rate_snapshot import load_snapshot, save_snapshot
+
+logger = logging.getLogger(__name__)
+
+# next to this file, where settings.NBP_SNAPSHOT_PATH of the web app points
+SNAPSHOT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "rates_snapshot.json"
+)
+
 
 class NBPClient:
-    def __init__(self):
+    def __init__(self, transport=None, snapshot_path=SNAPSHOT_PATH, background=True):
+        """
+        Starts with the rates stored in *snapshot_path* (if any) and refreshes
+        them from NBP, in a background thread unless *background* is False.
+        """
         self.base_url = "https://api.nbp.pl/api/exchangerates/tables/A/"
-        self.rates = self.get_exchange_rates()
+        self.transport = transport or default_transport
+        self.snapshot_path = snapshot_path
+        self.rates = None
+        self.effective_date = None
+        self.fetched_at = None
+
+        snapshot = load_snapshot(snapshot_path)
+        if snapshot:
+            self.rates = snapshot["rates"]
+            self.effective_date = snapshot["effective_date"]
+            self.fetched_at = snapshot["fetched_at"]
+
+        if background:
+            threading.Thread(target=self.refresh, daemon=True).start()
+        else:
+            self.refresh()
+
+    def refresh(self):
+        """
+        Fetches the current table and, if that worked, replaces the rates
+        and the snapshot file with it.
+        """
+        rates = self.get_exchange_rates()
+        if rates:
+            self.rates = rates
+            self.fetched_at = datetime.now(timezone.utc)
+            save_snapshot(self.snapshot_path, rates, self.effective_date)
+        return rates
 
     def get_exchange_rates(self):
         """
         Fetches current exchange rates from NBP table A and returns them in a dictionary.
         """
         try:
-            response = requests.get(self.base_url)
-            response.raise_for_status()
-            data = response.json()
+            data, _ = self.transport.get_json(self.base_url, conditional=True)
             rates = {rate["code"]: rate["mid"] for rate in data[0]["rates"]}
             rates["PLN"] = 1.0  # Set PLN rate to 1 for easier calculations
+            self.effective_date = data[0]["effectiveDate"]
             return rates
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching exchange rates: {e}")
+        except (requests.exceptions.RequestException, ValueError, LookupError) as e:
+            logger.error("Error fetching exchange rates: %s", e)
             return None
 
     def show_current_rates(self):
@@ -28,7 +73,10 @@ class NBPClient:
         if not self.rates:
             return "Could not fetch exchange rates. Please try again later."
 
-        output = "Current Exchange Rates (as of today):\n"
+        output = f"Current Exchange Rates (as of {self.effective_date}"
+        if self.fetched_at:
+            output += f", fetched {self.fetched_at:%Y-%m-%d %H:%M} UTC"
+        output += "):\n"
         for currency, rate in self.rates.items():
             if currency == "PLN":
                 continue
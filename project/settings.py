@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+from datetime import timedelta
 from pathlib import Path
 from django.utils.translation import gettext_lazy as _
 
@@ -77,6 +79,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "project.wsgi.application"
 
+# Serve async variants of views where they exist (set by project/asgi.py)
+ASYNC_VIEWS = os.environ.get("DJANGO_ASYNC_VIEWS") == "1"
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -146,3 +151,21 @@ LOGIN_URL = "two_factor:login"
 LOGIN_REDIRECT_URL = "/post-login/"
 # LOGOUT_REDIRECT_URL = "/login"
 LOGOUT_REDIRECT_URL = "two_factor:login"
+
+# Exchange rates
+# Table A of the National Bank of Poland, fetched by the refresh_rates command
+
+NBP_API_URL = "https://api.nbp.pl/api/exchangerates/tables/A/"
+# last good table, shared with the command line client (nbp_client.py)
+NBP_SNAPSHOT_PATH = BASE_DIR / "rates_snapshot.json"
+
+# Idempotency keys
+# how long the outcome of a keyed transfer or deposit is kept for replays
+
+IDEMPOTENCY_KEY_RETENTION = timedelta(days=1)
+
+# Transfers
+# "sync" executes a transfer within the request, "queued" stores it for the
+# settle_transfers workers and sends the customer to a status page
+
+TRANSFER_SETTLEMENT = os.environ.get("DJANGO_TRANSFER_SETTLEMENT", "sync")